@@ -1,5 +1,9 @@
+import os
 import sys
 import time
+import uuid
+from collections import defaultdict, deque
+from itertools import islice
 from threading import Thread
 from multiprocessing import Queue
 from queue import Empty
@@ -7,6 +11,21 @@ from queue import Empty
 from paxos.messages import *
 from paxos.protocol import *
 from paxos.analyzer import *
+from paxos.metrics import MetricsRegistry
+from paxos.reconfig import Reconfiguration, MembershipChange, ConfigSchedule
+from paxos.values import PayloadRef
+from paxos.history import DecidedLog
+
+
+def handles(*msg_types):
+    """
+    Decorator that registers an Agent method as the handler for messages of
+    the given types.  See Agent.handle_message.
+    """
+    def decorator(method):
+        method.handled_types = getattr(method, 'handled_types', ()) + msg_types
+        return method
+    return decorator
 
 
 class BaseSystem:
@@ -25,6 +44,8 @@ class Agent:
 
     def __init__(self, pid, mailbox, logger):
         self.config = None
+        # Weights per instance, when weights are changed through consensus.
+        self.schedule = None
         self.pid = pid
         self.mailbox = mailbox
         self.logger = logger
@@ -32,34 +53,154 @@ class Agent:
         self.active = True
         # Flag for any process threads to shutdown.
         self.stopping = False
+        # Seconds to wait for a message before calling handle_timeout, or None
+        # to wait forever.
+        self.timeout = None
+        # Source of timestamps in seconds, replaced by simulators that run on
+        # a virtual clock.
+        self.clock = time.monotonic
+        # Messages sent while handling a message are buffered here, mapping
+        # destination pid to a list of messages, and flushed as one frame per
+        # destination once the handler returns.  None when not buffering.
+        self.outbox = None
+        self.metrics = MetricsRegistry()
+        # Processes whose inboxes the mailbox reported as full, see
+        # handle_backpressure.
+        self.congested = set()
+        # Time of the latest metrics export, see export_metrics.
+        self.metrics_exported_at = None
+        # Records sent, received and dropped messages and decisions if the
+        # configuration has a trace_dir.
+        self.tracer = None
 
-    def run(self):
+    def run(self, config=None):
         """
-        Loop forever, listening for and handling any messages sent to us.
+        Loop forever, listening for and handling any messages sent to us.  If
+        given, config is set before telling the system that we're ready.
         """
+        if config is not None:
+            self.set_config(config)
+        self.mailbox.report_ready(self.pid)
         print("{}-{} started".format(self.pid, self.__class__.__name__))
         while self.active:
-            msg = self.recv()
-            self.handle_message(msg)
+            try:
+                msg = self.recv()
+            except Empty:
+                self.process_timeout()
+                continue
+            self.process_message(msg)
             #self.message_done()
         print("Process {} shutting down".format(self.pid))
 
-    def send_message(self, msg, pids):
+    def process_message(self, msg):
+        """
+        Handle a received message, coalescing all messages sent by the handler
+        into a single frame per destination process.
+        """
+        name = type(msg).__name__
+        self.metrics.count("received." + name)
+        if self.tracer:
+            self.tracer.recv(msg, self.pid)
+        start = time.perf_counter()
+        self.outbox = defaultdict(list)
+        try:
+            self.handle_message(msg)
+        finally:
+            self.flush_messages()
+        self.metrics.observe("handler." + name, time.perf_counter() - start)
+        self.check_metrics_export()
+
+    def process_timeout(self):
+        """
+        Call handle_timeout, coalescing the messages it sends like
+        process_message does.
+        """
+        self.outbox = defaultdict(list)
+        try:
+            self.handle_timeout()
+        finally:
+            self.flush_messages()
+        self.check_metrics_export()
+
+    def handle_timeout(self):
+        """
+        Called when no message arrived within self.timeout seconds.  Meant to
+        be overridden in subclasses that need to act on timeouts.
+        """
+
+    def send_message(self, msg, pids, immediate=False):
+        """
+        Send msg to each process in pids.  While a message is being handled,
+        the sent messages are buffered until the handler returns or until a
+        destination's buffer reaches the configured max_batch_size.  Pass
+        immediate=True to bypass the buffer, e.g. when sending from a helper
+        thread.
+        """
+        self.metrics.count("sent." + type(msg).__name__, len(pids))
+        if self.tracer:
+            for pid in pids:
+                self.tracer.send(msg, self.pid, pid)
         for pid in pids:
             print("Process {}-{} sending message to {}: {}".format(
                   self.pid, self.__class__.__name__, pid, msg))
-            self.mailbox.send(pid, msg)
+        if immediate or self.outbox is None:
+            self.mailbox.broadcast(msg, pids)
+            return
+        for pid in pids:
+            batch = self.outbox[pid]
+            batch.append(msg)
+            if self.config is None or len(batch) >= self.config.max_batch_size:
+                self.mailbox.send_batch(pid, batch)
+                self.outbox[pid] = []
+
+    def flush_messages(self):
+        """
+        Send any buffered messages, one frame per destination, and stop
+        buffering.
+        """
+        outbox, self.outbox = self.outbox, None
+        if outbox:
+            self.mailbox.send_batches(outbox)
 
     def recv(self):
         """
-        Blocking receive of a message destined to this agent process.
+        Blocking receive of a message destined to this agent process.  Raises
+        queue.Empty if no message arrived within self.timeout seconds.
         """
-        msg = self.mailbox.recv(self.pid)
+        msg = self.mailbox.recv(self.pid, self.timeout)
         source = getattr(msg, 'source', None)
         print("  Process {}-{} received message from {}: {}".format(
               self.pid, self.__class__.__name__, source, msg))
         return msg
 
+    def check_metrics_export(self):
+        """
+        Export the metrics if the configured metrics_interval has passed
+        since the last export.
+        """
+        interval = self.config and self.config.metrics_interval
+        if not interval:
+            return
+        now = self.clock()
+        if self.metrics_exported_at is None or \
+                now - self.metrics_exported_at >= interval:
+            self.metrics_exported_at = now
+            self.export_metrics()
+
+    def export_metrics(self):
+        """
+        Update the gauges and hand a snapshot of the metrics to the mailbox.
+        """
+        self.update_gauges()
+        self.mailbox.export_metrics(self.pid, self.metrics.snapshot())
+
+    def update_gauges(self):
+        """
+        Set gauges that are sampled rather than updated as things happen.
+        Subclasses may extend this to add their own.
+        """
+        self.metrics.gauge("inbox_depth", self.mailbox.depth(self.pid))
+
     def message_done(self):
         """
         Signal to the mailbox that we've finished processing of the message.
@@ -67,24 +208,131 @@ class Agent:
         """
         self.mailbox.task_done(self.pid)
 
+    @classmethod
+    def get_handlers(cls):
+        """
+        Return the dict mapping message type to handler method name for this
+        class.  The table is built once per class from the methods registered
+        with the ``handles`` decorator on the class and its bases, with
+        subclass registrations taking precedence.  Handlers are looked up by
+        name, so a subclass may override a handler without registering it
+        again.
+        """
+        handlers = cls.__dict__.get('_handlers')
+        if handlers is None:
+            handlers = {}
+            for klass in reversed(cls.__mro__):
+                for name, attr in vars(klass).items():
+                    for msg_type in getattr(attr, 'handled_types', ()):
+                        handlers[msg_type] = name
+            cls._handlers = handlers
+        return handlers
+
+    @classmethod
+    def resolve_handler(cls, msg_type):
+        """
+        Return the handler method name for a message type that has no handler
+        registered for it directly, using the handler of its nearest
+        registered base class (or None), and cache the result.
+        """
+        handlers = cls.get_handlers()
+        name = None
+        for base in msg_type.__mro__[1:]:
+            if base in handlers:
+                name = handlers[base]
+                break
+        handlers[msg_type] = name
+        return name
+
     def handle_message(self, msg):
         """
-        Handle a received message.  Meant to be overridden in subclasses for
-        customizing agent's behavior.
+        Handle a received message by dispatching it to the handler registered
+        for its type.  Messages without a handler are ignored.
         """
-        if isinstance(msg, SystemConfig):
-            self.set_config(msg)
-        if msg == 'quit':
-            self.handle_quit()
+        try:
+            name = self.get_handlers()[type(msg)]
+        except KeyError:
+            name = self.resolve_handler(type(msg))
+        if name is not None:
+            getattr(self, name)(msg)
 
     def set_config(self, config):
         self.config = config
+        if config.metrics_interval:
+            # Wake up to export metrics while idle.
+            self.timeout = config.metrics_interval
+        if config.trace_dir and self.tracer is None:
+            self.start_trace(config.trace_dir)
+        if config.reconfiguration_window:
+            self.schedule = ConfigSchedule(config.weights, config.total_weight,
+                                           config.learner_ids,
+                                           config.reconfiguration_window)
+
+    def start_trace(self, trace_dir, name=None):
+        """
+        Start recording a trace to this process's file in trace_dir, named
+        after name (by default, our pid).  The mailbox also records the
+        messages it drops for this process with our recorder, unless it has
+        one of its own.
+        """
+        # paxos.trace imports this package, so importing it at module level
+        # here would load it before "python -m paxos.trace" runs it, which
+        # runpy warns about.  Modules that the package doesn't import, like
+        # paxos.sim, import it at module level.
+        from paxos.trace import TraceRecorder
+        if self.clock is time.monotonic:
+            clock = time.monotonic_ns
+        else:
+            clock = lambda: int(self.clock() * 1e9)
+        if name is None:
+            name = self.pid
+        self.tracer = TraceRecorder.for_process(trace_dir, name, clock)
+        if self.mailbox.tracer is None:
+            self.mailbox.tracer = self.tracer
+
+    def trace_decision(self, instance, number=-1):
+        if self.tracer:
+            self.tracer.decide(self.pid, instance, number)
+
+    def get_weights(self, instance):
+        """
+        Return the (weights, total weight) pair used to count acceptor quorums
+        in the given instance.
+        """
+        if self.schedule:
+            return self.schedule.weights_for(instance)
+        return self.config.weights, self.config.total_weight
+
+    def get_members(self, instance):
+        """
+        Return the (acceptor ids, learner ids) pair of the given instance.
+        """
+        if self.schedule:
+            return self.schedule.members_for(instance)
+        return self.config.acceptor_ids, self.config.learner_ids
 
     def stop(self):
         """Stop any helper threads."""
         self.stopping = True
 
-    def handle_quit(self):
+    @handles(BackpressureMsg)
+    def handle_backpressure(self, msg):
+        """
+        Keep track of congested processes.  Only proposers act on it, by not
+        starting new instances while any process is congested.
+        """
+        if msg.congested:
+            self.congested.add(msg.source)
+        else:
+            self.congested.discard(msg.source)
+        self.metrics.gauge("congested_processes", len(self.congested))
+
+    @handles(QuitMsg)
+    def handle_quit(self, msg=None):
+        if self.config and self.config.metrics_interval:
+            self.export_metrics()
+        if self.tracer:
+            self.tracer.close()
         self.stop()
         self.mailbox.shutdown()
         self.active = False
@@ -107,7 +355,14 @@ class Proposer(Agent):
         # This will itself contain dictionaries of states for the rounds of
         # each proposal tried during an instance.
         self.instances = {}
-        self.instance_sequence = 1
+        # Next instance number in the sequence of each consensus group.
+        self.instance_sequences = {}
+
+        # Used with consensus ordered reconfiguration: client requests waiting
+        # for the reconfiguration window to open, and the time of the latest
+        # attempt in each instance that hasn't been decided.
+        self.pending_requests = deque()
+        self.last_attempt = {}
 
     def set_config(self, config):
         """
@@ -124,53 +379,140 @@ class Proposer(Agent):
         # instantiate analyzer if dynamic weights enabled after configuration
         self.analyzer = None
         if config.dynamic_weights:
-            self.analyzer = Analyzer(config.acceptor_ids)
+            self.analyzer = config.analyzer_class(
+                config.acceptor_ids, loss_timeout=2 * config.message_timeout,
+                clock=self.clock)
+        # Wake up periodically to retry instances that stall the
+        # reconfiguration window.
+        if self.schedule:
+            self.timeout = config.message_timeout
 
-    def handle_message(self, msg):
-        super(Proposer, self).handle_message(msg)
-        if isinstance(msg, ClientRequestMsg):
-            self.handle_client_request(msg)
-        elif isinstance(msg, PrepareResponseMsg):
-            self.handle_prepare_response(msg)
-        elif isinstance(msg, AcceptResponseMsg):
-            self.handle_accept_response(msg)
+    def next_instance(self, group=0):
+        """
+        Return the log position of the next instance of group's sequence.
+        """
+        return self.config.log_position(group,
+                                        self.instance_sequences.get(group, 1))
 
-    def create_proposal(self, instance=None):
+    def create_proposal(self, instance=None, group=0):
         """
         Create a new proposal using this process's current proposal number
-        sequence and instance number sequence.  If instance is given, then
-        use it as the instance number instead of using this process's current
-        instance sequence number.
+        sequence and the instance number sequence of group.  If instance is
+        given, then use it as the instance number instead of using this
+        process's current instance sequence number.
         """
         if instance:
             instance_sequence = instance
+            group = self.config.group_of(instance)
         else:
-            instance_sequence = self.instance_sequence
+            instance_sequence = self.next_instance(group)
         print("*** Process {} creating proposal with Number {}, Instance {}"
               .format(self.pid, self.sequence, instance_sequence))
-        proposal = Proposal(self.sequence, instance_sequence, self.pid)
+        proposal = Proposal(self.sequence, instance_sequence, self.pid,
+                            group=group)
         self.sequence += self.sequence_step
         # Only increment the instance sequence if we weren't given one.
         if instance is None:
-            self.instance_sequence += 1
+            self.instance_sequences[group] = \
+                    self.instance_sequences.get(group, 1) + 1
         return proposal
 
+    @handles(ClientRequestMsg)
     def handle_client_request(self, msg, instance=None):
         """
         Start a Paxos instance.
         """
-        proposal = self.create_proposal(instance)
+        if instance is None and not self.window_open():
+            self.pending_requests.append(msg)
+            self.retry_stalled_instance()
+            return
+        proposal = self.create_proposal(instance, getattr(msg, "group", 0))
+        if self.schedule:
+            self.last_attempt[proposal.instance] = self.clock()
         if proposal.instance not in self.instances:
             self.instances[proposal.instance] = {}
+            self.metrics.count("instances_started")
         if proposal.number not in self.instances[proposal.instance]:
             self.instances[proposal.instance][proposal.number] = \
                     BasicPaxosProposerProtocol(self, proposal)
         self.instances[proposal.instance][proposal.number].request = msg.value
         self.instances[proposal.instance][proposal.number].handle_client_request(proposal)
 
+    def window_open(self):
+        """
+        Return True if a new instance may be started, i.e. no process is
+        congested and its weights are known.  Weights are always known unless
+        they are changed through consensus.
+        """
+        if self.congested:
+            return False
+        return (self.schedule is None or
+                self.schedule.known(self.next_instance()))
+
+    def handle_timeout(self):
+        if self.pending_requests:
+            self.retry_stalled_instance()
+
+    def retry_stalled_instance(self):
+        """
+        Re-propose the original request in the first undecided instance if it
+        is holding back the reconfiguration window and its latest attempt is
+        older than two message timeouts.
+        """
+        if not self.schedule:
+            return
+        instance = self.schedule.first_undecided
+        last_attempt = self.last_attempt.get(instance)
+        if last_attempt is None or \
+                self.clock() - last_attempt < 2 * self.config.message_timeout:
+            return
+        request = next(iter(self.instances[instance].values())).request
+        self.metrics.count("retries")
+        self.handle_client_request(ClientRequestMsg(self.pid, request), instance)
+
+    def record_decision(self, instance, value):
+        """
+        Called when a proposal of this proposer has been accepted by a quorum.
+        Start any client requests that were waiting for the window to open.
+        """
+        if not self.schedule:
+            return
+        self.schedule.record(instance, value)
+        self.last_attempt.pop(instance, None)
+        if isinstance(value, MembershipChange) and self.analyzer:
+            acceptor_ids, _ = self.schedule.latest_members()
+            self.analyzer.set_acceptors(acceptor_ids)
+        self.start_pending_requests()
+
+    def start_pending_requests(self):
+        """
+        Start client requests that were waiting for the window to open.
+        """
+        while self.pending_requests and self.window_open():
+            self.handle_client_request(self.pending_requests.popleft())
+
+    def handle_backpressure(self, msg):
+        super(Proposer, self).handle_backpressure(msg)
+        self.start_pending_requests()
+
+    def update_gauges(self):
+        super(Proposer, self).update_gauges()
+        self.metrics.gauge("instances_in_flight",
+                           self.metrics.counters.get("instances_started", 0) -
+                           self.metrics.counters.get("instances_decided", 0))
+
+    def propose_reconfiguration(self, weights):
+        """
+        Propose changing the acceptor weights through consensus.
+        """
+        msg = ClientRequestMsg(self.pid, Reconfiguration(weights))
+        self.handle_client_request(msg)
+
+    @handles(PrepareResponseMsg)
     def handle_prepare_response(self, msg):
         self.instances[msg.proposal.instance][msg.proposal.number].handle_prepare_response(msg)
 
+    @handles(AcceptResponseMsg)
     def handle_accept_response(self, msg):
         self.instances[msg.proposal.instance][msg.proposal.number].handle_accept_response(msg)
 
@@ -190,35 +532,128 @@ class Acceptor(Agent):
             self.instances[instance_id] = BasicPaxosAcceptorProtocol(self)
         return self.instances[instance_id]
 
-    def handle_message(self, msg):
-        super(Acceptor, self).handle_message(msg)
-        if isinstance(msg, PrepareMsg):
-            self.handle_prepare(msg)
-        if isinstance(msg, AcceptMsg):
-            self.handle_accept(msg)
-
+    @handles(PrepareMsg)
     def handle_prepare(self, msg):
-        self.create_instance(msg.proposal.instance).handle_prepare(msg)
+        self.handle_with_check(msg, "handle_prepare")
 
+    @handles(AcceptMsg)
     def handle_accept(self, msg):
-        self.create_instance(msg.proposal.instance).handle_accept(msg)
+        self.handle_with_check(msg, "handle_accept")
+
+    def handle_with_check(self, msg, handler_name):
+        """
+        Handle msg with the named handler of its instance's protocol and, if
+        the configuration asks for acceptor checks, report the instance's
+        promised and accepted numbers to the logger when they change.
+        """
+        instance = msg.proposal.instance
+        protocol = self.create_instance(instance)
+        handler = getattr(protocol, handler_name)
+        if not self.config.check_acceptors:
+            handler(msg)
+            return
+        before = (protocol.highest_proposal_promised.number,
+                  protocol.highest_proposal_accepted.number)
+        handler(msg)
+        after = (protocol.highest_proposal_promised.number,
+                 protocol.highest_proposal_accepted.number)
+        if after != before:
+            self.logger.log_acceptor_state(self.pid, instance, *after)
 
 
 class Learner(Agent):
 
+    # Maximum number of values sent in one catch-up response.  A learner
+    # catching up from far behind gets several responses, so neither side
+    # holds all the values it's missing at once.
+    catchup_chunk_size = 1000
+    # Number of message timeouts a learner may wait before it acts on a
+    # value it's missing, e.g. by asking for it again, see
+    # sim.System.shutdown_agents.
+    retry_delay = 1
+
     def __init__(self, *args, **kwargs):
         super(Learner, self).__init__(*args, **kwargs)
         self.instances = {}
         # Results stored by instance number.
         self.results = {}
+        # Protocol instances that reached a possible quorum before their
+        # weights were known, mapped to the last accept response.
+        self.deferred = {}
+        self.deferred_checked_at = None
+        # First unknown instance at the time of our latest catchup request,
+        # and the number of requests made for it.
+        self.catchup_requested_at = None
+        self.catchup_attempts = 0
+        # Payloads of split values, by PayloadRef, and the number of payloads
+        # received for each reference less the decisions on it (negative if
+        # decisions were learned from other learners first).  Then the
+        # instances decided on references whose payload hasn't arrived yet,
+        # the time the oldest of them started waiting, and the time of our
+        # latest request for their values.
+        self.payloads = {}
+        self.payload_counts = defaultdict(int)
+        self.awaiting_payload = defaultdict(list)
+        self.awaiting_since = None
+        self.payloads_requested_at = None
+        # Persistent log of decided values, replacing results if configured.
+        self.decided_log = None
+        # Every instance below decided_below has been learned, and the values
+        # of those below truncated_below have been forgotten.
+        self.decided_below = 1
+        self.truncated_below = 1
 
-    def handle_message(self, msg):
-        super(Learner, self).handle_message(msg)
-        if isinstance(msg, AcceptResponseMsg):
-            self.handle_accept_response(msg)
-        elif isinstance(msg, AdjustWeightsMsg):
-            self.handle_adjust_weights(msg)
+    def set_config(self, config):
+        super(Learner, self).set_config(config)
+        if config.decided_log_dir and self.decided_log is None:
+            self.decided_log = DecidedLog(os.path.join(
+                config.decided_log_dir, config.run_id,
+                "learner-{}".format(self.pid)))
+            self.results = self.decided_log
+        if self.schedule or config.payload_split:
+            # Wake up periodically to fetch values that hold back deferred
+            # instances, or whose payloads we never received.
+            self.timeout = config.message_timeout
+        if self.pid not in config.learner_ids:
+            # We joined a running system, so fetch the values decided so far.
+            self.request_catchup()
+
+    def request_catchup(self):
+        """
+        Ask the other learners for the values decided from our first unknown
+        instance onwards.
+        """
+        instance = self.schedule.first_undecided if self.schedule else 1
+        if instance != self.catchup_requested_at:
+            self.catchup_requested_at = instance
+            self.catchup_attempts = 0
+        self.catchup_attempts += 1
+        self.send_message(CatchupRequestMsg(self.pid, instance),
+                          self.peer_learners())
+
+    def peer_learners(self):
+        """
+        Return the pids of the other learners, sorted.
+        """
+        learner_ids = set(self.config.learner_ids)
+        if self.schedule:
+            learner_ids.update(self.schedule.latest_members()[1])
+        learner_ids.discard(self.pid)
+        return sorted(learner_ids)
+
+    def handle_quit(self, msg=None):
+        if self.decided_log is not None:
+            self.decided_log.close()
+        super(Learner, self).handle_quit(msg)
 
+    def handle_timeout(self):
+        # Give up after a few attempts, in case no learner knows the values,
+        # so that an idle system stays idle.
+        if self.deferred and self.catchup_attempts < 3:
+            self.request_catchup()
+        self.check_awaiting_payloads()
+
+    @handles(AcceptResponseMsg)
     def handle_accept_response(self, msg):
         number = msg.proposal.number
         instance_id = msg.proposal.instance
@@ -227,17 +662,185 @@ class Learner(Agent):
         if number not in self.instances[instance_id]:
             self.instances[instance_id][number] = BasicPaxosLearnerProtocol(self)
         self.instances[instance_id][number].handle_accept_response(msg)
+        self.check_deferred()
+
+    def defer(self, protocol, msg):
+        """
+        Hold a protocol instance until the weights of its instance are known,
+        asking the other learners for the missing values unless we already
+        did since the last progress.
+        """
+        self.deferred[protocol] = msg
+        if self.catchup_requested_at != self.schedule.first_undecided:
+            self.request_catchup()
 
+    def check_deferred(self):
+        """
+        Check deferred protocol instances for a quorum again if more
+        instances have been decided since they were deferred.
+        """
+        while self.deferred and \
+                self.deferred_checked_at != self.schedule.first_undecided:
+            self.deferred_checked_at = self.schedule.first_undecided
+            deferred, self.deferred = self.deferred, {}
+            for protocol, msg in deferred.items():
+                protocol.check(msg)
+
+    @handles(AdjustWeightsMsg)
     def handle_adjust_weights(self, msg):
         self.config.weights = msg.weights
 
+    @handles(CatchupRequestMsg)
+    def handle_catchup_request(self, msg):
+        """
+        Send the values we know of from the requested instance onwards, in
+        responses of at most catchup_chunk_size values.  Each response is
+        sent as it's filled, rather than buffered with the others.
+        """
+        decided = iter(self.decided_from(msg.instance))
+        while True:
+            results = dict(islice(decided, self.catchup_chunk_size))
+            if not results:
+                break
+            self.send_message(CatchupResponseMsg(self.pid, results),
+                              [msg.source], immediate=True)
+
+    def decided_from(self, instance):
+        """
+        Return (instance, value) pairs of the values we know of from instance
+        onwards, in instance order, read from the decided log if we have one.
+        """
+        if self.decided_log is not None:
+            return self.decided_log.scan(instance)
+        return ((i, self.results[i]) for i in sorted(self.results)
+                if i >= instance)
+
+    @handles(CatchupResponseMsg)
+    def handle_catchup_response(self, msg):
+        learned = set()
+        for instance in sorted(msg.results):
+            if instance not in self.results:
+                self.learn(instance, msg.results[instance])
+                learned.add(instance)
+        if learned and self.awaiting_payload:
+            # Their payloads are no longer needed.
+            for ref, instances in list(self.awaiting_payload.items()):
+                remaining = [i for i in instances if i not in learned]
+                for _ in range(len(instances) - len(remaining)):
+                    self.use_payload(ref)
+                if remaining:
+                    self.awaiting_payload[ref] = remaining
+                else:
+                    del self.awaiting_payload[ref]
+            if not self.awaiting_payload:
+                self.awaiting_since = None
+        if self.schedule:
+            self.check_deferred()
+
     def record_result(self, instance, value):
         self.results[instance] = value
+        while self.decided_below in self.results:
+            self.decided_below += 1
+        if self.schedule:
+            self.schedule.record(instance, value)
+        if self.config.retain_instances is not None:
+            self.truncate_results(self.truncation_point() -
+                                  self.config.retain_instances)
+
+    def truncation_point(self):
+        """
+        Return the instance below which every value is decided and may be
+        forgotten, apart from the configured number of instances retained
+        for catch-up.
+        """
+        return self.decided_below
+
+    def truncate_results(self, instance):
+        """
+        Forget the values decided below instance.  They can no longer be sent
+        to learners that catch up.  A decided log discards them in steps of
+        retain_instances, since each discard records its new base on disk,
+        so it keeps up to twice that many.
+        """
+        if self.decided_log is not None:
+            step = max(self.config.retain_instances or 0, 1)
+            if instance >= self.truncated_below + step:
+                self.decided_log.discard_below(instance)
+                self.truncated_below = instance
+            return
+        for i in range(self.truncated_below, instance):
+            self.results.pop(i, None)
+        self.truncated_below = max(self.truncated_below, instance)
 
     def log_result(self, msg):
-        instance = msg.proposal.instance
-        value = msg.proposal.value
+        instance, value = msg.proposal.instance, msg.proposal.value
+        if isinstance(value, PayloadRef):
+            if value not in self.payloads:
+                # Learn the value once its payload arrives, or from the other
+                # learners if it doesn't.
+                if not self.awaiting_payload:
+                    self.awaiting_since = self.clock()
+                self.awaiting_payload[value].append(instance)
+                self.check_awaiting_payloads()
+                return
+            ref, value = value, self.payloads[value]
+            self.use_payload(ref)
+        self.learn(instance, value)
+
+    @handles(PayloadMsg)
+    def handle_payload(self, msg):
+        self.payload_counts[msg.ref] += 1
+        if self.payload_counts[msg.ref] <= 0:
+            # Its decision was already learned from another learner.
+            if not self.payload_counts[msg.ref]:
+                del self.payload_counts[msg.ref]
+            return
+        self.payloads[msg.ref] = msg.value
+        for instance in self.awaiting_payload.pop(msg.ref, ()):
+            self.use_payload(msg.ref)
+            self.learn(instance, msg.value)
+        if not self.awaiting_payload:
+            self.awaiting_since = None
+
+    def use_payload(self, ref):
+        """
+        Count a decision on ref, forgetting its payload once there's a
+        decision for every payload received.  A later decision on ref, as
+        when a request was proposed again, is learned from the other
+        learners.
+        """
+        self.payload_counts[ref] -= 1
+        if self.payload_counts[ref] <= 0:
+            self.payloads.pop(ref, None)
+            if not self.payload_counts[ref]:
+                del self.payload_counts[ref]
+
+    def check_awaiting_payloads(self):
+        """
+        Ask the other learners for the values of decided instances whose
+        payloads didn't arrive within a message timeout, as for requests
+        submitted before we joined, unless we just did.
+        """
+        if not self.awaiting_payload:
+            return
+        now = self.clock()
+        timeout = self.config.message_timeout
+        if now - self.awaiting_since < timeout or \
+                self.payloads_requested_at is not None and \
+                now - self.payloads_requested_at < timeout:
+            return
+        self.payloads_requested_at = now
+        instance = min(min(instances)
+                       for instances in self.awaiting_payload.values())
+        self.send_message(CatchupRequestMsg(self.pid, instance),
+                          self.peer_learners())
+
+    def learn(self, instance, value):
+        """
+        Record and log the value decided in instance.
+        """
         self.record_result(instance, value)
+        self.trace_decision(instance)
         print("*** {} logging result for instance {}: {}".format(self.pid, instance, value))
         self.logger.log_result(self.pid, instance, value)
 
@@ -253,13 +856,34 @@ class SystemConfig:
                  proposer_sequence_start=None,
                  proposer_sequence_step=None,
                  message_timeout=0.5,
+                 max_batch_size=32,
+                 reconfiguration_window=None,
+                 num_spare=0,
                  num_test_requests=0,
                  weights=None,
                  dynamic_weights=False,
+                 analyzer_class=Analyzer,
                  debug_messages=False,
+                 metrics_interval=None,
+                 inbox_size=None,
+                 overflow_policy="block",
+                 high_watermark=0.8,
+                 trace_dir=None,
+                 check_acceptors=False,
+                 check_window=None,
+                 start_method=None,
+                 value_threshold=None,
+                 value_dir=None,
+                 payload_split=False,
+                 num_groups=1,
+                 acceptor_workers=None,
+                 decided_log_dir=None,
+                 retain_instances=None,
+                 run_id=None,
                  ):
         self.agent_config = (num_proposers, num_acceptors, num_learners)
-        self.num_processes = sum([num_proposers, num_acceptors, num_learners])
+        self.num_processes = sum([num_proposers, num_acceptors, num_learners,
+                                  num_spare])
         self.proposer_class = proposer_class
         self.acceptor_class = acceptor_class
         self.learner_class = learner_class
@@ -270,10 +894,19 @@ class SystemConfig:
         self.acceptor_ids = list(range(counter, counter + num_acceptors))
         counter += num_acceptors
         self.learner_ids = list(range(counter, counter + num_learners))
+        counter += num_learners
+        # Process ids reserved for agents that join the system at runtime.
+        self.spare_ids = list(range(counter, counter + num_spare))
 
         self.proposer_sequence_start = proposer_sequence_start
         self.proposer_sequence_step = proposer_sequence_step
         self.message_timeout = message_timeout
+        # Maximum number of messages coalesced into one frame per destination
+        # before an agent flushes its outbound buffer.
+        self.max_batch_size = max_batch_size
+        # If set, weight changes are proposed through consensus and take
+        # effect this many instances after the one they were chosen in.
+        self.reconfiguration_window = reconfiguration_window
         self.num_test_requests = num_test_requests
 
         # configure weights based on static/dynamic setting
@@ -282,16 +915,98 @@ class SystemConfig:
         else:
             self.config_dynamic_weights(num_acceptors)
         self.dynamic_weights = dynamic_weights
+        # Analyzer class used by proposers to derive dynamic weights.
+        self.analyzer_class = analyzer_class
 
         # The following used by DebugMailbox.
         # If True, each process will record who they sent messages to.
         self.debug_messages = debug_messages
+        # If set, agents export a snapshot of their metrics this often, in
+        # seconds.
+        self.metrics_interval = metrics_interval
+        # Maximum number of messages waiting in an agent's inbox, or None for
+        # no limit, and what to do when it is reached: "block",
+        # "drop_oldest" or "signal" (see sim.Mailbox).  An alert is printed
+        # when an inbox reaches high_watermark of its size.
+        assert overflow_policy in ("block", "drop_oldest", "signal")
+        self.inbox_size = inbox_size
+        self.overflow_policy = overflow_policy
+        self.high_watermark = high_watermark
+        # If set, agents record a trace of their messages to files in this
+        # directory (see paxos.trace).
+        self.trace_dir = trace_dir
+        # If True, acceptors report their promised and accepted numbers to
+        # the logger, which checks them.  If check_window is set, the logger
+        # forgets instances that many instances after all learners decided
+        # them (see results.SafetyChecker).
+        self.check_acceptors = check_acceptors
+        self.check_window = check_window
+        # Multiprocessing start method of agent processes: "fork",
+        # "forkserver" or "spawn", or None for the platform's default.
+        self.start_method = start_method
+        # If set, submitted values of at least this many bytes are stored
+        # once in value_dir (by default a temporary directory) and proposed
+        # as handles (see paxos.values).
+        self.value_threshold = value_threshold
+        self.value_dir = value_dir
+        # If True, submitted values are sent to the learners directly and
+        # Paxos orders references to them (see paxos.values).
+        self.payload_split = payload_split
+        # Number of consensus groups that order client requests independently
+        # (see paxos.groups).  Group g is led by proposer g modulo the number
+        # of proposers.
+        assert num_groups == 1 or not reconfiguration_window, \
+                "Consensus groups don't support reconfiguration"
+        self.num_groups = num_groups
+        # Number of worker processes of each parallel.ParallelAcceptor, or
+        # None for the class's default_workers.
+        self.acceptor_workers = acceptor_workers
+        # If set, learners append decided values to a history.DecidedLog in
+        # a subdirectory of this directory named after run_id, and serve
+        # catch-up from it.  The run_id is unique to this configuration
+        # unless given, so a new run doesn't recover the decisions of an
+        # earlier one; pass the earlier run's run_id to recover them.
+        self.decided_log_dir = decided_log_dir
+        self.run_id = run_id or "run-{}".format(uuid.uuid4().hex[:12])
+        # If set, learners forget the values of instances more than this
+        # many instances below the first one they haven't learned, so a
+        # learner that catches up only gets the values of later instances.
+        self.retain_instances = retain_instances
 
     def __str__(self):
         return "System Configuration: {}-{}-{}".format(self.proposer_ids,
                                                        self.acceptor_ids,
                                                        self.learner_ids)
 
+    def log_position(self, group, number):
+        """
+        Return the log position of instance number of group's sequence.
+        """
+        return (number - 1) * self.num_groups + group + 1
+
+    def group_of(self, instance):
+        """
+        Return the group whose sequence log position instance belongs to.
+        """
+        return (instance - 1) % self.num_groups
+
+    def acceptor_partitions(self):
+        """
+        Return the number of worker processes, each with its own inbox, that
+        acceptors spread their instances over, or None if the acceptor class
+        doesn't (see parallel.ParallelAcceptor).
+        """
+        default = getattr(self.acceptor_class, "default_workers", None)
+        if default is None:
+            return None
+        return self.acceptor_workers or default
+
+    def group_leader(self, group):
+        """
+        Return the pid of the proposer that leads group.
+        """
+        return self.proposer_ids[group % len(self.proposer_ids)]
+
     def process_list(self):
         """
         Return a list of (pid, agent class) two-tuples that get used by
@@ -322,3 +1037,8 @@ class SystemConfig:
         for pid in self.acceptor_ids:
             self.weights[pid] = weight
         self.total_weight = 1.0
+
+
+# SystemConfig is defined after the agent classes that it refers to, so its
+# handler is registered here.
+handles(SystemConfig)(Agent.set_config)
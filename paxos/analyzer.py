@@ -1,100 +1,359 @@
-import copy
+from collections import deque, OrderedDict
+import time
+
 
 class Analyzer:
-    def __init__(self, acceptor_ids, factor=0.05):
+    """
+    Estimates how reliable and how fast each acceptor is from the messages a
+    proposer exchanges with it, and derives acceptor weights from those
+    estimates.
+
+    Both estimates are exponentially weighted moving averages, so recent
+    behavior dominates: an acceptor that recovers from a transient fault
+    regains its weight instead of being penalized forever.
+    """
+
+    def __init__(self, acceptor_ids, alpha=0.1, loss_timeout=1.0,
+                 threshold=0.05, ceiling=0.5, clock=time.monotonic):
+        """
+        ``alpha`` is the smoothing factor of the moving averages,
+        ``loss_timeout`` the number of seconds after which an unanswered
+        message counts as lost, and ``threshold`` the smallest change in any
+        acceptor's weight that gets published.  No acceptor is given more
+        than ``ceiling`` of the total weight, so that a single acceptor can
+        never form a quorum on its own.
+        """
         self.weight_changed = False
         self.acceptor_ids = acceptor_ids
-        self.factor=factor
+        self.alpha = alpha
+        self.loss_timeout = loss_timeout
+        self.threshold = threshold
+        self.ceiling = ceiling
+        self.clock = clock
         self.num_acceptors = len(acceptor_ids)
         self.nominal = 1 / self.num_acceptors
-        #self.ceiling = (int(self.num_acceptors/3)+1) * self.nominal
-        self.ceiling = 1/2
 
         self.weights = {}
-        self.msgs_sent = {}
-        self.msgs_recvd = {}
-        self.msg_ratios = {}
-        self.thresholds = {}
+        # Moving average of the fraction of messages answered.
+        self.reliability = {}
+        # Moving average of the round trip time in seconds, None until the
+        # first response has been seen.
+        self.latency = {}
         for pid in acceptor_ids:
             self.weights[pid] = self.nominal
-            self.msgs_sent[pid] = 0
-            self.msgs_recvd[pid] = 0
-            self.msg_ratios[pid] = 0
-            self.thresholds[pid] = round(1-self.factor,2)
+            self.reliability[pid] = 1.0
+            self.latency[pid] = None
+        # Messages awaiting a response, mapping (pid, key) to the send time,
+        # oldest first, so that expiring them only looks at the front.
+        self.outstanding = OrderedDict()
+
+    def set_acceptors(self, acceptor_ids):
+        """
+        Start tracking acceptors that joined and stop tracking those that
+        left.  New acceptors start with the nominal weight.
+        """
+        self.acceptor_ids = list(acceptor_ids)
+        self.num_acceptors = len(acceptor_ids)
+        self.nominal = 1 / self.num_acceptors
+        for pid in list(self.weights):
+            if pid not in acceptor_ids:
+                del self.weights[pid]
+                del self.reliability[pid]
+                del self.latency[pid]
+        for pid, key in list(self.outstanding):
+            if pid not in acceptor_ids:
+                del self.outstanding[(pid, key)]
+        for pid in acceptor_ids:
+            if pid not in self.weights:
+                self.weights[pid] = self.nominal
+                self.reliability[pid] = 1.0
+                self.latency[pid] = None
+
+    def add_send(self, pid, key):
+        """
+        Record a message sent to acceptor pid.  ``key`` identifies the
+        message so that the response can be matched to it.
+        """
+        self.outstanding.pop((pid, key), None)
+        self.outstanding[(pid, key)] = self.clock()
 
-        # make copy of state to compare before/after run
-        self._pre = copy.copy(self)
+    def add_recvd(self, pid, key):
+        """
+        Record a response from acceptor pid to the message identified by key.
+        Responses that arrive after the message was counted as lost, and
+        duplicate responses, are ignored.
+        """
+        sent = self.outstanding.pop((pid, key), None)
+        if sent is None:
+            return
+        self.update_reliability(pid, 1.0)
+        self.update_latency(pid, self.clock() - sent)
 
-    def add_send(self, pid):
-        self.msgs_sent[pid] += 1
+    def update_reliability(self, pid, sample):
+        self.reliability[pid] += self.alpha * (sample - self.reliability[pid])
+
+    def update_latency(self, pid, sample):
+        if self.latency[pid] is None:
+            self.latency[pid] = sample
+        else:
+            self.latency[pid] += self.alpha * (sample - self.latency[pid])
 
-    def add_recvd(self, pid):
-        self.msgs_recvd[pid] += 1
-        try:
-            self.msg_ratios[pid] = round(self.msgs_recvd[pid]/self.msgs_sent[pid],2)
-        except ZeroDivisionError:
-            pass
-        #self.check_threshold(pid)
+    def expire(self):
+        """
+        Count messages that have gone unanswered for loss_timeout seconds as
+        lost.  Messages are kept in the order they were sent, so only the
+        expired ones are looked at.
+        """
+        deadline = self.clock() - self.loss_timeout
+        while self.outstanding:
+            (pid, key), sent = next(iter(self.outstanding.items()))
+            if sent >= deadline:
+                break
+            del self.outstanding[(pid, key)]
+            self.update_reliability(pid, 0.0)
 
     def check(self):
+        """
+        Recalculate the weights from the current estimates, setting
+        weight_changed if any weight moved by at least the threshold.
+        """
+        self.expire()
+        weights = self.compute_weights()
+        if self.differs(weights):
+            self.weights = weights
+            self.weight_changed = True
+
+    def differs(self, weights):
+        """
+        Return True if the given weights differ enough from the current ones
+        to be published.
+        """
+        return any(abs(weights[pid] - self.weights[pid]) >= self.threshold
+                   for pid in self.acceptor_ids)
+
+    def scores(self):
+        """
+        Return a dict mapping pid to a non-negative score.  An acceptor's
+        score is its reliability, scaled down by up to half for being slower
+        than the fastest acceptor.
+        """
+        latencies = [l for l in self.latency.values() if l is not None]
+        fastest = min(latencies) if latencies else None
+        scores = {}
         for pid in self.acceptor_ids:
-            self.check_threshold(pid)
-
-    def check_threshold(self, pid):
-        if self.msg_ratios[pid] <= self.thresholds[pid]:
-            self.thresholds[pid] = round(self.thresholds[pid]-self.factor,2)
-            self.lower_weight(pid)
-
-    def lower_weight(self, pid):
-        # lower the pid's weight
-        tmp = round(self.weights[pid]-self.factor,2)
-        if tmp > 0.0:
-            self.weights[pid] = tmp
-        else:
-            self.weights[pid] = 0.0
-        self.raise_weight()
-        self.weight_changed = True
-
-    def raise_weight(self):
-        # increase another pid's weight
-        if self.nominal != self.ceiling:
-            adjusted = False
-            while not adjusted:
-                for i in range(self.num_acceptors):
-                    pid = self.acceptor_ids[i]
-                    diff = self.weights[pid] - self.nominal
-                    if diff == 0.0:
-                        self.weights[pid] = round(self.weights[pid]+self.factor,2)
-                        adjusted = True
-                        break
-                if i is (self.num_acceptors-1):
-                    self.nominal = round(self.nominal+self.factor,2)
+            score = self.reliability[pid]
+            latency = self.latency[pid]
+            if fastest is not None and latency:
+                score *= max(0.5, fastest / latency)
+            scores[pid] = score
+        return scores
+
+    def compute_weights(self):
+        """
+        Return weights proportional to the acceptors' scores, summing to 1,
+        with no weight above the ceiling.
+        """
+        return self.normalize(self.scores())
+
+    def normalize(self, scores):
+        """
+        Scale scores to weights summing to 1.  Weights above the ceiling are
+        capped and the excess is spread over the remaining acceptors in
+        proportion to their scores.
+        """
+        weights = {}
+        remaining = dict(scores)
+        total = 1.0
+        # With fewer than 1/ceiling acceptors, the ceiling can't be honored.
+        ceiling = max(self.ceiling, total / len(scores))
+        while remaining:
+            score_sum = sum(remaining.values())
+            if score_sum <= 0:
+                for pid in remaining:
+                    weights[pid] = total / len(remaining)
+                break
+            capped = [pid for pid, score in remaining.items()
+                      if total * score / score_sum > ceiling]
+            if not capped:
+                for pid, score in remaining.items():
+                    weights[pid] = total * score / score_sum
+                break
+            for pid in capped:
+                weights[pid] = ceiling
+                total -= ceiling
+                del remaining[pid]
+        return weights
 
     def log(self):
         print("Acceptor weights: {}".format(self.weights))
-        print("Acceptor ratios: {}".format(self.msg_ratios))
-        print("Acceptor thresholds: {}".format(self.thresholds))
+        print("Acceptor reliability: {}".format(self.reliability))
+        print("Acceptor latency: {}".format(self.latency))
+
+
+class LatencyAnalyzer(Analyzer):
+    """
+    An Analyzer that assigns weights from round trip latency percentiles, so
+    that the fastest acceptors can form a quorum on their own and commits
+    only wait for them.
+
+    The fault_tolerance + 1 acceptors with the lowest latency percentile make
+    up the fast quorum and share a majority of the weight.  Weights are
+    chosen so that any fault_tolerance acceptors together hold less than
+    half of the weight, so the system still makes progress after that many
+    acceptors fail.  As with any weighting, quorums intersect because each
+    holds a majority of the total weight.
+
+    The fast quorum only saves waiting if it's smaller than a majority of
+    the acceptors, which takes a fault_tolerance below n // 2.  By default
+    the fault tolerance is the largest one for which that holds, n // 2 - 1,
+    which is one less than equal weights tolerate with an odd number of
+    acceptors.  With three acceptors, or a fault_tolerance of (n - 1) // 2
+    and an odd n, the fast quorum is a plain majority and the weights change
+    nothing.
+    """
+
+    def __init__(self, acceptor_ids, fault_tolerance=None, percentile=99,
+                 window=1000, margin=0.2, min_reliability=0.9, **kwargs):
+        """
+        ``fault_tolerance`` defaults to default_fault_tolerance() of the
+        number of acceptors.  Latency percentiles are taken over
+        the last ``window`` responses of each acceptor.  An acceptor stays in
+        the fast quorum until another acceptor is faster by more than
+        ``margin``, and acceptors with a reliability below
+        ``min_reliability`` are never part of it.
+        """
+        super(LatencyAnalyzer, self).__init__(acceptor_ids, **kwargs)
+        self.auto_fault_tolerance = fault_tolerance is None
+        if fault_tolerance is None:
+            fault_tolerance = self.default_fault_tolerance(self.num_acceptors)
+        assert 2 * fault_tolerance < self.num_acceptors
+        self.fault_tolerance = fault_tolerance
+        self.percentile = percentile
+        self.window = window
+        self.margin = margin
+        self.min_reliability = min_reliability
+        self.samples = {}
+        for pid in acceptor_ids:
+            self.samples[pid] = deque(maxlen=window)
+        self.fast_quorum = []
+
+    def set_acceptors(self, acceptor_ids):
+        super(LatencyAnalyzer, self).set_acceptors(acceptor_ids)
+        if self.auto_fault_tolerance:
+            self.fault_tolerance = self.default_fault_tolerance(
+                self.num_acceptors)
+        self.fault_tolerance = min(self.fault_tolerance,
+                                   (self.num_acceptors - 1) // 2)
+        self.samples = dict((pid, self.samples.get(pid, deque(maxlen=self.window)))
+                            for pid in acceptor_ids)
+        self.fast_quorum = [pid for pid in self.fast_quorum
+                            if pid in acceptor_ids]
+
+    @staticmethod
+    def default_fault_tolerance(n):
+        """
+        Return the largest fault tolerance whose fast quorum is smaller than
+        a majority of n acceptors, but at least one failure if n can
+        tolerate one.
+        """
+        return max(n // 2 - 1, min(1, (n - 1) // 2))
+
+    def update_latency(self, pid, sample):
+        super(LatencyAnalyzer, self).update_latency(pid, sample)
+        self.samples[pid].append(sample)
+
+    def get_percentile(self, pid, percentile=None):
+        """
+        Return the given percentile (default: the configured one) of the
+        acceptor's recent latencies, or None if there are no samples.
+        """
+        if percentile is None:
+            percentile = self.percentile
+        samples = sorted(self.samples[pid])
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * percentile / 100))
+        return samples[index]
+
+    def rank(self):
+        """
+        Return acceptor pids ordered from most to least preferable for the
+        fast quorum.
+        """
+        def key(pid):
+            latency = self.get_percentile(pid)
+            if self.reliability[pid] < self.min_reliability:
+                return (2, 0)
+            if latency is None:
+                return (1, 0)
+            if pid in self.fast_quorum:
+                latency /= 1 + self.margin
+            return (0, latency)
+        return sorted(self.acceptor_ids, key=key)
+
+    def differs(self, weights):
+        """
+        Publish any change, i.e. whenever the fast quorum changes.
+        """
+        return weights != self.weights
+
+    def compute_weights(self):
+        size = self.fault_tolerance + 1
+        self.fast_quorum = self.rank()[:size]
+        n = self.num_acceptors
+        if size == n:
+            return dict((pid, 1 / n) for pid in self.acceptor_ids)
+        # A fast quorum member's weight must be above 1/(2 * size) for the
+        # fast quorum to hold a majority, and below 1/(2 * fault_tolerance)
+        # for any fault_tolerance acceptors to hold less than half.  It also
+        # has to be at least 1/n and at most 1/size so that the remaining
+        # acceptors get a non-negative weight no larger than its own.
+        low = max(1 / (2 * size), 1 / n)
+        if self.fault_tolerance:
+            high = min(1 / (2 * self.fault_tolerance), 1 / size)
+        else:
+            high = 1 / size
+        fast = (low + high) / 2
+        slow = (1 - size * fast) / (n - size)
+        weights = {}
+        for pid in self.acceptor_ids:
+            weights[pid] = fast if pid in self.fast_quorum else slow
+        return weights
 
 
 if __name__ == '__main__':
     import random
 
+    class Clock:
+        now = 0.0
+        def __call__(self):
+            return self.now
+
+    def run_rounds(a, clock, acceptors, fail_rates, num_msgs):
+        for n in range(num_msgs):
+            for pid in acceptors:
+                a.add_send(pid, n)
+            clock.now += 0.01
+            for pid in acceptors:
+                if fail_rates[pid] <= random.random():
+                    a.add_recvd(pid, n)
+            clock.now += a.loss_timeout
+            a.check()
+
     def test(acceptors, fail_rates, num_msgs):
         print("testing pids {}: ".format(acceptors))
-        a=Analyzer(acceptors)
+        clock = Clock()
+        a = Analyzer(acceptors, clock=clock)
         print("\nBefore rounds...")
         a.log()
-        for n in range(num_msgs):
-            for pid in acceptors:
-                a.add_send(pid)
-                if fail_rates[pid] > random.random():
-                    pass
-                else:
-                    a.add_recvd(pid)
-        print("\nAfter rounds...")
+        run_rounds(a, clock, acceptors, fail_rates, num_msgs)
+        print("\nAfter faulty rounds...")
+        a.log()
+        run_rounds(a, clock, acceptors, [0] * len(acceptors), num_msgs)
+        print("\nAfter recovered rounds...")
         a.log()
         print('\n')
 
     test([0,1,2,3],[0,0,0.05,0],100)
-    test([0,1,2,3,4],[0,0,0.05,0,0],100)
-    test([0,1,2,3,4,5,6,7,8,9],[0,0,0.05,0,0,0,0,0,0.1,0],1000)
\ No newline at end of file
+    test([0,1,2,3,4],[0,0,0.5,0,0],100)
+    test([0,1,2,3,4,5,6,7,8,9],[0,0,0.05,0,0,0,0,0,0.1,0],1000)
@@ -0,0 +1,285 @@
+"""
+Throughput and latency benchmarks of a whole paxos system.
+
+A client drives a ``sim.System`` with requests, either open loop (at a fixed
+rate) or closed loop (keeping a fixed number of requests outstanding).  The
+latency of a request is the time from the client sending it until the first
+learner's result for it reaches the result logger.  Each benchmark reports
+commits per second, latency percentiles and the time to bring the system up
+until all agents are ready, and is appended to a JSON lines file so that runs
+can be compared for regressions.
+
+Usage::
+
+    python -m paxos.bench [results.jsonl]
+    python -m paxos.bench --compare baseline.jsonl results.jsonl
+"""
+
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from paxos import SystemConfig
+from paxos.sim import System, Mailbox, ResultLogger
+from paxos.sim_failure import FailTestMailbox
+from paxos.test import DebugMailbox
+
+
+class TimingLogger(ResultLogger):
+    """
+    A ResultLogger that records when each value was first learned.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(TimingLogger, self).__init__(*args, **kwargs)
+        # Value mapped to the time its first result arrived.
+        self.learned = {}
+        self.condition = threading.Condition()
+
+    def record(self, source, instance, value):
+        super(TimingLogger, self).record(source, instance, value)
+        if value not in self.learned:
+            with self.condition:
+                self.learned[value] = time.monotonic()
+                self.condition.notify_all()
+
+    def wait(self, count, timeout):
+        """
+        Block until count values have been learned or timeout seconds pass.
+        Return the number of learned values.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.learned) >= count,
+                                    timeout)
+            return len(self.learned)
+
+
+class Client:
+    """
+    Sends numbered requests to a proposer (by default, the leader of the
+    request's consensus group) and records when they were sent.
+    With a rate, requests are sent open loop at that many per second;
+    otherwise at most ``window`` requests are outstanding at a time.  With a
+    value_size, requests are that many bytes, starting with their number.
+    """
+
+    def __init__(self, system, num_requests, rate=None, window=1,
+                 proposer=None, timeout=30, value_size=None):
+        self.system = system
+        self.num_requests = num_requests
+        self.rate = rate
+        self.window = window
+        self.proposer = proposer
+        self.timeout = timeout
+        self.value_size = value_size
+        # Request value (as submitted) mapped to the time it was sent.
+        self.sent = {}
+
+    def send(self, number):
+        sent_at = time.monotonic()
+        value = number
+        if self.value_size:
+            value = number.to_bytes(8, 'big') + bytes(self.value_size - 8)
+        value = self.system.submit(value, self.proposer)
+        self.sent[value] = sent_at
+
+    def run(self):
+        """
+        Send all requests and wait for them to be learned.  Return the
+        number of learned requests.
+        """
+        logger = self.system.logger
+        start = time.monotonic()
+        for value in range(1, self.num_requests + 1):
+            if self.rate:
+                delay = start + (value - 1) / self.rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            elif logger.wait(value - self.window, self.timeout) < \
+                    value - self.window:
+                break
+            self.send(value)
+        return logger.wait(self.num_requests, self.timeout)
+
+
+def percentile(values, p):
+    """
+    Return the p-th percentile of a sorted list of values.
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+@contextlib.contextmanager
+def discard_output():
+    """
+    Discard standard output, including that of agent processes that are
+    spawned rather than forked, which write to the file descriptor directly.
+    """
+    sys.stdout.flush()
+    saved = os.dup(1)
+    with open(os.devnull, 'w') as devnull:
+        os.dup2(devnull.fileno(), 1)
+        try:
+            with contextlib.redirect_stdout(devnull):
+                yield
+        finally:
+            os.dup2(saved, 1)
+            os.close(saved)
+
+
+def run_benchmark(name, config, mailbox=Mailbox, num_requests=1000,
+                  rate=None, window=1, value_size=None):
+    """
+    Run a benchmark and return its result dict.  Agent output is discarded.
+    """
+    with discard_output():
+        started = time.monotonic()
+        system = System(config, mailbox=mailbox, logger=TimingLogger)
+        system.start()
+        bring_up = time.monotonic() - started
+        client = Client(system, num_requests, rate, window,
+                        value_size=value_size)
+        learned = client.run()
+        system.shutdown_agents()
+        system.quit()
+
+    timings = system.logger.learned
+    latencies = sorted(timings[value] - sent
+                       for value, sent in client.sent.items()
+                       if value in timings)
+    first_sent = min(client.sent.values())
+    last_learned = max(timings.values()) if timings else first_sent
+    elapsed = last_learned - first_sent
+    return {
+        "name": name,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": get_revision(),
+        "mailbox": mailbox.__name__,
+        "agents": list(config.agent_config),
+        "requests": num_requests,
+        "rate": rate,
+        "window": None if rate else window,
+        "value_size": value_size,
+        "value_threshold": config.value_threshold,
+        "payload_split": config.payload_split,
+        "groups": config.num_groups,
+        "learned": learned,
+        "bring_up": bring_up,
+        "commits_per_second": learned / elapsed if elapsed else None,
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+        "p999": percentile(latencies, 99.9),
+    }
+
+
+def get_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(__file__)).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmarks(num_requests=1000):
+    """
+    Yield (name, kwargs for run_benchmark) pairs of the standard suite:
+    closed and open loop clients, a few cluster shapes and each mailbox.
+    """
+    for mailbox in (Mailbox, DebugMailbox, FailTestMailbox):
+        for shape in ((1, 3, 1), (1, 5, 2), (1, 9, 3)):
+            for window in (1, 16):
+                yield ("closed-{}-{}-{}".format(mailbox.__name__,
+                                                "x".join(map(str, shape)),
+                                                window),
+                       dict(config=SystemConfig(*shape), mailbox=mailbox,
+                            num_requests=num_requests, window=window))
+            yield ("open-{}-{}-500".format(mailbox.__name__,
+                                           "x".join(map(str, shape))),
+                   dict(config=SystemConfig(*shape), mailbox=mailbox,
+                        num_requests=num_requests, rate=500))
+    # Large values, copied in every message, stored once, or sent to the
+    # learners apart from the messages that order them.
+    for suffix, options in (("", {}), ("-store", dict(value_threshold=4096)),
+                            ("-split", dict(payload_split=True))):
+        yield ("closed-Mailbox-1x5x2-16-64KB" + suffix,
+               dict(config=SystemConfig(1, 5, 2, **options),
+                    num_requests=num_requests, window=16, value_size=65536))
+    # Independent consensus groups, each led by its own proposer.
+    for num_groups in (1, 2, 4):
+        yield ("closed-Mailbox-groups-{}-32".format(num_groups),
+               dict(config=SystemConfig(num_groups, 3, 2,
+                                        num_groups=num_groups),
+                    num_requests=num_requests, window=32))
+    # Bring-up time of a larger cluster with each way of starting processes.
+    for start_method in ("fork", "forkserver", "spawn"):
+        yield ("bringup-{}-1x25x5".format(start_method),
+               dict(config=SystemConfig(1, 25, 5, start_method=start_method),
+                    num_requests=100, window=16))
+
+
+def format_result(result):
+    def ms(seconds):
+        return "{:8.2f}".format(1000 * seconds) if seconds is not None \
+            else "       -"
+    return "{:<40} {:>8.1f}/s  p50 {} ms  p99 {} ms  p999 {} ms  " \
+           "up {} ms".format(
+        result["name"], result["commits_per_second"] or 0,
+        ms(result["p50"]), ms(result["p99"]), ms(result["p999"]),
+        ms(result.get("bring_up")))
+
+
+def run_suite(filename="bench_results.jsonl", num_requests=1000):
+    """
+    Run the standard suite, printing each result and appending it to
+    filename.
+    """
+    for name, kwargs in benchmarks(num_requests):
+        result = run_benchmark(name, **kwargs)
+        print(format_result(result))
+        with open(filename, 'a') as f:
+            f.write(json.dumps(result) + "\n")
+
+
+def load_results(filename):
+    """
+    Return a dict mapping benchmark name to its latest result in filename.
+    """
+    results = {}
+    with open(filename) as f:
+        for line in f:
+            result = json.loads(line)
+            results[result["name"]] = result
+    return results
+
+
+def compare(baseline_file, current_file):
+    """
+    Print the change in throughput and p99 latency of each benchmark between
+    two result files.
+    """
+    baseline = load_results(baseline_file)
+    current = load_results(current_file)
+    for name in sorted(set(baseline) & set(current)):
+        old, new = baseline[name], current[name]
+        def change(key):
+            if not old[key] or new[key] is None:
+                return "      -"
+            return "{:+6.1f}%".format(100 * (new[key] - old[key]) / old[key])
+        print("{:<40} throughput {}  p99 {}  bring-up {}".format(
+              name, change("commits_per_second"), change("p99"),
+              change("bring_up")))
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--compare"]:
+        compare(sys.argv[2], sys.argv[3])
+    else:
+        run_suite(*sys.argv[1:2])
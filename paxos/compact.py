@@ -0,0 +1,216 @@
+"""
+A compact instance table for acceptors.
+
+An ``Acceptor`` keeps a ``BasicPaxosAcceptorProtocol`` per instance, with
+two ``Proposal`` objects each, which costs several hundred bytes of Python
+objects per instance.  All an acceptor has to remember of an instance is the
+number of the proposal it promised, the number of the proposal it accepted
+and that proposal's value.  An ``AcceptorTable`` keeps the numbers in two
+typed arrays and the values in a list, indexed by the instance's offset from
+a base instance, and grows them as later instances are used.  An instance
+far beyond the end of the arrays is kept in a dict until the arrays reach
+it, so that a stray instance number doesn't allocate arrays up to it.
+Scanning the table, to recover or transfer an acceptor's state, reads the
+arrays in order.
+
+Use it with ``SystemConfig(acceptor_class=CompactAcceptor)``.
+"""
+
+from array import array
+
+from paxos import Acceptor, handles
+from paxos.messages import (Proposal, PrepareMsg, PrepareResponseMsg,
+                            AcceptMsg, AcceptResponseMsg)
+
+
+# Proposal number of an instance that promised or accepted nothing yet.
+NO_PROPOSAL = -1
+
+
+class AcceptorTable:
+    """
+    The promised and accepted proposal numbers, and the accepted values, of
+    the instances of an acceptor.  Instances from ``base`` are stored in
+    arrays, which grow to take in instances up to ``max_gap`` past their
+    end, and others in a sparse dict.
+    """
+
+    def __init__(self, base=1, max_gap=1 << 20):
+        self.base = base
+        self.max_gap = max_gap
+        self.promised = array('q')
+        self.accepted = array('q')
+        self.values = []
+        # [promised, accepted, value] of instances outside the arrays.
+        self.sparse = {}
+
+    def offset(self, instance):
+        """
+        Return the array offset of instance, or None if it's outside the
+        arrays.
+        """
+        offset = instance - self.base
+        if 0 <= offset < len(self.promised):
+            return offset
+        return None
+
+    def offset_for_update(self, instance):
+        """
+        Return the array offset of instance, growing the arrays to it if it's
+        within max_gap of their end, or None if it's kept in the sparse dict.
+        """
+        offset = instance - self.base
+        if 0 <= offset < len(self.promised):
+            return offset
+        if 0 <= offset < len(self.promised) + self.max_gap:
+            self.grow(offset + 1)
+            return offset
+        return None
+
+    def grow(self, size):
+        """
+        Grow the arrays to at least size entries, doubling their size to
+        keep growing cheap, and move the sparse instances they now cover
+        into them.
+        """
+        size = max(size, 2 * len(self.promised), 64)
+        extra = size - len(self.promised)
+        self.promised.extend(array('q', [NO_PROPOSAL]) * extra)
+        self.accepted.extend(array('q', [NO_PROPOSAL]) * extra)
+        self.values.extend([None] * extra)
+        self.take_in_sparse()
+
+    def take_in_sparse(self):
+        """
+        Move the sparse instances that the arrays cover into them.
+        """
+        for instance in [i for i in self.sparse
+                         if self.offset(i) is not None]:
+            promised, accepted, value = self.sparse.pop(instance)
+            offset = self.offset(instance)
+            self.promised[offset] = promised
+            self.accepted[offset] = accepted
+            self.values[offset] = value
+
+    def get(self, instance):
+        """
+        Return (promised number, accepted number, accepted value) of
+        instance.
+        """
+        offset = self.offset(instance)
+        if offset is None:
+            entry = self.sparse.get(instance)
+            if entry is None:
+                return NO_PROPOSAL, NO_PROPOSAL, None
+            return tuple(entry)
+        return (self.promised[offset], self.accepted[offset],
+                self.values[offset])
+
+    def set_promised(self, instance, number):
+        offset = self.offset_for_update(instance)
+        if offset is None:
+            self.sparse_entry(instance)[0] = number
+            return
+        self.promised[offset] = number
+
+    def set_accepted(self, instance, number, value):
+        offset = self.offset_for_update(instance)
+        if offset is None:
+            entry = self.sparse_entry(instance)
+            entry[1] = number
+            entry[2] = value
+            return
+        self.accepted[offset] = number
+        self.values[offset] = value
+
+    def sparse_entry(self, instance):
+        entry = self.sparse.get(instance)
+        if entry is None:
+            entry = self.sparse[instance] = [NO_PROPOSAL, NO_PROPOSAL, None]
+        return entry
+
+    def scan(self, start=None):
+        """
+        Yield (instance, promised number, accepted number, accepted value) of
+        every instance from start onwards that promised or accepted a
+        proposal, in instance order.
+        """
+        if start is None:
+            start = min(self.sparse, default=self.base)
+            start = min(start, self.base)
+        sparse = sorted(i for i in self.sparse if i >= start)
+        end = self.base + len(self.promised)
+        for instance in sparse:
+            if instance >= self.base:
+                break
+            yield (instance,) + tuple(self.sparse[instance])
+        promised = self.promised
+        accepted = self.accepted
+        for offset in range(max(start - self.base, 0), len(promised)):
+            if promised[offset] != NO_PROPOSAL or \
+                    accepted[offset] != NO_PROPOSAL:
+                yield (self.base + offset, promised[offset],
+                       accepted[offset], self.values[offset])
+        for instance in sparse:
+            if instance >= end:
+                yield (instance,) + tuple(self.sparse[instance])
+
+    def discard_below(self, instance):
+        """
+        Forget the instances below instance, once their decisions are safely
+        kept elsewhere, and move the base of the arrays up to instance.
+        """
+        for i in [i for i in self.sparse if i < instance]:
+            del self.sparse[i]
+        shift = min(max(instance - self.base, 0), len(self.promised))
+        del self.promised[:shift]
+        del self.accepted[:shift]
+        del self.values[:shift]
+        self.base = max(self.base, instance)
+
+
+class CompactAcceptor(Acceptor):
+    """
+    An acceptor that keeps its instances in an AcceptorTable rather than in
+    protocol objects.  It handles messages like BasicPaxosAcceptorProtocol.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(CompactAcceptor, self).__init__(*args, **kwargs)
+        self.table = AcceptorTable()
+
+    @handles(PrepareMsg)
+    def handle_prepare(self, msg):
+        instance = msg.proposal.instance
+        promised, accepted, value = self.table.get(instance)
+        if msg.proposal.number > promised:
+            self.table.set_promised(instance, msg.proposal.number)
+            highest_accepted = Proposal(accepted, instance, value=value)
+            self.send_message(PrepareResponseMsg(self.pid, msg.proposal,
+                                                 highest_accepted),
+                              [msg.source])
+            self.report_state(instance, msg.proposal.number, accepted)
+
+    @handles(AcceptMsg)
+    def handle_accept(self, msg):
+        instance = msg.proposal.instance
+        promised, accepted, value = self.table.get(instance)
+        if msg.proposal.number >= promised:
+            self.table.set_accepted(instance, msg.proposal.number,
+                                    msg.proposal.value)
+            learner_ids = msg.learner_ids
+            if learner_ids is None:
+                learner_ids = self.config.learner_ids
+            self.send_message(AcceptResponseMsg(self.pid, msg.proposal),
+                              [msg.source] + list(learner_ids))
+            if msg.proposal.number != accepted:
+                self.report_state(instance, promised, msg.proposal.number)
+
+    def report_state(self, instance, promised, accepted):
+        """
+        Report the instance's promised and accepted numbers to the logger, if
+        the configuration asks for acceptor checks.
+        """
+        if self.config.check_acceptors:
+            self.logger.log_acceptor_state(self.pid, instance, promised,
+                                           accepted)
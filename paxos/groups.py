@@ -0,0 +1,45 @@
+"""
+Independent consensus groups over shared acceptors and learners.
+
+With ``SystemConfig(num_groups=...)``, client requests are partitioned into
+groups, each led by its own proposer with its own sequence of instances, so
+that groups start instances without waiting for each other.  Instance ``n``
+of group ``g`` is decided in log position ``(n - 1) * num_groups + g + 1``
+(see ``SystemConfig.log_position``), so acceptors and learners, which only
+see log positions, serve all groups at once, and the decisions of all groups
+merge into a single log.
+
+Groups advance independently, so a group that gets fewer requests than
+another leaves positions of the merged log undecided, for good if it gets
+none.  Consumers of results therefore follow each group's sequence: a
+``results.DecisionStream`` orders decisions within each group, and a
+``results.ResultTable`` counts the positions of the requests routed to each
+group rather than the first positions of the log.
+
+``System.submit`` routes requests with a ``GroupRouter``.
+"""
+
+import pickle
+import zlib
+
+
+class GroupRouter:
+    """
+    Maps client keys to groups by their CRC-32, so that requests with the
+    same key are always ordered by the same group.
+    """
+
+    def __init__(self, num_groups):
+        self.num_groups = num_groups
+
+    def key_bytes(self, key):
+        if isinstance(key, bytes):
+            return key
+        if isinstance(key, str):
+            return key.encode('utf-8')
+        return pickle.dumps(key, pickle.HIGHEST_PROTOCOL)
+
+    def group_for(self, key):
+        if self.num_groups == 1:
+            return 0
+        return zlib.crc32(self.key_bytes(key)) % self.num_groups
@@ -0,0 +1,251 @@
+"""
+A persistent log of the values a learner has decided.
+
+A ``Learner`` keeps its decided values in a dict, from which
+``SystemConfig(retain_instances=...)`` has it forget the older ones, so a
+learner can only serve catch-up requests from what it still holds in memory.
+With ``SystemConfig(decided_log_dir=...)``, each learner instead appends its
+decisions to a ``DecidedLog`` in its own subdirectory of the run's
+directory, and serves catch-up requests by scanning it.
+
+The log is a sequence of segment files, each memory-mapped and filled with
+records of a 16-byte header (instance, length) followed by the pickled
+value.  An index array maps each instance to the position of its latest
+record, so that values are read on demand rather than kept on the heap.
+When a segment is full, the next one is started, and once the instances
+below some instance are no longer needed (the learner's truncation point,
+with ``retain_instances``), ``discard_below`` deletes the segments that only
+hold those.  Reopening a directory recovers the log from its
+segments.
+"""
+
+import mmap
+import os
+import pickle
+import struct
+from array import array
+
+HEADER = struct.Struct("<qq")
+# A record's position is its segment number shifted by this many bits, plus
+# its offset in the segment.
+OFFSET_BITS = 40
+NO_POSITION = -1
+
+
+class Segment:
+    """
+    A memory-mapped segment file, holding records up to ``end``.
+    """
+
+    def __init__(self, number, path, size):
+        self.number = number
+        self.path = path
+        with open(path, 'a+b') as f:
+            if os.fstat(f.fileno()).st_size < size:
+                f.truncate(size)
+            self.size = os.fstat(f.fileno()).st_size
+            self.map = mmap.mmap(f.fileno(), self.size)
+        self.end = 0
+        # Highest instance with a record in this segment.
+        self.max_instance = 0
+
+    def records(self):
+        """
+        Yield (instance, offset) of the records written to the segment,
+        setting end past the last one.  A zero header, where nothing was
+        written yet, ends the records.
+        """
+        offset = 0
+        while offset + HEADER.size <= self.size:
+            instance, length = HEADER.unpack_from(self.map, offset)
+            if instance <= 0 or \
+                    offset + HEADER.size + length > self.size:
+                break
+            yield instance, offset
+            offset += HEADER.size + length
+            self.end = offset
+            self.max_instance = max(self.max_instance, instance)
+
+    def append(self, instance, data):
+        """
+        Write a record, returning its offset.  The header is written last,
+        so that a partly written record ends the segment when it's recovered.
+        """
+        offset = self.end
+        start = offset + HEADER.size
+        self.map[start:start + len(data)] = data
+        HEADER.pack_into(self.map, offset, instance, len(data))
+        self.end = start + len(data)
+        self.max_instance = max(self.max_instance, instance)
+        return offset
+
+    def read(self, offset):
+        instance, length = HEADER.unpack_from(self.map, offset)
+        start = offset + HEADER.size
+        with memoryview(self.map) as view:
+            return pickle.loads(view[start:start + length])
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+
+
+class DecidedLog:
+    """
+    Decided values by instance, appended to segment files of ``directory``
+    of ``segment_size`` bytes (or more, for a larger value).  Supports
+    ``log[instance] = value``, ``log[instance]``, ``instance in log`` and
+    ``len(log)`` like the dict it replaces.
+    """
+
+    def __init__(self, directory, segment_size=1 << 24):
+        self.directory = directory
+        self.segment_size = segment_size
+        os.makedirs(directory, exist_ok=True)
+        self.segments = {}
+        # Record positions, by instance offset from base.
+        self.base = 1
+        self.positions = array('q')
+        self.count = 0
+        self.current = None
+        self.recover()
+
+    def segment_path(self, number):
+        return os.path.join(self.directory, "{:08d}.seg".format(number))
+
+    def recover(self):
+        """
+        Map the existing segments, in order, and index their records.
+        """
+        numbers = sorted(int(name[:-4]) for name in os.listdir(self.directory)
+                         if name.endswith(".seg"))
+        records = []
+        for number in numbers:
+            segment = Segment(number, self.segment_path(number), 0)
+            self.segments[number] = segment
+            records.extend((instance, number, offset)
+                           for instance, offset in segment.records())
+            self.current = segment
+        base_path = os.path.join(self.directory, "base")
+        if os.path.exists(base_path):
+            # Discarded instances aren't indexed again.
+            with open(base_path) as f:
+                self.base = int(f.read())
+        elif records:
+            self.base = min(records)[0]
+        for instance, number, offset in records:
+            self.index(instance, number, offset)
+
+    def index(self, instance, number, offset):
+        i = instance - self.base
+        if i < 0:
+            return
+        if i >= len(self.positions):
+            size = max(i + 1, 2 * len(self.positions), 64)
+            self.positions.extend(
+                array('q', [NO_POSITION]) * (size - len(self.positions)))
+        if self.positions[i] == NO_POSITION:
+            self.count += 1
+        self.positions[i] = (number << OFFSET_BITS) | offset
+
+    def position(self, instance):
+        i = instance - self.base
+        if 0 <= i < len(self.positions):
+            return self.positions[i]
+        return NO_POSITION
+
+    def __setitem__(self, instance, value):
+        if instance < self.base:
+            # Already covered by a snapshot.
+            return
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        needed = HEADER.size + len(data)
+        segment = self.current
+        if segment is None or segment.end + needed > segment.size:
+            segment = self.roll(needed)
+        offset = segment.append(instance, data)
+        self.index(instance, segment.number, offset)
+
+    def roll(self, needed):
+        """
+        Start a new segment with room for at least needed bytes.
+        """
+        if self.current is not None:
+            self.current.map.flush()
+            number = self.current.number + 1
+        else:
+            number = 0
+        # Leave room for a zero header after the last record.
+        size = max(self.segment_size, needed + HEADER.size)
+        self.current = Segment(number, self.segment_path(number), size)
+        self.segments[number] = self.current
+        return self.current
+
+    def __getitem__(self, instance):
+        position = self.position(instance)
+        if position == NO_POSITION:
+            raise KeyError(instance)
+        segment = self.segments[position >> OFFSET_BITS]
+        return segment.read(position & ((1 << OFFSET_BITS) - 1))
+
+    def get(self, instance, default=None):
+        try:
+            return self[instance]
+        except KeyError:
+            return default
+
+    def __contains__(self, instance):
+        return self.position(instance) != NO_POSITION
+
+    def __len__(self):
+        return self.count
+
+    def scan(self, start=None, stop=None):
+        """
+        Yield (instance, value) of the decided instances from start up to,
+        but not including, stop, in instance order.
+        """
+        first = max((start or self.base) - self.base, 0)
+        last = len(self.positions)
+        if stop is not None:
+            last = min(max(stop - self.base, 0), last)
+        mask = (1 << OFFSET_BITS) - 1
+        for i in range(first, last):
+            position = self.positions[i]
+            if position != NO_POSITION:
+                segment = self.segments[position >> OFFSET_BITS]
+                yield self.base + i, segment.read(position & mask)
+
+    def discard_below(self, instance):
+        """
+        Forget the instances below instance, which are no longer needed, and
+        delete the segments that only hold records of those.
+        """
+        shift = min(max(instance - self.base, 0), len(self.positions))
+        self.count -= sum(1 for p in self.positions[:shift]
+                          if p != NO_POSITION)
+        del self.positions[:shift]
+        self.base = max(self.base, instance)
+        base_path = os.path.join(self.directory, "base")
+        with open(base_path + ".tmp", 'w') as f:
+            f.write(str(self.base))
+        os.replace(base_path + ".tmp", base_path)
+        for number, segment in sorted(self.segments.items()):
+            if segment is self.current or segment.max_instance >= instance:
+                continue
+            segment.close()
+            os.remove(segment.path)
+            del self.segments[number]
+
+    def sync(self):
+        """
+        Flush the current segment to its file.
+        """
+        if self.current is not None:
+            self.current.map.flush()
+
+    def close(self):
+        for segment in self.segments.values():
+            segment.close()
+        self.segments = {}
+        self.current = None
@@ -1,10 +1,12 @@
 class Proposal:
-    def __init__(self, number, instance, pid=None, value=None):
+    def __init__(self, number, instance, pid=None, value=None, group=0):
         self.number = number
         self.instance = instance
         # PID of the process that created this proposal.
         self.pid = pid
         self.value = value
+        # Consensus group whose instance sequence the instance belongs to.
+        self.group = group
     def __str__(self):
         return "Proposal[N-{}, I-{}, {}]".format(self.number, self.instance,
                                                  self.value)
@@ -15,13 +17,34 @@ class Message:
         # PID of the sender of the message.
         self.source = source
 
+class QuitMsg(Message):
+    """
+    Control message asking an agent to shut down.
+    """
+    def __str__(self):
+        return "Quit"
+
 class ClientRequestMsg(Message):
-    def __init__(self, source, value):
+    def __init__(self, source, value, group=0):
         super(ClientRequestMsg, self).__init__(source)
         self.value = value
+        # Consensus group to order the request in.
+        self.group = group
     def __str__(self):
         return "Client Request: {}".format(self.value)
 
+class PayloadMsg(Message):
+    """
+    Carries the value of a client request to a learner, ahead of the
+    decision on ``ref``, a values.PayloadRef to it.
+    """
+    def __init__(self, source, ref, value):
+        super(PayloadMsg, self).__init__(source)
+        self.ref = ref
+        self.value = value
+    def __str__(self):
+        return "Payload: {}".format(self.ref)
+
 class ProposalMsg(Message):
     """
     A base class for other message types that hold a proposal.
@@ -49,6 +72,10 @@ class PrepareResponseMsg(ProposalMsg):
 
 class AcceptMsg(ProposalMsg):
     name = "Accept"
+    def __init__(self, source, proposal, learner_ids=None):
+        super(AcceptMsg, self).__init__(source, proposal)
+        # Learners to send accept responses to, if not the configured ones.
+        self.learner_ids = learner_ids
 
 class AcceptResponseMsg(ProposalMsg):
     name = "Accept Response"
@@ -63,9 +90,41 @@ class RetryMsg(Message):
     def __str__(self):
         return "RetryMsg: {}".format(self.instance)
 
+class BackpressureMsg(Message):
+    """
+    Sent by the mailbox to tell a process that the inbox of process
+    ``source`` is full (congested is True), or has drained (False).
+    """
+    def __init__(self, source, congested):
+        super(BackpressureMsg, self).__init__(source)
+        self.congested = congested
+
+    def __str__(self):
+        return "Backpressure: {} {}".format(
+            self.source, "congested" if self.congested else "clear")
+
 class AdjustWeightsMsg(Message):
     def __init__(self, source, weights):
         super(AdjustWeightsMsg, self).__init__(source)
         self.weights = weights
     def __str__(self):
         return "Weights: {}".format(self.weights)
+
+class CatchupRequestMsg(Message):
+    """
+    Sent by a learner that joined a running system to ask other learners
+    for the values decided from instance onwards.
+    """
+    def __init__(self, source, instance):
+        super(CatchupRequestMsg, self).__init__(source)
+        self.instance = instance
+    def __str__(self):
+        return "Catchup Request: {}".format(self.instance)
+
+class CatchupResponseMsg(Message):
+    def __init__(self, source, results):
+        super(CatchupResponseMsg, self).__init__(source)
+        # Decided values, mapped by instance number.
+        self.results = results
+    def __str__(self):
+        return "Catchup Response: {} values".format(len(self.results))
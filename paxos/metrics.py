@@ -0,0 +1,180 @@
+"""
+Counters, gauges and histograms kept by every agent.
+
+Each agent has a ``MetricsRegistry``.  Recording a metric is a dict update,
+cheap enough to do for every message.  When the system configuration sets a
+``metrics_interval``, agents periodically export a snapshot of their registry
+through the mailbox, so that the metrics of a running system can be read (see
+``sim.MetricsCollector``).
+"""
+
+import copy
+
+
+class Histogram:
+    """
+    A histogram of non-negative values with bounded relative error, in the
+    style of HdrHistogram.
+
+    Values are recorded in integer multiples of ``unit`` into log-linear
+    buckets: each power of two range is split into 2 ** (precision - 1)
+    equal buckets, so a recorded value is off by at most 2 ** -(precision - 1)
+    of itself (about 1.6% for the default precision of 7).  Buckets are kept
+    in a dict, so memory is proportional to the number of distinct buckets
+    used and the range of values is unbounded.
+    """
+
+    def __init__(self, unit=1e-6, precision=7):
+        self.unit = unit
+        self.precision = precision
+        self.half = 1 << (precision - 1)
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def bucket_index(self, value):
+        shift = value.bit_length() - self.precision
+        if shift <= 0:
+            return value
+        return shift * self.half + (value >> shift)
+
+    def bucket_value(self, index):
+        """
+        Return the middle of the values that fall into bucket index.
+        """
+        if index < 2 * self.half:
+            return index
+        shift = index // self.half - 1
+        return ((index - shift * self.half) << shift) + (1 << shift) // 2
+
+    def record(self, value, count=1):
+        """
+        Record value, a number of seconds or whatever ``unit`` is a fraction
+        of, count times.
+        """
+        value = max(0, int(value / self.unit))
+        index = self.bucket_index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """
+        Add the values recorded in another histogram with the same unit and
+        precision to this one.
+        """
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                if self.min is None or value < self.min:
+                    self.min = value
+                if self.max is None or value > self.max:
+                    self.max = value
+
+    def percentile(self, p):
+        """
+        Return the p-th percentile of the recorded values, or None if no
+        values have been recorded.
+        """
+        if not self.count:
+            return None
+        rank = max(1, p * self.count / 100)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                value = min(self.bucket_value(index), self.max)
+                return max(value, self.min) * self.unit
+        return self.max * self.unit
+
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total * self.unit / self.count
+
+    def summary(self):
+        """
+        Return a dict with the count, mean, min, max and common percentiles.
+        """
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": self.mean(),
+            "min": self.min * self.unit,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "p999": self.percentile(99.9),
+            "max": self.max * self.unit,
+        }
+
+
+class MetricsRegistry:
+    """
+    Named counters, gauges and histograms.  Metrics are created when they are
+    first recorded.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def observe(self, name, value):
+        """
+        Record value, in seconds, in the histogram called name.
+        """
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.record(value)
+
+    def snapshot(self):
+        """
+        Return a copy of the registry that is safe to send to another
+        process while this one keeps recording.
+        """
+        return copy.deepcopy(self)
+
+    def merge(self, other):
+        """
+        Add the counters and histograms of another registry to this one.
+        Gauges of different processes can't be added up meaningfully, so
+        each merged gauge keeps the highest value, e.g. the deepest inbox.
+        """
+        for name, value in other.counters.items():
+            self.count(name, value)
+        for name, value in other.gauges.items():
+            self.gauges[name] = max(self.gauges.get(name, value), value)
+        for name, histogram in other.histograms.items():
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(histogram.unit,
+                                                  histogram.precision)
+            self.histograms[name].merge(histogram)
+
+    def print_metrics(self, prefix=""):
+        for name in sorted(self.counters):
+            print("{}{}: {}".format(prefix, name, self.counters[name]))
+        for name in sorted(self.gauges):
+            print("{}{}: {}".format(prefix, name, self.gauges[name]))
+        for name in sorted(self.histograms):
+            summary = self.histograms[name].summary()
+            if not summary["count"]:
+                continue
+            print("{}{}: n={count} mean={mean:.6f} p50={p50:.6f} "
+                  "p99={p99:.6f} max={max:.6f}".format(prefix, name, **summary))
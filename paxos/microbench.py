@@ -0,0 +1,294 @@
+"""
+Micro-benchmarks of the protocol handlers and message encoding.
+
+Each benchmark calls one hot path in-process, against an agent whose mailbox
+discards sent messages, so that its cost can be measured in isolation from
+processes, queues and printing.  Results are reported in operations per
+second and in memory allocated per operation, as measured by tracemalloc:
+the number of memory blocks and bytes that an operation leaves allocated,
+and the peak number of bytes it allocates while running.
+
+Usage::
+
+    python -m paxos.microbench [iterations]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from paxos import Agent, Acceptor, SystemConfig
+from paxos.compact import CompactAcceptor
+from paxos.messages import (Proposal, PrepareMsg, PrepareResponseMsg,
+                            AcceptMsg, AcceptResponseMsg)
+from paxos.protocol import (BasicPaxosProtocol, BasicPaxosProposerProtocol,
+                            BasicPaxosAcceptorProtocol,
+                            BasicPaxosLearnerProtocol)
+from paxos.sim import Mailbox
+
+
+ACCEPTOR_COUNTS = (3, 5, 11, 21, 51, 101)
+
+
+class StubMailbox(Mailbox):
+    """
+    A Mailbox that counts and discards sent messages.  Encoding and decoding
+    are those of the regular Mailbox.
+    """
+
+    def __init__(self, config=None):
+        self.config = config
+        self.num_sent = 0
+
+    def broadcast(self, msg, pids):
+        self.num_sent += len(pids)
+
+    def send_batches(self, batches):
+        for msgs in batches.values():
+            self.num_sent += len(msgs)
+
+
+class StubAgent(Agent):
+    """
+    An agent that provides what the protocols need from their agent, without
+    printing sent messages or acting on decisions.
+    """
+
+    def __init__(self, config, pid=0):
+        super(StubAgent, self).__init__(pid, StubMailbox(config), None)
+        self.analyzer = None
+        self.set_config(config)
+
+    def send_message(self, msg, pids, immediate=False):
+        self.mailbox.broadcast(msg, pids)
+
+    def record_decision(self, instance, value):
+        pass
+
+    def log_result(self, msg):
+        pass
+
+
+def get_config(num_acceptors):
+    return SystemConfig(1, num_acceptors, 1)
+
+
+# Each benchmark setup takes the number of operations to run and returns a
+# (function, list of argument tuples) pair, one tuple per operation.  Setup
+# isn't measured.
+
+def setup_acceptor_prepare(count, num_acceptors=3):
+    agent = StubAgent(get_config(num_acceptors), pid=1)
+    protocol = BasicPaxosAcceptorProtocol(agent)
+    # Increasing proposal numbers, so that every prepare is promised.
+    msgs = [(PrepareMsg(0, Proposal(n, 1, 0)),) for n in range(count)]
+    return protocol.handle_prepare, msgs
+
+
+def setup_acceptor_accept(count, num_acceptors=3):
+    config = get_config(num_acceptors)
+    agent = StubAgent(config, pid=1)
+    protocol = BasicPaxosAcceptorProtocol(agent)
+    msgs = [(AcceptMsg(0, Proposal(n, 1, 0, n), config.learner_ids),)
+            for n in range(count)]
+    return protocol.handle_accept, msgs
+
+
+class StubAcceptor(StubAgent, Acceptor):
+    pass
+
+
+class StubCompactAcceptor(StubAgent, CompactAcceptor):
+    pass
+
+
+ACCEPTOR_CLASSES = {"Acceptor": StubAcceptor,
+                    "CompactAcceptor": StubCompactAcceptor}
+
+
+def setup_acceptor_instances(count, acceptor="Acceptor"):
+    """
+    Each operation is a prepare and an accept of a new instance, so that the
+    bytes left allocated are the acceptor's state per instance (besides the
+    accepted proposal, which the acceptor keeps a reference to).
+    """
+    config = get_config(3)
+    agent = ACCEPTOR_CLASSES[acceptor](config, pid=1)
+
+    def prepare_and_accept(prepare, accept):
+        agent.handle_prepare(prepare)
+        agent.handle_accept(accept)
+
+    args = []
+    for instance in range(1, count + 1):
+        proposal = Proposal(1, instance, 0, instance)
+        args.append((PrepareMsg(0, proposal),
+                     AcceptMsg(0, proposal, config.learner_ids)))
+    return prepare_and_accept, args
+
+
+def setup_proposer_prepare_response(count, num_acceptors=3):
+    """
+    Each operation is one prepare response.  A fresh protocol instance is
+    used per round of responses from all acceptors, so that every round
+    reaches a majority and sends accept messages.
+    """
+    config = get_config(num_acceptors)
+    agent = StubAgent(config)
+    args = []
+    instance = 0
+    while len(args) < count:
+        instance += 1
+        protocol = BasicPaxosProposerProtocol(
+            agent, Proposal(instance, instance, 0))
+        protocol.request = instance
+        protocol.state = protocol.PREPARE_SENT
+        protocol.sent_at = agent.clock()
+        for pid in config.acceptor_ids:
+            msg = PrepareResponseMsg(pid, protocol.proposal,
+                                     Proposal(-1, None))
+            args.append((protocol, msg))
+    return BasicPaxosProposerProtocol.handle_prepare_response, args[:count]
+
+
+def setup_learner_accept_response(count, num_acceptors=3):
+    """
+    Each operation is one accept response, with a fresh protocol instance per
+    round of responses from all acceptors, as in the proposer benchmark.
+    """
+    config = get_config(num_acceptors)
+    agent = StubAgent(config, pid=num_acceptors + 1)
+    args = []
+    instance = 0
+    while len(args) < count:
+        instance += 1
+        protocol = BasicPaxosLearnerProtocol(agent)
+        proposal = Proposal(instance, instance, 0, instance)
+        for pid in config.acceptor_ids:
+            args.append((protocol, AcceptResponseMsg(pid, proposal)))
+    return BasicPaxosLearnerProtocol.handle_accept_response, args[:count]
+
+
+def setup_majority(count, num_acceptors=3):
+    """
+    Check a bare majority of the acceptors.
+    """
+    config = get_config(num_acceptors)
+    protocol = BasicPaxosProtocol(StubAgent(config))
+    acceptors = set(config.acceptor_ids[:num_acceptors // 2 + 1])
+    return protocol.have_acceptor_majority, [(acceptors, 1)] * count
+
+
+def example_messages():
+    proposal = Proposal(10, 7, 0, "value")
+    return [
+        PrepareMsg(0, proposal),
+        PrepareResponseMsg(1, proposal, Proposal(5, 7, 0, "other")),
+        AcceptMsg(0, proposal, [4]),
+        AcceptResponseMsg(1, proposal),
+    ]
+
+
+def setup_encode(count, msg):
+    mailbox = StubMailbox()
+    return mailbox.encode, [(msg,)] * count
+
+
+def setup_decode(count, msg):
+    mailbox = StubMailbox()
+    return mailbox.decode, [(mailbox.encode(msg),)] * count
+
+
+def benchmarks():
+    """
+    Yield (name, setup function, setup keyword arguments) of every benchmark.
+    """
+    for num_acceptors in (3, 11):
+        kwargs = dict(num_acceptors=num_acceptors)
+        yield ("acceptor.handle_prepare/{}".format(num_acceptors),
+               setup_acceptor_prepare, kwargs)
+        yield ("acceptor.handle_accept/{}".format(num_acceptors),
+               setup_acceptor_accept, kwargs)
+        yield ("proposer.handle_prepare_response/{}".format(num_acceptors),
+               setup_proposer_prepare_response, kwargs)
+        yield ("learner.handle_accept_response/{}".format(num_acceptors),
+               setup_learner_accept_response, kwargs)
+    for acceptor in ACCEPTOR_CLASSES:
+        yield ("acceptor.new_instance/{}".format(acceptor),
+               setup_acceptor_instances, dict(acceptor=acceptor))
+    for num_acceptors in ACCEPTOR_COUNTS:
+        yield ("have_acceptor_majority/{}".format(num_acceptors),
+               setup_majority, dict(num_acceptors=num_acceptors))
+    for msg in example_messages():
+        name = type(msg).__name__
+        yield ("encode/{}".format(name), setup_encode, dict(msg=msg))
+        yield ("decode/{}".format(name), setup_decode, dict(msg=msg))
+
+
+def time_ops(func, args):
+    """
+    Return the seconds taken to call func once with each argument tuple.
+    """
+    start = time.perf_counter()
+    for a in args:
+        func(*a)
+    return time.perf_counter() - start
+
+
+def measure_allocations(func, args):
+    """
+    Return the (blocks, bytes, peak bytes) allocated per call of func, on
+    average over the argument tuples.  Blocks and bytes are those still
+    allocated after the calls, peak bytes the most allocated during a call.
+    """
+    tracemalloc.start()
+    try:
+        peak = 0
+        before = tracemalloc.take_snapshot()
+        for a in args:
+            tracemalloc.reset_peak()
+            start, _ = tracemalloc.get_traced_memory()
+            func(*a)
+            _, call_peak = tracemalloc.get_traced_memory()
+            peak += call_peak - start
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    # Leave out tracemalloc's own allocations.
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    stats = after.filter_traces(ignore).compare_to(
+        before.filter_traces(ignore), 'filename')
+    blocks = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+    count = len(args)
+    return blocks / count, size / count, peak / count
+
+
+def run_benchmark(setup, iterations=100000, alloc_iterations=1000, **kwargs):
+    """
+    Run a benchmark, returning its (operations per second, blocks per
+    operation, bytes per operation, peak bytes per operation).  The fastest
+    of three timed runs is used.
+    """
+    best = None
+    for _ in range(3):
+        func, args = setup(iterations, **kwargs)
+        elapsed = time_ops(func, args)
+        if best is None or elapsed < best:
+            best = elapsed
+    func, args = setup(alloc_iterations, **kwargs)
+    blocks, size, peak = measure_allocations(func, args)
+    return iterations / best, blocks, size, peak
+
+
+def run_suite(iterations=100000):
+    print("{:<45} {:>12} {:>9} {:>9} {:>9}".format(
+          "benchmark", "ops/sec", "blocks", "bytes", "peak"))
+    for name, setup, kwargs in benchmarks():
+        ops, blocks, size, peak = run_benchmark(setup, iterations, **kwargs)
+        print("{:<45} {:>12,.0f} {:>9.2f} {:>9.1f} {:>9.1f}".format(
+              name, ops, blocks, size, peak))
+
+
+if __name__ == "__main__":
+    run_suite(*[int(arg) for arg in sys.argv[1:2]])
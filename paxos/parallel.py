@@ -0,0 +1,131 @@
+"""
+An acceptor that spreads its instances over several processes.
+
+Instances are independent, so an acceptor's state can be partitioned by
+instance.  A ``ParallelAcceptor`` starts ``SystemConfig.acceptor_workers``
+worker processes (``default_workers`` if not set) when it's configured, one
+per partition.  The mailbox gives the acceptor an inbox per partition, and
+senders put the prepare and accept messages of instance ``i`` straight into
+the inbox of partition ``i % acceptor_workers`` (see sim.Mailbox), so the
+acceptor's own process only handles control messages and isn't on the path
+of the protocol's messages.  A worker handles the messages of its instances
+in the order they were received, and replies through the mailbox as the
+acceptor (with its pid), so the rest of the system doesn't know about the
+workers.
+
+Use it with ``SystemConfig(acceptor_class=ParallelAcceptor,
+acceptor_workers=...)``.
+"""
+
+from queue import Empty
+
+from paxos import Acceptor, handles
+from paxos.messages import PrepareMsg, AcceptMsg, QuitMsg
+from paxos.sim import get_context
+
+
+class AcceptorWorker(Acceptor):
+    """
+    Handles the instances of one partition of a ParallelAcceptor, reading
+    messages from the partition's inbox.
+    """
+
+    def __init__(self, pid, mailbox, logger, index, inbox):
+        super(AcceptorWorker, self).__init__(pid, mailbox, logger)
+        self.index = index
+        self.inbox = inbox
+
+    def run(self, config=None):
+        if config is not None:
+            self.set_config(config)
+        while self.active:
+            try:
+                msg = self.recv()
+            except Empty:
+                self.process_timeout()
+                continue
+            self.process_message(msg)
+
+    def recv(self):
+        return self.mailbox.recv(self.inbox, self.timeout)
+
+    def start_trace(self, trace_dir, name=None):
+        super(AcceptorWorker, self).start_trace(
+            trace_dir, "{}.{}".format(self.pid, self.index))
+
+    def export_metrics(self):
+        self.update_gauges()
+        self.mailbox.export_metrics("{}.{}".format(self.pid, self.index),
+                                    self.metrics.snapshot())
+
+    def update_gauges(self):
+        depth = self.mailbox.depth(self.inbox)
+        if depth is not None:
+            self.metrics.gauge("inbox_depth", depth)
+
+    @handles(QuitMsg)
+    def handle_quit(self, msg=None):
+        # Unlike other agents, a worker doesn't shut the shared mailbox down;
+        # its acceptor does.
+        if self.config and self.config.metrics_interval:
+            self.export_metrics()
+        if self.tracer:
+            self.tracer.close()
+        self.stop()
+        self.active = False
+
+
+class ParallelAcceptor(Acceptor):
+    """
+    An acceptor whose instances are handled by worker processes, partitioned
+    by instance number.  It keeps no instance state itself.
+    """
+
+    # Number of workers unless SystemConfig.acceptor_workers is set.  Each
+    # worker is a process, so a few already spread the load of a busy
+    # acceptor without taking over a machine that runs the whole system.
+    default_workers = 2
+
+    def __init__(self, *args, **kwargs):
+        super(ParallelAcceptor, self).__init__(*args, **kwargs)
+        self.workers = []
+
+    def set_config(self, config):
+        super(ParallelAcceptor, self).set_config(config)
+        if not self.workers:
+            self.start_workers(config)
+
+    def start_workers(self, config):
+        context = get_context(config)
+        for index, inbox in enumerate(self.mailbox.partitions[self.pid]):
+            # The worker is only given its own inbox.
+            worker = AcceptorWorker(self.pid, self.mailbox.for_inbox(inbox),
+                                    self.logger, index, inbox)
+            process = context.Process(
+                target=worker.run, args=(config,),
+                name="AcceptorWorker-{}.{}".format(self.pid, index))
+            process.start()
+            self.workers.append(process)
+
+    def forward(self, msg):
+        """
+        Pass a prepare or accept message that reached the acceptor's own
+        inbox on to the inbox of its partition.
+        """
+        self.mailbox.send(self.pid, msg)
+
+    @handles(PrepareMsg)
+    def handle_prepare(self, msg):
+        self.forward(msg)
+
+    @handles(AcceptMsg)
+    def handle_accept(self, msg):
+        self.forward(msg)
+
+    @handles(QuitMsg)
+    def handle_quit(self, msg=None):
+        for inbox in self.mailbox.partitions[self.pid]:
+            self.mailbox.send(inbox, QuitMsg(None))
+        for process in self.workers:
+            process.join()
+        super(ParallelAcceptor, self).handle_quit(msg)
@@ -8,34 +8,42 @@ class BasicPaxosProtocol:
     def __init__(self, agent):
         self.agent = agent
 
-    def have_acceptor_majority(self, acceptors):
+    def have_acceptor_majority(self, acceptors, instance):
         """
         Return True or False, depending on whether or not the passed collection
-        of acceptors make up a majority.
+        of acceptors make up a majority of the weight in effect for instance.
         """
-        config = self.agent.config
-        majority_weight = config.total_weight / float(2)
-        current_weight = sum([config.weights[i] for i in acceptors])
+        weights, total_weight = self.agent.get_weights(instance)
+        majority_weight = total_weight / float(2)
+        current_weight = sum([weights.get(i, 0) for i in acceptors])
         return current_weight > majority_weight
 
-    def tally_outbound_msgs(self):
+    def tally_outbound_msgs(self, key, acceptor_ids):
+        """
+        Tell the analyzer, if any, that the message identified by key was sent
+        to the given acceptors.
+        """
         if self.agent.analyzer:
-            for pid in self.agent.config.acceptor_ids:
-                self.agent.analyzer.add_send(pid)
+            for pid in acceptor_ids:
+                self.agent.analyzer.add_send(pid, key)
 
-    def tally_inbound_msgs(self, pid):
+    def tally_inbound_msgs(self, pid, key):
         if self.agent.analyzer:
-            self.agent.analyzer.add_recvd(pid)
+            self.agent.analyzer.add_recvd(pid, key)
 
     def adjust_weights(self):
         if self.agent.analyzer:
             self.agent.analyzer.check()
             if self.agent.analyzer.weight_changed:
                 weights = self.agent.analyzer.weights
-                source = self.agent.pid
-                msg = AdjustWeightsMsg(source, weights)
-                self.agent.send_message(msg, self.agent.config.learner_ids)
-                print("--RATIOS--{}".format(self.agent.analyzer.msg_ratios))
+                if self.agent.schedule:
+                    self.agent.propose_reconfiguration(weights)
+                else:
+                    source = self.agent.pid
+                    msg = AdjustWeightsMsg(source, weights)
+                    self.agent.send_message(msg, self.agent.config.learner_ids)
+                print("--RELIABILITY--{}".format(self.agent.analyzer.reliability))
+                print("--LATENCY--{}".format(self.agent.analyzer.latency))
                 print("--WEIGHTS--{}".format(weights))
                 self.agent.analyzer.weight_changed = False
 
@@ -52,17 +60,29 @@ class BasicPaxosProposerProtocol(BasicPaxosProtocol):
         self.highest_proposal_from_promises = Proposal(-1, None)
         self.accept_responders = set()
 
-        # States.
+        # States, and the time the messages of the current state were sent.
         self.state = None
+        self.sent_at = None
         self.PREPARE_SENT = 0
         self.ACCEPT_SENT = 1
+        self.DECIDED = 2
 
     def handle_client_request(self, proposal):
         next_msg = PrepareMsg(proposal.pid, proposal)
-        self.agent.send_message(next_msg, self.agent.config.acceptor_ids)
+        acceptor_ids, _ = self.agent.get_members(proposal.instance)
+        self.agent.send_message(next_msg, acceptor_ids)
         # if dynamic weights, tally messages
-        self.tally_outbound_msgs()
+        self.tally_outbound_msgs(self.analyzer_key(self.PREPARE_SENT),
+                                 acceptor_ids)
         self.state = self.PREPARE_SENT
+        self.sent_at = self.agent.clock()
+
+    def analyzer_key(self, state):
+        """
+        Return the key identifying, for the analyzer, the messages sent by this
+        protocol instance in the given state.
+        """
+        return (state, self.proposal.instance, self.proposal.number)
 
     def handle_prepare_response(self, msg):
         """
@@ -72,12 +92,14 @@ class BasicPaxosProposerProtocol(BasicPaxosProtocol):
         accept messages to acceptors.
         """
         self.prepare_responders.add(msg.source)
-        self.tally_inbound_msgs(msg.source)
+        self.tally_inbound_msgs(msg.source,
+                                self.analyzer_key(self.PREPARE_SENT))
         if msg.highest_proposal.number > self.highest_proposal_from_promises.number:
             self.highest_proposal_from_promises = msg.highest_proposal
         # Check that we have sent prepare but not yet sent accept.
         if self.state == self.PREPARE_SENT:
-            if self.have_acceptor_majority(self.prepare_responders):
+            if self.have_acceptor_majority(self.prepare_responders,
+                                           self.proposal.instance):
                 # If we have received any prepare responses with a higher
                 # proposal number, we must use the value in that proposal.
                 # If that value is None, then we get to choose (i.e. we'll use
@@ -90,17 +112,34 @@ class BasicPaxosProposerProtocol(BasicPaxosProtocol):
                 else:
                     self.proposal.value = self.request
                     self.client_request_handled = True
-                next_msg = AcceptMsg(self.agent.pid, self.proposal)
+                acceptor_ids, learner_ids = \
+                        self.agent.get_members(self.proposal.instance)
+                next_msg = AcceptMsg(self.agent.pid, self.proposal, learner_ids)
                 # Can send to all acceptors or just the ones that responded.
-                self.agent.send_message(next_msg, self.agent.config.acceptor_ids)
+                self.agent.send_message(next_msg, acceptor_ids)
                 #self.agent.send_message(next_msg, self.prepare_responders)
-                self.tally_outbound_msgs()
+                self.tally_outbound_msgs(self.analyzer_key(self.ACCEPT_SENT),
+                                         acceptor_ids)
+                now = self.agent.clock()
+                self.agent.metrics.observe("quorum_wait.prepare",
+                                           now - self.sent_at)
                 self.state = self.ACCEPT_SENT
+                self.sent_at = now
 
     def handle_accept_response(self, msg):
         self.accept_responders.add(msg.source)
-        self.tally_inbound_msgs(msg.source)
-        if self.have_acceptor_majority(self.accept_responders):
+        self.tally_inbound_msgs(msg.source, self.analyzer_key(self.ACCEPT_SENT))
+        if self.have_acceptor_majority(self.accept_responders,
+                                       self.proposal.instance):
+            if self.state != self.DECIDED:
+                self.agent.metrics.observe("quorum_wait.accept",
+                                           self.agent.clock() - self.sent_at)
+                self.agent.metrics.count("instances_decided")
+                self.agent.trace_decision(self.proposal.instance,
+                                          self.proposal.number)
+                self.state = self.DECIDED
+                self.agent.record_decision(self.proposal.instance,
+                                           self.proposal.value)
             self.adjust_weights()
 
 class BasicPaxosAcceptorProtocol(BasicPaxosProtocol):
@@ -129,8 +168,10 @@ class BasicPaxosAcceptorProtocol(BasicPaxosProtocol):
             next_msg = AcceptResponseMsg(self.agent.pid, msg.proposal)
             # Send "accepted" message to sender of the accept message
             # (the proposer), and to all learners.
-            self.agent.send_message(next_msg,
-                              [msg.source] + list(self.agent.config.learner_ids))
+            learner_ids = msg.learner_ids
+            if learner_ids is None:
+                learner_ids = self.agent.config.learner_ids
+            self.agent.send_message(next_msg, [msg.source] + list(learner_ids))
 
 
 class BasicPaxosLearnerProtocol(BasicPaxosProtocol):
@@ -139,15 +180,35 @@ class BasicPaxosLearnerProtocol(BasicPaxosProtocol):
         super(BasicPaxosLearnerProtocol, self).__init__(agent)
         # Set of acceptors that have sent an accept response.
         self.accept_responders = defaultdict(set)
+        # Time of the first accept response.
+        self.first_response_at = None
 
         self.state = None
         self.RESULT_SENT = 1
 
     def handle_accept_response(self, msg):
+        if self.first_response_at is None:
+            self.first_response_at = self.agent.clock()
         self.accept_responders[msg.proposal.value].add(msg.source)
+        self.check(msg)
+
+    def check(self, msg):
+        """
+        Log the result if the acceptors that accepted msg's proposal make up a
+        majority.  If the weights of the instance aren't known yet, the check
+        is deferred by the agent until they are.
+        """
         # Don't do anything if we've already logged the result.
         if self.state == self.RESULT_SENT:
             return
-        if self.have_acceptor_majority(self.accept_responders[msg.proposal.value]):
+        instance = msg.proposal.instance
+        if self.agent.schedule and not self.agent.schedule.known(instance):
+            self.agent.defer(self, msg)
+            return
+        if self.have_acceptor_majority(self.accept_responders[msg.proposal.value],
+                                       instance):
+            self.agent.metrics.observe(
+                    "quorum_wait.learn",
+                    self.agent.clock() - self.first_response_at)
             self.agent.log_result(msg)
             self.state = self.RESULT_SENT
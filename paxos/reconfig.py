@@ -0,0 +1,180 @@
+"""
+Reconfiguration of acceptor weights and membership through the Paxos log.
+
+A change is proposed as a regular value, a ``Reconfiguration``.  When it is
+chosen in instance i, it takes effect from instance i + alpha, where alpha
+is the ``reconfiguration_window`` of the system configuration.  So every
+agent counts quorums of an instance with the same weights and members, as
+long as it knows the decisions of all instances up to alpha before it.
+Proposers only start instances within alpha of their first undecided
+instance, which lets them keep up to alpha instances in flight through a
+reconfiguration.
+
+The acceptors of a configuration are the keys of its weights, so a new
+acceptor can join with empty state: no instance of the configuration it
+joins has been started before the configuration took effect.
+"""
+
+from bisect import bisect_right
+
+
+class Reconfiguration:
+    """
+    A log entry value that changes the weights of current acceptors.
+    Weights of processes that are not acceptors when the change takes
+    effect are ignored.
+    """
+
+    def __init__(self, weights):
+        self.weights = dict(weights)
+
+    def apply(self, weights, learner_ids):
+        """
+        Return the (weights, learner ids) pair resulting from applying this
+        change to the given ones.
+        """
+        weights = dict((pid, self.weights.get(pid, weight))
+                       for pid, weight in weights.items())
+        return weights, learner_ids
+
+    def key(self):
+        return tuple(sorted(self.weights.items()))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash((type(self).__name__, self.key()))
+
+    def __str__(self):
+        return "Reconfiguration: {}".format(self.weights)
+
+
+class MembershipChange(Reconfiguration):
+    """
+    A log entry value that adds and/or removes acceptors and learners.
+    Added acceptors get the given weight, or by default the mean weight of
+    the current acceptors.
+    """
+
+    def __init__(self, add_acceptors=(), remove_acceptors=(),
+                 add_learners=(), remove_learners=(), weight=None):
+        self.add_acceptors = tuple(add_acceptors)
+        self.remove_acceptors = tuple(remove_acceptors)
+        self.add_learners = tuple(add_learners)
+        self.remove_learners = tuple(remove_learners)
+        self.weight = weight
+
+    def apply(self, weights, learner_ids):
+        weight = self.weight
+        if weight is None:
+            weight = sum(weights.values()) / len(weights) if weights else 1
+        weights = dict((pid, w) for pid, w in weights.items()
+                       if pid not in self.remove_acceptors)
+        for pid in self.add_acceptors:
+            weights[pid] = weight
+        learner_ids = [pid for pid in learner_ids
+                       if pid not in self.remove_learners]
+        learner_ids += [pid for pid in self.add_learners
+                        if pid not in learner_ids]
+        return weights, learner_ids
+
+    def key(self):
+        return (self.add_acceptors, self.remove_acceptors,
+                self.add_learners, self.remove_learners, self.weight)
+
+    def __str__(self):
+        return "Membership Change: +A{} -A{} +L{} -L{}".format(
+            list(self.add_acceptors), list(self.remove_acceptors),
+            list(self.add_learners), list(self.remove_learners))
+
+
+class ConfigSchedule:
+    """
+    The configurations (acceptor weights and learners) in effect over ranges
+    of instances, together with the prefix of instances that are known to be
+    decided.
+    """
+
+    def __init__(self, weights, total_weight, learner_ids, window):
+        self.window = window
+        self.initial = (dict(weights), total_weight, list(learner_ids))
+        # Scheduled (first instance, Reconfiguration) pairs, sorted.
+        self.changes = []
+        # Sorted first instances of each configuration and the matching
+        # (weights, total weight, learner ids) tuples.
+        self.starts = [0]
+        self.configs = [self.initial]
+        # Decided instances above first_undecided.
+        self.decided = set()
+        self.first_undecided = 1
+
+    def record(self, instance, value):
+        """
+        Record the decision of an instance, scheduling the value if it is a
+        Reconfiguration.  Recording an instance more than once is harmless.
+        """
+        if instance < self.first_undecided or instance in self.decided:
+            return
+        if isinstance(value, Reconfiguration):
+            self.add(instance + self.window, value)
+        self.decided.add(instance)
+        while self.first_undecided in self.decided:
+            self.decided.remove(self.first_undecided)
+            self.first_undecided += 1
+
+    def add(self, start, reconfig):
+        """
+        Schedule reconfig to take effect from instance start.  Changes may be
+        added in any order; the configurations are rebuilt by applying them
+        in instance order.
+        """
+        starts = [s for s, _ in self.changes]
+        index = bisect_right(starts, start)
+        if index and starts[index - 1] == start:
+            self.changes[index - 1] = (start, reconfig)
+        else:
+            self.changes.insert(index, (start, reconfig))
+        self.rebuild()
+
+    def rebuild(self):
+        weights, total_weight, learner_ids = self.initial
+        self.starts = [0]
+        self.configs = [self.initial]
+        for start, reconfig in self.changes:
+            weights, learner_ids = reconfig.apply(weights, learner_ids)
+            total_weight = sum(weights.values())
+            self.starts.append(start)
+            self.configs.append((weights, total_weight, learner_ids))
+
+    def known(self, instance):
+        """
+        Return True if the configuration of instance is known, i.e. all
+        instances that could reconfigure it have been decided.
+        """
+        return instance < self.first_undecided + self.window
+
+    def config_for(self, instance):
+        return self.configs[bisect_right(self.starts, instance) - 1]
+
+    def weights_for(self, instance):
+        """
+        Return the (weights, total weight) pair in effect for instance.
+        """
+        weights, total_weight, _ = self.config_for(instance)
+        return weights, total_weight
+
+    def members_for(self, instance):
+        """
+        Return the (acceptor ids, learner ids) pair in effect for instance.
+        """
+        weights, _, learner_ids = self.config_for(instance)
+        return sorted(weights), learner_ids
+
+    def latest_members(self):
+        """
+        Return the (acceptor ids, learner ids) pair of the last scheduled
+        configuration.
+        """
+        weights, _, learner_ids = self.configs[-1]
+        return sorted(weights), learner_ids
@@ -0,0 +1,442 @@
+"""
+Storage and bookkeeping of the values learned by the learners of a system.
+"""
+
+from array import array
+import asyncio
+from collections import deque, namedtuple
+import queue
+from threading import Condition
+
+
+class ResultTable:
+    """
+    The values learned by each learner, stored by column: one array per
+    learner, indexed by instance, of codes of the learned values (-1 where
+    nothing was learned).  Values are interned in a list, so each distinct
+    value is stored once however many learners learned it.
+
+    The counts that ``sim.ResultSummary`` reports, over the configured
+    learners and the instances of the first ``num_instances`` requests, are
+    kept up to date as results are recorded, so summarizing a run doesn't
+    depend on its size.  With a single consensus group, the requests are
+    decided in instances 1 to num_instances.  With ``num_groups`` groups,
+    each group decides its requests in its own sequence of instances (see
+    paxos.groups), so the instances counted are the first of each group's
+    sequence, as many as there were requests routed to it (see
+    count_request).
+    """
+
+    MISSING = -1
+
+    def __init__(self, learner_ids, num_instances, num_groups=1):
+        # The learners, and the number of requests, that are counted.
+        self.learner_ids = list(learner_ids)
+        self.counted = set(learner_ids)
+        self.num_instances = num_instances
+        self.num_groups = num_groups
+        # Number of counted requests routed to each group.
+        self.requests = [0] * num_groups
+        self.num_requests = 0
+        # Code of each learned value, and the value of each code.
+        self.codes = {}
+        self.values = []
+        # Learner pid mapped to its column of value codes.
+        self.columns = {}
+        # Per counted instance: the number of counted learners that learned
+        # it, the code of the first value learned, and whether learners
+        # learned different values.  With several groups, these grow as
+        # requests are counted.
+        size = num_instances + 1 if num_groups == 1 else 1
+        self.learned_counts = array('l', [0]) * size
+        self.first_codes = array('q', [self.MISSING]) * size
+        self.conflicts = bytearray(size)
+        # Number of counted instances by the number of learners that learned
+        # them, and running totals.
+        self.instances_by_count = [0] * (len(self.learner_ids) + 1)
+        self.instances_by_count[0] = num_instances
+        self.learned = 0
+        self.bad = 0
+        self.bad_complete = 0
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def column(self, pid):
+        if pid not in self.columns:
+            self.columns[pid] = array('q')
+        return self.columns[pid]
+
+    def is_counted(self, instance):
+        """
+        Return True if instance is one of the counted requests' instances.
+        """
+        if instance < 1:
+            return False
+        if self.num_groups == 1:
+            return instance <= self.num_instances
+        group = (instance - 1) % self.num_groups
+        return (instance - 1) // self.num_groups < self.requests[group]
+
+    def counted_instances(self):
+        """
+        Return the counted instances, in order.
+        """
+        if self.num_groups == 1:
+            return range(1, self.num_instances + 1)
+        return sorted(
+            number * self.num_groups + group + 1
+            for group, count in enumerate(self.requests)
+            for number in range(count))
+
+    def count_request(self, group):
+        """
+        Count the next instance of group's sequence, which a request routed
+        to group is decided in, unless num_instances requests are already
+        counted.  Values already learned in the instance are counted too.
+        Only needed with several groups.
+        """
+        if self.num_groups == 1 or self.num_requests >= self.num_instances:
+            return
+        instance = self.requests[group] * self.num_groups + group + 1
+        self.requests[group] += 1
+        self.num_requests += 1
+        if instance >= len(self.learned_counts):
+            grow = max(instance + 1, 2 * len(self.learned_counts)) - \
+                len(self.learned_counts)
+            self.learned_counts.extend(array('l', [0]) * grow)
+            self.first_codes.extend(array('q', [self.MISSING]) * grow)
+            self.conflicts.extend(bytearray(grow))
+        for pid in self.learner_ids:
+            column = self.columns.get(pid, ())
+            if instance < len(column) and column[instance] != self.MISSING:
+                self.count(instance, self.MISSING, column[instance])
+
+    def record(self, pid, instance, value):
+        """
+        Store the value learned by learner pid in instance and update the
+        counts.
+        """
+        code = self.encode(value)
+        column = self.column(pid)
+        if instance >= len(column):
+            # Grow by at least doubling, so that appending is amortized O(1).
+            grow = max(instance + 1, 2 * len(column)) - len(column)
+            column.extend(array('q', [self.MISSING]) * grow)
+        previous = column[instance]
+        column[instance] = code
+        if pid in self.counted and previous != code and \
+                self.is_counted(instance):
+            self.count(instance, previous, code)
+
+    def count(self, instance, previous, code):
+        """
+        Update the counts of a counted instance, where a counted learner
+        learned the value of code instead of previous.
+        """
+        n = len(self.learner_ids)
+        count = self.learned_counts[instance]
+        was_bad_complete = self.conflicts[instance] and count == n
+        if previous == self.MISSING:
+            self.learned += 1
+            self.instances_by_count[count] -= 1
+            count += 1
+            self.instances_by_count[count] += 1
+            self.learned_counts[instance] = count
+        first = self.first_codes[instance]
+        if first == self.MISSING:
+            self.first_codes[instance] = code
+        elif code != first and not self.conflicts[instance]:
+            self.conflicts[instance] = 1
+            self.bad += 1
+        if self.conflicts[instance] and count == n and not was_bad_complete:
+            self.bad_complete += 1
+
+    def get(self, pid, instance):
+        """
+        Return the value learned by pid in instance, or None.
+        """
+        column = self.columns.get(pid)
+        if column is None or instance >= len(column) or \
+                column[instance] == self.MISSING:
+            return None
+        return self.values[column[instance]]
+
+    def pids(self):
+        return list(self.columns)
+
+    def as_dict(self, pid):
+        """
+        Return a dict mapping instance to the value learned by pid.
+        """
+        values = self.values
+        return dict((instance, values[code])
+                    for instance, code in enumerate(self.columns.get(pid, ()))
+                    if code != self.MISSING)
+
+    def as_dicts(self):
+        """
+        Return a dict mapping each learner pid to its as_dict.
+        """
+        return dict((pid, self.as_dict(pid)) for pid in self.columns)
+
+    def to_numpy(self):
+        """
+        Return the codes of the counted learners and instances as a NumPy
+        array indexed by [learner, n], where n is the instance's position
+        among the counted instances, from 1, and the list of values by code.
+        Requires NumPy.
+        """
+        import numpy
+        matrix = numpy.full((len(self.learner_ids), self.num_instances + 1),
+                            self.MISSING, dtype=numpy.int64)
+        # With several groups, the counted instances are spread over the
+        # groups' sequences, so they're gathered into columns 1 onwards.
+        instances = numpy.array(self.counted_instances(), dtype=numpy.int64)
+        for row, pid in enumerate(self.learner_ids):
+            column = self.columns.get(pid)
+            if column:
+                codes = numpy.frombuffer(column, dtype=numpy.int64)
+                learned = instances[instances < len(codes)]
+                matrix[row, 1:len(learned) + 1] = codes[learned]
+        return matrix, self.values
+
+    def counts(self):
+        """
+        Return a dict of the counts over the counted learners and instances:
+        learned and missing values, and consistent ("good"), inconsistent
+        ("bad"), empty, incomplete and complete instances.
+        """
+        n = len(self.learner_ids)
+        total_values = n * self.num_instances
+        empty = self.instances_by_count[0] if n else self.num_instances
+        complete = (self.instances_by_count[n] - self.bad_complete) if n else 0
+        good = self.num_instances - self.bad
+        return {
+            "learned": self.learned,
+            "missing": total_values - self.learned,
+            "total": total_values,
+            "good": good,
+            "bad": self.bad,
+            "empty": empty,
+            "incomplete": good - empty - complete,
+            "complete": complete,
+        }
+
+
+class DecisionStream:
+    """
+    An iterator over the decisions of one learner, as (instance, value) pairs
+    in instance order, starting at instance ``start``.  Results that arrive
+    out of order are held back until the instances before them are learned,
+    so a stream stalls at an instance its learner never learns.
+
+    With ``num_groups`` consensus groups, each group decides its own
+    sequence of instances (see paxos.groups), and a group that gets fewer
+    requests leaves the others' instances without neighbours.  Decisions
+    are then in the order of each group's sequence, and held back only by
+    that group's earlier instances.
+
+    Ordered decisions wait for the consumer in a buffer of ``maxsize``
+    decisions (unbounded if 0).  When the buffer is full, a thread recording
+    results with ``block=True`` waits until the consumer catches up or the
+    stream is closed, so a consumer should keep reading its stream until it
+    ends.  Recording with ``block=False`` lets the buffer grow instead.
+    """
+
+    def __init__(self, pid, maxsize=1000, start=1, num_groups=1):
+        self.pid = pid
+        self.maxsize = maxsize
+        self.num_groups = num_groups
+        # Next instance of each group's sequence, the first from start on.
+        self.next_instances = [start + (group - start + 1) % num_groups
+                               for group in range(num_groups)]
+        # Results that arrived ahead of their group's next instance.
+        self.waiting = {}
+        # Ordered decisions not yet read.
+        self.ready = deque()
+        self.closed = False
+        self.condition = Condition()
+
+    def put(self, instance, value, block=True):
+        """
+        Add a learned result.  Called by the thread recording results; if
+        block is False, the buffer may grow past maxsize instead.
+        """
+        with self.condition:
+            group = (instance - 1) % self.num_groups
+            next_instance = self.next_instances[group]
+            if instance < next_instance:
+                return
+            self.waiting[instance] = value
+            while next_instance in self.waiting:
+                self.ready.append((next_instance,
+                                   self.waiting.pop(next_instance)))
+                next_instance += self.num_groups
+            self.next_instances[group] = next_instance
+            self.condition.notify_all()
+            if block and self.maxsize:
+                while len(self.ready) > self.maxsize and not self.closed:
+                    self.condition.wait()
+
+    def close(self):
+        """
+        End the stream once the consumer has read the buffered decisions.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def get(self, timeout=None):
+        """
+        Return the next (instance, value) pair, or None if the stream has
+        ended.  Raises queue.Empty if none arrives within timeout seconds.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.ready or self.closed, timeout)
+            if self.ready:
+                item = self.ready.popleft()
+                self.condition.notify_all()
+                return item
+            if self.closed:
+                return None
+            raise queue.Empty
+
+    def __iter__(self):
+        while True:
+            item = self.get()
+            if item is None:
+                return
+            yield item
+
+    async def __aiter__(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await loop.run_in_executor(None, self.get)
+            if item is None:
+                return
+            yield item
+
+
+AcceptorState = namedtuple("AcceptorState", ["promised", "accepted"])
+
+
+class SafetyChecker:
+    """
+    Checks the safety of a run as events arrive: that learners agree on the
+    value decided in each instance (the first value decided is taken as the
+    chosen one), and, from the states reported by acceptors, that no acceptor
+    lowers the number it promised or accepts a proposal below a number it
+    promised.
+
+    Checking an event is a few dict operations.  So that the checker can stay
+    on in long runs, with a ``window``, instances that every learner in
+    ``learner_ids`` has decided are forgotten once ``window`` more instances
+    have been; later events for them can't be checked and are only counted.
+    With ``num_groups`` consensus groups, instances are forgotten along each
+    group's own sequence (see paxos.groups), so that a group that gets fewer
+    requests doesn't hold back forgetting the others' instances, and the
+    window counts instances of the same group.
+    """
+
+    def __init__(self, learner_ids=(), window=None, num_groups=1):
+        self.learner_ids = set(learner_ids)
+        self.window = window
+        self.num_groups = num_groups
+        # Per instance: the chosen value, the learners that decided it, and
+        # each acceptor's highest promised and accepted numbers.
+        self.chosen = {}
+        self.deciders = {}
+        self.acceptors = {}
+        # Per group, the instances of its sequence below complete_below have
+        # been decided by every learner, those below pruned_below have been
+        # forgotten.
+        self.complete_below = [group + 1 for group in range(num_groups)]
+        self.pruned_below = list(self.complete_below)
+        self.unchecked = 0
+        # (instance, pid, value, chosen value) of each conflicting decision.
+        self.conflicts = []
+        # (instance, pid, description) of each broken acceptor invariant.
+        self.violations = []
+
+    def check_decision(self, pid, instance, value):
+        """
+        Return True if value agrees with what was decided before in instance.
+        """
+        group = (instance - 1) % self.num_groups
+        if instance < self.pruned_below[group]:
+            self.unchecked += 1
+            return True
+        chosen = self.chosen.setdefault(instance, value)
+        if chosen != value:
+            self.conflicts.append((instance, pid, value, chosen))
+            print("*** Inconsistent result: process {} learned {} in instance "
+                  "{}, already learned as {}".format(pid, value, instance,
+                                                     chosen))
+            return False
+        self.deciders.setdefault(instance, set()).add(pid)
+        if instance == self.complete_below[group]:
+            self.advance(group)
+        return True
+
+    def check_acceptor(self, pid, instance, state):
+        """
+        Check the AcceptorState that acceptor pid reported for instance
+        against the ones it reported before.  Return True if it's valid.
+        """
+        if instance < self.pruned_below[(instance - 1) % self.num_groups]:
+            self.unchecked += 1
+            return True
+        states = self.acceptors.setdefault(instance, {})
+        previous = states.get(pid)
+        problems = []
+        if previous:
+            if state.promised < previous.promised:
+                problems.append("promised {} after promising {}".format(
+                                state.promised, previous.promised))
+            if state.accepted != previous.accepted and \
+                    state.accepted < previous.promised:
+                problems.append("accepted {} after promising {}".format(
+                                state.accepted, previous.promised))
+            # Keep the highest promise, so that one bad report doesn't hide
+            # the next.
+            state = AcceptorState(max(state.promised, previous.promised),
+                                  state.accepted)
+        states[pid] = state
+        for problem in problems:
+            self.violations.append((instance, pid, problem))
+            print("*** Safety violation: acceptor {} {} in instance {}"
+                  .format(pid, problem, instance))
+        return not problems
+
+    def advance(self, group=0):
+        """
+        Move group's complete_below past the instances every learner has
+        decided, and forget the ones that fell out of the window.
+        """
+        step = self.num_groups
+        complete_below = self.complete_below[group]
+        while self.learner_ids and \
+                self.learner_ids <= self.deciders.get(complete_below, set()):
+            complete_below += step
+        self.complete_below[group] = complete_below
+        if self.window is None:
+            return
+        pruned_below = self.pruned_below[group]
+        while pruned_below < complete_below - self.window * step:
+            for table in (self.chosen, self.deciders, self.acceptors):
+                table.pop(pruned_below, None)
+            pruned_below += step
+        self.pruned_below[group] = pruned_below
+
+    @property
+    def consistent(self):
+        return not self.conflicts
+
+    @property
+    def safe(self):
+        return not self.conflicts and not self.violations
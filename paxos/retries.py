@@ -6,7 +6,7 @@ learned by one or more learners.
 import time
 from threading import Thread
 
-from paxos import Proposer, Learner
+from paxos import Proposer, Learner, handles
 from paxos.messages import RetryMsg
 
 
@@ -24,17 +24,14 @@ class RetryProposer(Proposer):
         # Default leader to PID 0.
         self.leader = 0
 
-    def handle_message(self, msg):
-        super(Proposer, self).handle_message(msg)
-        if isinstance(msg, RetryMsg):
-            self.handle_retry(msg)
-
+    @handles(RetryMsg)
     def handle_retry(self, msg):
         """
         Handle another process wanting to retry a run of the protocol in the
         specified instance, typically invoked by another process when it needs
         to learn the value for an instance that it doesn't know about.
         """
+        self.metrics.count("retries")
         self.handle_client_request(msg, msg.instance)
 
 
@@ -45,6 +42,8 @@ class RetryLearner(Learner):
     from a majority of Acceptors).
     """
 
+    retry_delay = 5
+
     class LoggerThread(Thread):
         """
         Helper thread to order and log results.
@@ -52,11 +51,14 @@ class RetryLearner(Learner):
         def __init__(self, agent):
             Thread.__init__(self, name="LoggerThread-{}".format(agent.pid))
             self.agent = agent
+            # Next instance to log.
+            self.counter = 1
         def run(self):
-            counter = 1
             # Even if agent is not active, we need to continue until we've
             # logged all results we've seen.
-            while self.agent.active or (counter <= self.agent.highest_instance):
+            while self.agent.active or \
+                    (self.counter <= self.agent.highest_instance):
+                counter = self.counter
                 # Wait until agent has received its configuration before starting.
                 if not self.agent.config:
                     time.sleep(0.5)
@@ -70,17 +72,21 @@ class RetryLearner(Learner):
                 try:
                     result = self.agent.results[counter]
                 except KeyError:
-                    # Wait five message delays.
-                    time.sleep(5 * self.agent.config.message_timeout)
+                    # Wait a few message delays.
+                    time.sleep(self.agent.retry_delay *
+                               self.agent.config.message_timeout)
                     # If result still not there, tell the proposer to rerun the
                     # protocol in that instance.
                     if counter not in self.agent.results:
                         msg = RetryMsg(self.agent.pid, counter)
-                        self.agent.send_message(msg, [self.agent.leader])
+                        self.agent.metrics.count("retries")
+                        self.agent.send_message(msg, [self.agent.leader],
+                                                immediate=True)
                 else:
+                    # Results are kept to serve catch-up, until they are
+                    # truncated (see Learner.truncate_results).
                     self.agent.log_result_to_logger(counter, result)
-                    del self.agent.results[counter]
-                    counter += 1
+                    self.counter += 1
 
     def __init__(self, *args, **kwargs):
         super(RetryLearner, self).__init__(*args, **kwargs)
@@ -89,15 +95,22 @@ class RetryLearner(Learner):
         # we have caught up to logging results that have come in.
         self.highest_instance = 0
 
-    def run(self):
+    def run(self, config=None):
         self.loggerthread = self.LoggerThread(self)
         self.loggerthread.start()
-        super(RetryLearner, self).run()
+        super(RetryLearner, self).run(config)
 
-    def handle_quit(self):
+    def handle_quit(self, msg=None):
         self.active = False
         self.loggerthread.join()
-        super(RetryLearner, self).handle_quit()
+        super(RetryLearner, self).handle_quit(msg)
+
+    def truncation_point(self):
+        """
+        Don't truncate results that the LoggerThread hasn't logged yet.
+        """
+        return min(super(RetryLearner, self).truncation_point(),
+                   self.loggerthread.counter)
 
     def record_result(self, instance, value):
         super(RetryLearner, self).record_result(instance, value)
@@ -106,17 +119,15 @@ class RetryLearner(Learner):
         if instance > self.highest_instance:
             self.highest_instance = instance
 
-    def log_result(self, msg):
+    def learn(self, instance, value):
         """
         Don't actually log the result yet, just record it and let the
         LoggerThread handle the ordering and logging of the results to the
         result logger object.
         """
-        instance = msg.proposal.instance
-        value = msg.proposal.value
         self.record_result(instance, value)
 
     def log_result_to_logger(self, instance, value):
         print("*** {} logging result for instance {}: {}"
               .format(self.pid, instance, value))
-        self.logger.log_result(self.pid, value)
+        self.logger.log_result(self.pid, instance, value)
@@ -1,66 +1,567 @@
-from collections import defaultdict
-from multiprocessing import Process, Queue, JoinableQueue
+from collections import deque
+import copy
+import multiprocessing
+import pickle
 import queue
-from threading import Thread
+from threading import Thread, Lock, Condition, Event
 import time
 
 from paxos import Proposer, Acceptor, Learner, BaseSystem
+from paxos.messages import (QuitMsg, ClientRequestMsg, BackpressureMsg,
+                            PayloadMsg, PrepareMsg, AcceptMsg)
+from paxos.metrics import MetricsRegistry
+from paxos.results import (ResultTable, DecisionStream, SafetyChecker,
+                           AcceptorState)
+from paxos.trace import TraceRecorder
+from paxos.reconfig import MembershipChange
+from paxos.values import ValueStore, PayloadRef
+from paxos.groups import GroupRouter
+
+
+def get_context(config):
+    """
+    Return the multiprocessing context that agent processes are started in.
+    """
+    return multiprocessing.get_context(config.start_method)
 
 
 class Mailbox:
     """
     Provides messaging functionality for a paxos system instance.
+
+    Inboxes are unbounded unless the system configuration sets an
+    ``inbox_size``.  What happens to messages for a full inbox depends on the
+    configured ``overflow_policy``:
+
+    ``"block"``
+        Senders block until the destination's inbox has room.  This
+        throttles clients, as the proposers they send requests to back up
+        behind slow acceptors and learners.  An agent that has waited for a
+        message timeout, as in a cycle of agents waiting for each other,
+        drops its frame rather than exceed the bound, so "block" can lose
+        protocol messages too; they are counted in ``num_dropped``.  Agents
+        never wait for proposers, which otherwise could be waiting for them,
+        so the inboxes of proposers are not bounded for agents' frames.
+    ``"drop_oldest"``
+        The oldest agent message waiting for the process is dropped to make
+        room.  Paxos tolerates lost messages, so any message sent by an agent
+        may be dropped; control messages sent by the system are not.
+    ``"signal"``
+        The message is delivered, and the sender and the proposers are sent
+        a ``BackpressureMsg``.  Proposers stop starting new instances until
+        the inbox has drained to half its size and they are sent another.
+        Meanwhile they hold client requests in a queue that isn't bounded,
+        so clients aren't throttled.
+
+    The mailbox thread only puts a message in a bounded inbox queue when it
+    has room, and keeps the messages waiting for room in a backlog, in
+    order.  With "drop_oldest", inbox queues are only filled to half their
+    size, so that the oldest messages are still in the backlog, where they
+    can be dropped without reordering the others.
+
+    Whatever the policy, an alert is printed when the messages waiting for
+    a process grow past the ``high_watermark`` fraction of the inbox size.
+
+    An acceptor that spreads its instances over worker processes (see
+    parallel.ParallelAcceptor) has an inbox per worker, after the inboxes of
+    the processes, and senders put the prepare and accept messages of
+    instance ``i`` straight into partition ``i % k`` of its ``k`` inboxes.
+    Each partition inbox is bounded like a process's inbox.
     """
 
     def __init__(self, config):
         self.config = config
-        self.funnel = Queue()
-        self.inbox = [Queue() for i in range(config.num_processes)]
+        # Queues are created in the context that agent processes are started
+        # in, see SystemConfig.start_method.
+        context = get_context(config)
+        self.funnel = context.Queue()
+        # Inbox bounds, see the class docstring.
+        self.capacity = config.inbox_size
+        if self.capacity and not self.has_queue_sizes(context):
+            print("Mailbox: queue sizes aren't available on this platform, "
+                  "so inboxes are unbounded")
+            self.capacity = None
+        # Partition inboxes of each acceptor with workers, by pid, and the
+        # (pid, index) of each partition inbox.
+        self.partitions = {}
+        self.partition_of = {}
+        num_inboxes = config.num_processes
+        num_partitions = config.acceptor_partitions()
+        if num_partitions:
+            for pid in config.acceptor_ids + config.spare_ids:
+                self.partitions[pid] = []
+                for index in range(num_partitions):
+                    self.partitions[pid].append(num_inboxes)
+                    self.partition_of[num_inboxes] = (pid, index)
+                    num_inboxes += 1
+        self.inbox = [context.Queue(self.capacity or 0)
+                      for i in range(num_inboxes)]
+        # Metrics snapshots exported by agents, see MetricsCollector.
+        self.metrics_queue = context.Queue()
+        # Pids of agents that are running and configured, see System.start.
+        self.ready_queue = context.Queue()
         self.message_count = 0
+        # Messages from a received frame that have not yet been handed to the
+        # agent.  Local to each agent process's copy of the mailbox.
+        self.pending = deque()
 
-        # Two flags, active to signal when we haven't received any messages
-        # for timeout_interval seconds, and terminate to signal when we have
-        # been asked to shutdown by the System.
+        # The following are updated by the mailbox thread.
+        self.overflow_policy = config.overflow_policy
+        if self.capacity:
+            self.high_watermark = max(1, int(config.high_watermark *
+                                             self.capacity))
+            # Number of messages the mailbox thread puts in an inbox queue.
+            self.inbox_limit = self.capacity
+            if self.overflow_policy == "drop_oldest":
+                self.inbox_limit = max(1, self.capacity // 2)
+        # Messages waiting for room in each inbox queue, and the processes
+        # that have any.
+        self.backlog = [deque() for i in range(num_inboxes)]
+        self.backlogged = set()
+        # With the "block" policy, the number of frames sent to each inbox
+        # that hasn't been received yet, wherever they are, shared by all
+        # processes so that senders can reserve room, and a condition per
+        # inbox, which guards its count and which receivers notify when they
+        # take a frame (see wait_for_room).
+        self.unreceived = None
+        self.room = None
+        if self.capacity and self.overflow_policy == "block":
+            self.unreceived = context.Array('l', num_inboxes, lock=False)
+            self.room = [context.Condition() for i in range(num_inboxes)]
+        # Highest depth seen of each inbox.
+        self.max_depth = [0] * num_inboxes
+        # Inboxes above the high watermark.
+        self.alerted = set()
+        # Congested inboxes, mapped to the processes that were signalled.
+        self.congested = {}
+        # Number of inbox items dropped, by the mailbox thread or by senders
+        # that gave up waiting for room, shared by all processes.
+        self.dropped = context.Value('l', 0)
+        # Trace recorders of messages dropped by an agent's copy of the
+        # mailbox (set by the agent) and by the mailbox thread.
+        self.tracer = None
+        self.drop_tracer = None
+
+        # active is cleared, and idle set, when we haven't received any
+        # messages for timeout_interval seconds, and both are restored when
+        # messages arrive again.
         self.active = True
-        self.terminate = False
+        self.idle = Event()
         # If don't receive any messages in this amount of time, then shutdown.
         self.timeout_interval = 3 * self.config.message_timeout
         # Time stamp of the last seen message, used together with
         # timeout_interval to determine when the mailbox should shutdown.
         self.last_seen = None
 
+    def __getstate__(self):
+        """
+        Leave out the idle event, which is only used by the system process
+        and can't be pickled for agent processes that aren't forked.
+        """
+        state = self.__dict__.copy()
+        # A copy of the mailbox has no idle event to leave out.
+        state.pop("idle", None)
+        return state
+
+    def for_inbox(self, inbox):
+        """
+        Return a copy of the mailbox for a process that only receives from
+        the given inbox, such as an acceptor's worker, leaving out the other
+        inbox queues so that they aren't passed to the process.
+        """
+        mailbox = copy.copy(self)
+        mailbox.inbox = [inbox_queue if i == inbox else None
+                         for i, inbox_queue in enumerate(self.inbox)]
+        mailbox.pending = deque()
+        return mailbox
+
+    def inbox_name(self, inbox):
+        """
+        Return the pid of the process of an inbox, or "pid.index" for the
+        partition inboxes of an acceptor with workers.
+        """
+        if inbox in self.partition_of:
+            return "{}.{}".format(*self.partition_of[inbox])
+        return inbox
+
+    def route(self, to, msg):
+        """
+        Return the inbox that msg for process id ``to`` goes to: the
+        partition inbox of its instance, for a prepare or accept message to
+        an acceptor with workers, or else the process's own.
+        """
+        inboxes = self.partitions.get(to)
+        if inboxes and isinstance(msg, (PrepareMsg, AcceptMsg)):
+            return inboxes[msg.proposal.instance % len(inboxes)]
+        return to
+
+    def route_batches(self, batches):
+        """
+        Split the frames of a dict mapping process id to a list of messages
+        into frames per inbox, see route.
+        """
+        routed = {}
+        for to, msgs in batches.items():
+            for msg in msgs:
+                routed.setdefault(self.route(to, msg), []).append(msg)
+        return routed
+
+    @staticmethod
+    def has_queue_sizes(context):
+        """
+        Return True if the platform can tell the size of a queue, which
+        bounded inboxes rely on.
+        """
+        try:
+            context.Queue().qsize()
+        except NotImplementedError:
+            return False
+        return True
+
     def run(self):
         print("Mailbox started")
+        if self.config.trace_dir:
+            self.drop_tracer = TraceRecorder.for_process(self.config.trace_dir,
+                                                         "mailbox")
+        # Count idle time from the start, in case no message is ever sent.
+        self.last_seen = time.time()
         while True:
-            if not self.active and self.terminate:
-                break
-            if self.active and self.last_seen and (time.time() - self.last_seen) > self.timeout_interval:
-                self.active = False
-            # Take messages off the funnel and deliver them to the appropriate
-            # process.
+            # Block until a message arrives, or until we'd become idle, or,
+            # while inboxes are congested, until it's time to check them.
+            timeout = None
+            if self.active:
+                timeout = max(0, self.last_seen + self.timeout_interval -
+                              time.time())
+            if self.congested or self.backlogged:
+                timeout = 0.01 if timeout is None else min(timeout, 0.01)
             try:
-                dest, msg = self.funnel.get(timeout=0.5)
-                self.last_seen = time.time()
+                item = self.funnel.get(timeout=timeout)
             except queue.Empty:
-                pass
+                if self.active and not self.backlogged and \
+                        time.time() - self.last_seen >= self.timeout_interval:
+                    self.active = False
+                    self.idle.set()
             else:
-                self.inbox[dest].put(msg)
+                # None is put on the funnel by quit, after every message.
+                if item is None:
+                    break
+                self.mark_active()
+                self.deliver(*item)
+            for dest in list(self.backlogged):
+                self.feed(dest)
+            if self.congested:
+                self.check_congestion()
+        if self.drop_tracer:
+            self.drop_tracer.close()
         print("Mailbox shutting down")
 
+    def mark_active(self):
+        """
+        Start counting idle time again from now.  Called by the mailbox
+        thread when a message arrives, and by the system once its agents are
+        ready, so that slowly starting agents don't count as idle time.
+        """
+        self.last_seen = time.time()
+        if not self.active:
+            self.active = True
+            self.idle.clear()
+
+    def deliver(self, dest, msg, source):
+        """
+        Put a message taken off the funnel into its destination's inbox,
+        applying the overflow policy.  Called by the mailbox thread.
+        """
+        if not self.capacity:
+            self.inbox[dest].put(msg)
+            return
+        depth = self.waiting(dest)
+        if depth >= self.capacity and self.is_droppable(msg):
+            if self.overflow_policy == "drop_oldest":
+                self.drop_oldest(dest, msg)
+                return
+            if self.overflow_policy == "signal":
+                self.signal_congestion(dest, source)
+        self.enqueue(dest, msg)
+        depth += 1
+        if depth > self.max_depth[dest]:
+            self.max_depth[dest] = depth
+        if depth >= self.high_watermark and dest not in self.alerted:
+            self.alerted.add(dest)
+            print("Mailbox: inbox of process {} above high watermark, "
+                  "{} of {} messages".format(self.inbox_name(dest), depth,
+                                             self.capacity))
+        elif depth < self.high_watermark:
+            self.alerted.discard(dest)
+
+    def is_droppable(self, msg):
+        """
+        Return True if the queued message msg was sent by an agent, and so may
+        be dropped.  Agents' messages are always encoded, while the system
+        sends control messages (configuration, client requests, quit) as is.
+        """
+        return isinstance(msg, (bytes, list))
+
+    def enqueue(self, dest, msg):
+        """
+        Queue msg for dest behind the messages already waiting for it.
+        """
+        if not self.capacity:
+            self.inbox[dest].put(msg)
+            return
+        self.backlog[dest].append(msg)
+        self.feed(dest)
+
+    def feed(self, dest):
+        """
+        Move messages from dest's backlog to its inbox queue while it has
+        room.  The inbox queue is only ever put to here, by the mailbox
+        thread, so putting never blocks.
+        """
+        backlog = self.backlog[dest]
+        inbox = self.inbox[dest]
+        while backlog and inbox.qsize() < self.inbox_limit:
+            inbox.put(backlog.popleft())
+        if backlog:
+            self.backlogged.add(dest)
+        else:
+            self.backlogged.discard(dest)
+
+    def drop_oldest(self, dest, msg):
+        """
+        Make room for msg among the messages waiting for dest by dropping the
+        oldest agent message of its backlog, or drop msg itself if there is
+        none.  Messages are never taken back out of the inbox queue, so the
+        others keep their order.
+        """
+        backlog = self.backlog[dest]
+        for i, item in enumerate(backlog):
+            if self.is_droppable(item):
+                del backlog[i]
+                backlog.append(msg)
+                self.trace_drop(dest, item)
+                break
+        else:
+            self.trace_drop(dest, msg)
+        self.count_dropped()
+
+    def count_dropped(self):
+        with self.dropped.get_lock():
+            self.dropped.value += 1
+
+    @property
+    def num_dropped(self):
+        """
+        The number of frames or messages dropped so far, whatever dropped
+        them.
+        """
+        return self.dropped.value
+
+    def trace_drop(self, dest, item):
+        """
+        Record the messages of a dropped inbox item in the trace, if any.
+        """
+        if not self.drop_tracer:
+            return
+        pid = self.partition_of.get(dest, (dest,))[0]
+        for data in item if isinstance(item, list) else [item]:
+            self.drop_tracer.drop(self.decode(data), pid)
+
+    def signal_congestion(self, dest, source):
+        """
+        Tell source and the proposers that dest's inbox is full, unless they
+        were already told.
+        """
+        signalled = self.congested.setdefault(dest, set())
+        for pid in [source] + self.config.proposer_ids:
+            if pid is not None and pid != dest and pid not in signalled:
+                signalled.add(pid)
+                self.enqueue(pid, BackpressureMsg(dest, True))
+
+    def check_congestion(self):
+        """
+        Tell the processes signalled about congested inboxes that have
+        drained to half their size that they are clear.
+        """
+        for dest in list(self.congested):
+            if self.waiting(dest) <= self.capacity // 2:
+                for pid in self.congested.pop(dest):
+                    self.enqueue(pid, BackpressureMsg(dest, False))
+
+    def wait_for_room(self, to, source):
+        """
+        With the "block" overflow policy, block until fewer than inbox_size
+        frames sent to inbox ``to`` are unreceived, and count the frame
+        about to be sent, unless an agent is sending to a proposer, which
+        is counted without waiting.  Return False if the frame should be
+        dropped instead, which only happens to an agent that has waited for
+        a message timeout, in case of a cycle of agents waiting for each
+        other.  The system's own messages wait as long as it takes.
+        """
+        unreceived = self.unreceived
+        if unreceived is None:
+            return True
+        room = self.room[to]
+        with room:
+            if source is None or to not in self.config.proposer_ids:
+                timeout = None
+                if source is not None:
+                    timeout = self.config.message_timeout
+                if not room.wait_for(lambda: unreceived[to] < self.capacity,
+                                     timeout):
+                    return False
+            unreceived[to] += 1
+        return True
+
+    def drop_unsent(self, to, msgs):
+        """
+        Count a frame that a blocked sender gave up on as dropped, and record
+        its messages in the trace, if any.
+        """
+        self.count_dropped()
+        if self.tracer:
+            pid = self.partition_of.get(to, (to,))[0]
+            for msg in msgs:
+                self.tracer.drop(msg, pid)
+
+    def get_depths(self):
+        """
+        Return a dict mapping each process id (or inbox name, see
+        inbox_name) to the number of messages waiting for it, in its inbox
+        queue and backlog, plus "funnel" to the depth of the funnel queue.
+        Depths are None if the platform can't tell queue sizes.  Meant to be
+        called in the system process.
+        """
+        depths = dict((self.inbox_name(inbox), self.waiting(inbox))
+                      for inbox in range(len(self.inbox)))
+        try:
+            depths["funnel"] = self.funnel.qsize()
+        except NotImplementedError:
+            depths["funnel"] = None
+        return depths
+
     def send(self, to, msg):
         """
         Send msg to process id ``to``.
         """
         # Funnel all messages through a primary queue so that we can keep track
         # of when we are done (i.e. all messages are processed).
+        source = getattr(msg, 'source', None)
+        to = self.route(to, msg)
+        if not self.wait_for_room(to, source):
+            self.drop_unsent(to, [msg])
+            return
         self.message_count += 1
-        self.funnel.put((to, msg))
+        self.funnel.put((to, msg, source))
+
+    def broadcast(self, msg, pids):
+        """
+        Send msg to every process id in ``pids``.  The message is serialized
+        once and the same encoded buffer is queued for every destination.
+        """
+        data = self.encode(msg)
+        source = getattr(msg, 'source', None)
+        for to in pids:
+            to = self.route(to, msg)
+            if not self.wait_for_room(to, source):
+                self.drop_unsent(to, [msg])
+                continue
+            self.message_count += 1
+            self.funnel.put((to, data, source))
+
+    def send_batch(self, to, msgs):
+        """
+        Send the list of messages ``msgs`` to process id ``to`` as a single
+        frame, costing one queue operation instead of one per message.
+        """
+        self.send_batches({to: msgs})
+
+    def send_batches(self, batches):
+        """
+        Send one frame per destination, given a dict mapping process id to a
+        list of messages.  A message that appears in several frames (i.e. a
+        broadcast) is only serialized once.
+        """
+        if self.partitions:
+            batches = self.route_batches(batches)
+        encoded = {}
+        for to, msgs in batches.items():
+            frame = []
+            for msg in msgs:
+                data = encoded.get(id(msg))
+                if data is None:
+                    data = encoded[id(msg)] = self.encode(msg)
+                frame.append(data)
+            if not frame:
+                continue
+            source = getattr(msgs[0], 'source', None)
+            if not self.wait_for_room(to, source):
+                self.drop_unsent(to, msgs)
+                continue
+            self.message_count += len(frame)
+            if len(frame) == 1:
+                self.funnel.put((to, frame[0], source))
+            else:
+                self.funnel.put((to, frame, source))
+
+    def encode(self, msg):
+        return pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data):
+        return pickle.loads(data)
+
+    def recv(self, from_, timeout=None):
+        """
+        Receive (blocking) msg destined for process id ``from_``.  Frames sent
+        with send_batches are unpacked and returned one message at a time, and
+        messages encoded by the sender are decoded.  If timeout is given, raise
+        queue.Empty if no message arrives within timeout seconds.
+        """
+        if not self.pending:
+            msg = self.inbox[from_].get(timeout=timeout)
+            if self.room is not None:
+                room = self.room[from_]
+                with room:
+                    self.unreceived[from_] -= 1
+                    room.notify()
+            if not isinstance(msg, list):
+                if isinstance(msg, bytes):
+                    msg = self.decode(msg)
+                return msg
+            self.pending.extend(msg)
+        return self.decode(self.pending.popleft())
+
+    def depth(self, pid):
+        """
+        Return the number of messages in the inbox queue of process id pid,
+        or None if the platform can't tell.
+        """
+        try:
+            return self.inbox[pid].qsize()
+        except NotImplementedError:
+            return None
+
+    def waiting(self, pid):
+        """
+        Return the number of messages waiting for process id pid, including
+        those in its backlog.  Only the mailbox thread's process knows the
+        backlog, and only bounded inboxes have one.
+        """
+        depth = self.depth(pid)
+        if depth is None:
+            return None
+        return depth + len(self.backlog[pid])
+
+    def export_metrics(self, pid, metrics):
+        """
+        Hand a snapshot of an agent's MetricsRegistry to the system.
+        """
+        self.metrics_queue.put((pid, metrics))
 
-    def recv(self, from_):
+    def report_ready(self, pid):
         """
-        Receive (blocking) msg destined for process id ``from_``.
+        Tell the system that the agent pid is running and configured.
         """
-        return self.inbox[from_].get()
+        self.ready_queue.put(pid)
 
     def task_done(self, pid):
         """
@@ -75,11 +576,7 @@ class Mailbox:
         Block until all messages have finished processing and we haven't had
         any messages for a while (i.e. active set to False).
         """
-        while self.active:
-            time.sleep(0.5)
-        # Don't join funnel queue because there's a good chance that it will
-        # never be fully exhausted due to heart beat messages.
-        #self.funnel.join()
+        self.idle.wait()
 
     def shutdown(self):
         """
@@ -89,61 +586,204 @@ class Mailbox:
         pass
 
     def quit(self):
-        self.terminate = True
+        self.funnel.put(None)
 
 
 class ResultLogger:
     """
     Class to hold log of results from each learner process.
+
+    Results can also be consumed while the system runs, through a
+    DecisionStream per learner (see subscribe).  Results, and the acceptor
+    states reported with ``SystemConfig(check_acceptors=True)``, are checked
+    for safety as they arrive (see results.SafetyChecker).
     """
 
+    # Whether recording a result waits for the consumers of full streams.
+    # The logger thread may wait, as the system keeps running meanwhile.
+    block_streams = True
+
     def __init__(self, config):
         self.config = config
-        self.queue = Queue()
-        self.active = True
-        # Results, PID mapped to list of decided values.
-        self.results = defaultdict(dict)
+        self.queue = get_context(config).Queue()
+        # Values learned by each learner, by instance.
+        self.table = ResultTable(config.learner_ids, config.num_test_requests,
+                                 config.num_groups)
+        self.checker = SafetyChecker(config.learner_ids, config.check_window,
+                                     config.num_groups)
+        # Learners of the current configuration, which are expected to learn
+        # submitted values, see add_learner.
+        self.learner_ids = list(config.learner_ids)
+        # Learner pid mapped to its subscribed DecisionStreams.
+        self.streams = {}
+        # Guards streams against subscribing while a result is recorded.
+        self.lock = Lock()
+        # Values of submitted requests mapped to the learners that have yet
+        # to learn them, and how many more times each (as a value may be
+        # submitted more than once), see expect.
+        self.outstanding = {}
+        self.num_expected = 0
+        self.completed = Condition(self.lock)
+
+    def __getstate__(self):
+        """
+        Agent processes only log results, so leave out the state of the
+        parent's logger thread, which can't be pickled for processes that
+        aren't forked.
+        """
+        return {"config": self.config, "queue": self.queue}
 
     def run(self):
         print("Logger started")
         while True:
-            if not self.active and self.queue.empty():
+            source, instance, value = self.queue.get()
+            # The quit message is logged after every agent has exited.
+            if source == "quit":
                 break
-            try:
-                source, instance, value = self.queue.get(timeout=0.5)
-            except queue.Empty:
-                pass
+            elif isinstance(value, AcceptorState):
+                self.checker.check_acceptor(source, instance, value)
             else:
-                if source == "quit":
-                    self.active = False
-                else:
-                    self.results[source][instance] = value
+                self.record(source, instance, value)
+        self.close_streams()
         print("Logger shutting down")
 
+    def record(self, source, instance, value):
+        """
+        Store a result received from a learner, check it, and pass it on to
+        the learner's streams.  Streams are fed after releasing the lock, so
+        that waiting for a slow consumer (see block_streams) doesn't hold up
+        subscribing, waiting for completion or closing the streams.
+        """
+        with self.lock:
+            # A learner may log an instance again, which completes nothing.
+            first = self.table.get(source, instance) is None
+            self.table.record(source, instance, value)
+            self.checker.check_decision(source, instance, value)
+            remaining = self.outstanding.get(value)
+            if first and remaining and source in remaining:
+                remaining[source] -= 1
+                if not remaining[source]:
+                    del remaining[source]
+                    if not remaining:
+                        del self.outstanding[value]
+                        self.completed.notify_all()
+            streams = list(self.streams.get(source, ()))
+        for stream in streams:
+            stream.put(instance, value, block=self.block_streams)
+
+    def expect(self, value, group=0):
+        """
+        Track a submitted request for value, routed to group, until every
+        current learner has learned it.  A value submitted n times is
+        tracked until every learner has learned it in n instances.
+        """
+        with self.lock:
+            self.table.count_request(group)
+            self.num_expected += 1
+            remaining = self.outstanding.setdefault(value, {})
+            for pid in self.learner_ids:
+                remaining[pid] = remaining.get(pid, 0) + 1
+
+    def add_learner(self, pid):
+        """
+        Expect learner pid, which joined the system, to learn the values
+        submitted from now on.
+        """
+        with self.lock:
+            if pid not in self.learner_ids:
+                self.learner_ids.append(pid)
+
+    def remove_learner(self, pid):
+        """
+        Stop expecting learner pid, which left the system, to learn values,
+        including those already submitted.
+        """
+        with self.lock:
+            if pid in self.learner_ids:
+                self.learner_ids.remove(pid)
+            for value, remaining in list(self.outstanding.items()):
+                remaining.pop(pid, None)
+                if not remaining:
+                    del self.outstanding[value]
+            if not self.outstanding:
+                self.completed.notify_all()
+
+    @property
+    def num_outstanding(self):
+        """
+        The number of submitted requests that some learner has yet to learn.
+        """
+        with self.lock:
+            return sum(max(remaining.values())
+                       for remaining in self.outstanding.values())
+
+    def wait_done(self, idle_timeout=None):
+        """
+        Block until every expected value has been learned by every learner.
+        Return False instead if idle_timeout seconds pass without any value
+        completing, as when messages were lost.
+        """
+        with self.completed:
+            while self.outstanding:
+                if not self.completed.wait(idle_timeout):
+                    return False
+            return True
+
+    def subscribe(self, pid, maxsize=1000):
+        """
+        Return a DecisionStream of learner pid's decisions, in instance
+        order from instance 1 (in each consensus group's order, with several
+        groups), buffering at most maxsize decisions.  The stream ends when
+        the logger shuts down.
+        """
+        stream = DecisionStream(pid, maxsize,
+                                num_groups=self.config.num_groups)
+        with self.lock:
+            self.streams.setdefault(pid, []).append(stream)
+            # Replay what was learned so far without waiting for the consumer,
+            # which can't read the stream before it's returned.
+            for instance, value in sorted(self.table.as_dict(pid).items()):
+                stream.put(instance, value, block=False)
+        return stream
+
+    def close_streams(self):
+        with self.lock:
+            for streams in self.streams.values():
+                for stream in streams:
+                    stream.close()
+
+    @property
+    def results(self):
+        """
+        Results as a dict mapping learner pid to a dict of instance to value.
+        Built on each access, so meant for the end of a run.
+        """
+        return self.table.as_dicts()
+
     def log_result(self, source, instance, value):
         self.queue.put((source, instance, value))
 
+    def log_acceptor_state(self, source, instance, promised, accepted):
+        self.queue.put((source, instance, AcceptorState(promised, accepted)))
+
     def print_results(self):
         print("Process Result Log:")
-        processes = sorted(self.results.keys())
+        processes = sorted(self.table.pids())
         for pid in processes:
             instances = range(1, self.config.num_test_requests + 1)
-            results = [(instance, self.results[pid].get(instance))
+            results = [(instance, self.table.get(pid, instance))
                        for instance in instances]
             print("  {}: {}".format(pid, results))
 
     def check_results(self):
         """
-        Check that each learner process got the same results in the same order.
-        Return False if there is a result list that is not the same.  If all
-        results are the same, then return the list of results.
+        Check that the learner processes learned the same value in every
+        instance that more than one of them learned, and that no acceptor
+        invariant was broken.  Learners that learned different subsets of
+        the instances are consistent as long as no values conflict.  Return
+        True or False.
         """
-        results = list(self.results.values())
-        compare_list = results[0]
-        result = True
-        for result_list in results[1:]:
-            if result_list != compare_list:
-                result =  False
+        result = self.checker.safe
         print("Logger results consistent:", result)
         return result
 
@@ -155,6 +795,54 @@ class ResultLogger:
         summary.print_summary()
 
 
+class MetricsCollector:
+    """
+    Keeps the latest metrics snapshot exported by each agent, read from the
+    given queue by a thread of the system process.
+    """
+
+    def __init__(self, queue=None):
+        self.queue = queue
+        # Latest MetricsRegistry snapshot of each pid.
+        self.latest = {}
+
+    def run(self):
+        while True:
+            pid, metrics = self.queue.get()
+            if pid == "quit":
+                break
+            self.latest[pid] = metrics
+
+    def quit(self):
+        self.queue.put(("quit", None))
+
+    def get_metrics(self, pids=None):
+        """
+        Return the latest metrics of the given pids (default: all), merged
+        into one MetricsRegistry.  Its gauges are the highest of the pids'
+        values; see get_gauge for each pid's value.
+        """
+        merged = MetricsRegistry()
+        for pid, metrics in list(self.latest.items()):
+            if pids is None or pid in pids:
+                merged.merge(metrics)
+        return merged
+
+    def get_gauge(self, name, pids=None):
+        """
+        Return a dict mapping each of the given pids (default: all) to its
+        latest value of the named gauge, for the pids that have one.
+        """
+        return dict((pid, metrics.gauges[name])
+                    for pid, metrics in list(self.latest.items())
+                    if (pids is None or pid in pids) and name in metrics.gauges)
+
+    def print_metrics(self):
+        for pid in sorted(self.latest):
+            print("Metrics of process {}:".format(pid))
+            self.latest[pid].print_metrics("    ")
+
+
 class ResultSummary:
     """
     Given a logger object, summarize its results.
@@ -167,65 +855,40 @@ class ResultSummary:
         self.calculate()
 
     def calculate(self):
-        self.calculate_missing()
-        self.calculate_consistency()
-
-    def calculate_missing(self):
-        self.learned_values = 0
-        self.missing_values = 0
-        self.total_values = 0
-        for i in self.instances:
-            for pid in self.pids:
-                value = self.logger.results[pid].get(i)
-                self.total_values += 1
-                if value is None:
-                    self.missing_values += 1
-                else:
-                    self.learned_values += 1
+        # The logger's ResultTable keeps the counts up to date as results
+        # arrive, so this doesn't loop over instances and learners.
+        counts = self.logger.table.counts()
+        self.calculate_missing(counts)
+        self.calculate_consistency(counts)
+
+    def calculate_missing(self, counts):
+        self.learned_values = counts["learned"]
+        self.missing_values = counts["missing"]
+        self.total_values = counts["total"]
         self.learned_values_percent = float(100) * self.learned_values / self.total_values
         self.missing_values_percent = float(100) * self.missing_values / self.total_values
 
-    def calculate_consistency(self):
+    def calculate_consistency(self, counts):
         """
         Count the number of consistent and inconsistent instance results,
         excluding unlearned or missing values.
         """
         # Disjoint set: good and bad (consistent and inconsistent) instances.
-        self.good_instances = 0
-        self.bad_instances = 0
+        self.good_instances = counts["good"]
+        self.bad_instances = counts["bad"]
         # Disjoint set: empty, incomplete, and complete instances representing
         # no, some, or all learners learned the value.
-        self.empty_instances = 0
-        self.incomplete_instances = 0
-        self.complete_instances = 0
-        for i in self.instances:
-            values = set()
-            num_none = 0
-            for pid in self.pids:
-                value = self.logger.results[pid].get(i)
-                if value is None:
-                    num_none += 1
-                else:
-                    values.add(value)
-            length = len(values)
-            if length == 0:
-                self.good_instances += 1
-                self.empty_instances += 1
-            elif length == 1:
-                if num_none == 0:
-                    self.complete_instances += 1
-                else:
-                    self.incomplete_instances += 1
-                self.good_instances += 1
-            else:
-                self.bad_instances += 1
+        self.empty_instances = counts["empty"]
+        self.incomplete_instances = counts["incomplete"]
+        self.complete_instances = counts["complete"]
         self.good_instances_percent = float(100) * self.good_instances / len(self.instances)
         self.bad_instances_percent = float(100) * self.bad_instances / len(self.instances)
         self.empty_instances_percent = float(100) * self.empty_instances / len(self.instances)
         self.incomplete_instances_percent = float(100) * self.incomplete_instances / len(self.instances)
         self.complete_instances_percent = float(100) * self.complete_instances / len(self.instances)
 
-    def get_summary_headings(self):
+    @staticmethod
+    def get_summary_headings():
         return [
             "learned values", "learned values percent",
             "missing values", "missing_values_percent",
@@ -286,10 +949,11 @@ class System(BaseSystem):
     Class for simulating a network of paxos agents.
     """
 
-    def __init__(self, config, mailbox=None):
+    def __init__(self, config, mailbox=None, logger=None):
         """
         ``mailbox`` should be a mailbox class; if None, then use default
-        Mailbox class.
+        Mailbox class.  Likewise, ``logger`` is the result logger class,
+        ResultLogger by default.
         """
         print("System starting...")
         self.config = config
@@ -303,29 +967,124 @@ class System(BaseSystem):
         self.mailbox_process = Thread(target=self.mailbox.run, name="System Mailbox")
         self.mailbox_process.start()
         # Start the logger thread.
-        self.logger = ResultLogger(config)
+        logger_class = logger or ResultLogger
+        self.logger = logger_class(config)
         self.logger_process = Thread(target=self.logger.run, name="System Logger")
         self.logger_process.start()
+        # Start the thread collecting agents' metrics.
+        self.metrics = MetricsCollector(self.mailbox.metrics_queue)
+        self.metrics_process = Thread(target=self.metrics.run, name="System Metrics")
+        self.metrics_process.start()
+        # Store of large submitted values.
+        self.value_store = None
+        if config.value_threshold is not None:
+            self.value_store = ValueStore(config.value_threshold,
+                                          config.value_dir)
 
+        self.context = get_context(config)
+        if config.start_method == "forkserver":
+            self.context.set_forkserver_preload(self.preload_modules())
+        # Pids of the agents that reported being ready.
+        self.ready = set()
+        # Learners that submitted payloads are sent to.
+        self.learner_ids = list(config.learner_ids)
+        # Maps the keys of submitted requests to consensus groups.
+        self.router = GroupRouter(config.num_groups)
         self.processes = self.launch_processes()
 
+    def preload_modules(self):
+        """
+        Return the modules that a forkserver imports once, before forking
+        agent processes, so that each agent doesn't import them itself.
+        """
+        classes = [self.config.proposer_class, self.config.acceptor_class,
+                   self.config.learner_class, type(self.mailbox),
+                   type(self.logger)]
+        return sorted(set(["paxos", "paxos.sim"] +
+                          [cls.__module__ for cls in classes
+                           if cls.__module__ != "__main__"]))
+
     def launch_processes(self):
         """
-        Launch ``number`` number of processes of the given ``agent_class``,
-        using the given Mailbox instance and with process id starting with the
-        given ``pid`` and incrementing for each process spawned.
+        Launch a process for each agent of the configuration, with the
+        configuration passed at spawn time so that agents are configured
+        before they receive any message.  Processes are started without
+        waiting for each other; start waits until they are all ready.
 
-        Return the incremented pid value when done, which is meant to be used
-        in subsequent calls to this method for a starting pid.
+        Return the list of processes.
         """
         processes = []
         for pid, agent_class in self.config.process_list():
-            agent = agent_class(pid, self.mailbox, self.logger)
-            p = Process(target=agent.run)
-            p.start()
-            processes.append(p)
+            processes.append(self.spawn_agent(pid, agent_class))
         return processes
 
+    def spawn_agent(self, pid, agent_class):
+        agent = agent_class(pid, self.mailbox, self.logger)
+        p = self.context.Process(target=agent.run, args=(self.config,),
+                                 name="{}-{}".format(agent_class.__name__, pid))
+        p.start()
+        return p
+
+    def add_agent(self, agent_class):
+        """
+        Launch an agent of the given class in the next spare process id while
+        the system is running, and send it the system configuration.  Return
+        the process id.
+        """
+        spare = len(self.processes) - len(list(self.config.process_list()))
+        if spare >= len(self.config.spare_ids):
+            raise RuntimeError("No spare process ids left to add an agent; "
+                               "reserve more with SystemConfig(num_spare=...)")
+        pid = self.config.spare_ids[spare]
+        self.processes.append(self.spawn_agent(pid, agent_class))
+        self.wait_ready([pid])
+        return pid
+
+    def reconfigure(self, change, proposer=0):
+        """
+        Ask a proposer to get a reconfiguration of the system chosen.
+        """
+        assert self.config.reconfiguration_window, \
+                "Reconfiguration requires a reconfiguration_window"
+        self.mailbox.send(proposer, ClientRequestMsg(None, change))
+
+    def add_acceptor(self, weight=None, proposer=0):
+        """
+        Launch a new acceptor and add it to the system.  It takes part in
+        quorums from the instance where the membership change takes effect.
+        """
+        pid = self.add_agent(self.config.acceptor_class)
+        self.reconfigure(MembershipChange(add_acceptors=[pid], weight=weight),
+                         proposer)
+        return pid
+
+    def add_learner(self, proposer=0):
+        """
+        Launch a new learner and add it to the system.  The learner catches
+        up on earlier values from the other learners.
+        """
+        pid = self.add_agent(self.config.learner_class)
+        self.learner_ids.append(pid)
+        self.logger.add_learner(pid)
+        self.reconfigure(MembershipChange(add_learners=[pid]), proposer)
+        return pid
+
+    def remove_acceptor(self, pid, proposer=0):
+        """
+        Retire an acceptor.  It keeps serving the instances started before
+        the change takes effect, and runs until the system is shut down.
+        """
+        self.reconfigure(MembershipChange(remove_acceptors=[pid]), proposer)
+
+    def remove_learner(self, pid, proposer=0):
+        """
+        Retire a learner.  Requests are no longer tracked until it learns
+        them, but it keeps being sent payloads, for the instances it still
+        learns.
+        """
+        self.logger.remove_learner(pid)
+        self.reconfigure(MembershipChange(remove_learners=[pid]), proposer)
+
     def join(self):
         """
         Join with all processes that have been launched.
@@ -333,32 +1092,99 @@ class System(BaseSystem):
         for process in self.processes:
             process.join()
 
+    def submit(self, value, to=None, key=None):
+        """
+        Send a client request for value to proposer ``to``, by default the
+        leader of the consensus group that the router maps key (by default,
+        value) to.  Submitted requests are tracked, so that shutdown_agents
+        can return as soon as they have all been learned.  A large value is
+        stored in the value store, if there is one, and its handle sent
+        instead.  With payload_split, the value is sent to the learners, and
+        a reference to it to the proposer.  Return the value or handle that
+        learners learn.
+        """
+        group = self.router.group_for(value if key is None else key)
+        if to is None:
+            to = self.config.group_leader(group)
+        if self.value_store:
+            value = self.value_store.wrap(value)
+        self.logger.expect(value, group)
+        proposed = value
+        if self.config.payload_split:
+            proposed = PayloadRef.for_value(value)
+            for pid in self.learner_ids:
+                self.mailbox.send(pid, PayloadMsg(None, proposed, value))
+        self.mailbox.send(to, ClientRequestMsg(None, proposed, group))
+        return value
+
     def start(self):
         """
-        Start the system by sending a message to each process containing
-        this system object.
+        Wait until every agent process is running and configured, so that
+        the system is ready for requests.
         """
-        for x in range(len(self.processes)):
-            self.mailbox.send(x, self.config)
+        self.wait_ready(range(len(self.processes)))
+        self.mailbox.mark_active()
+
+    def wait_ready(self, pids, timeout=None):
+        """
+        Block until the agents pids have reported being ready.  Raise
+        RuntimeError if an agent process exits first or, if timeout is given,
+        if they aren't ready within timeout seconds.
+        """
+        waiting = set(pids) - self.ready
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while waiting:
+            try:
+                pid = self.mailbox.ready_queue.get(timeout=0.1)
+            except queue.Empty:
+                for pid in waiting:
+                    if self.processes[pid].exitcode is not None:
+                        raise RuntimeError("Agent process {} exited during "
+                                           "startup".format(pid))
+                if deadline is not None and time.monotonic() > deadline:
+                    raise RuntimeError("Agents {} not ready after {} seconds"
+                                       .format(sorted(waiting), timeout))
+            else:
+                self.ready.add(pid)
+                waiting.discard(pid)
 
     def shutdown_agents(self):
         """
-        Wait for all mailbox messages to be processed, then send quit messages
-        to all processes and join with all processes.  This will block until
-        all agents have terminated.
+        Wait until the submitted requests have been learned, or if requests
+        were sent some other way, until the mailbox goes inactive.  Then
+        send quit messages to all processes and join with all processes.
+        This will block until all agents have terminated.
+
+        Waiting for requests only gives up once none has been learned for
+        longer than learners wait before retrying a missing value (see
+        Learner.retry_delay), and the mailbox has gone inactive.
         """
-        print("System waiting for mailbox to go inactive...")
-        # Sleep a bit to allow any actions based on timeouts to fire.
-        #time.sleep(10)
-        self.mailbox.join()
+        if self.logger.num_expected:
+            print("System waiting for submitted requests to be learned...")
+            interval = max(self.mailbox.timeout_interval,
+                           (self.config.learner_class.retry_delay + 1) *
+                           self.config.message_timeout)
+            while not self.logger.wait_done(interval):
+                if not self.mailbox.active:
+                    print("System giving up on {} requests that weren't "
+                          "learned".format(self.logger.num_outstanding))
+                    break
+        else:
+            print("System waiting for mailbox to go inactive...")
+            self.mailbox.join()
         print("System shutting down agents...")
         for x in range(len(self.processes)):
-            self.mailbox.send(x, "quit")
+            self.mailbox.send(x, QuitMsg(None))
         self.join()
 
     def quit(self):
+        # Closing the streams first releases the logger thread if it's
+        # waiting for a consumer that stopped reading.
+        self.logger.close_streams()
         self.logger.log_result("quit", None, None)
         self.logger_process.join()
+        self.metrics.quit()
+        self.metrics_process.join()
         self.mailbox.quit()
         self.mailbox_process.join()
         print("System terminated.")
@@ -0,0 +1,325 @@
+"""
+A deterministic, single-threaded discrete-event simulation of a paxos system.
+
+The regular agent classes are driven by a virtual clock instead of processes,
+queues and wall-clock timeouts.  Message delay, loss and reordering are drawn
+from a seeded random number generator, so a run is reproducible from its
+seed and takes a fraction of the time of the equivalent ``sim.System`` run.
+
+Agents that rely on helper threads, like ``retries.RetryLearner``, are not
+supported.
+"""
+
+from collections import defaultdict
+import contextlib
+import copy
+import heapq
+import itertools
+import os
+import pickle
+import random
+
+from paxos import BaseSystem
+from paxos.messages import ClientRequestMsg, QuitMsg, PayloadMsg
+from paxos.sim import ResultLogger, MetricsCollector
+from paxos.results import AcceptorState
+from paxos.values import ValueStore, PayloadRef
+from paxos.groups import GroupRouter
+from paxos.trace import TraceRecorder
+from paxos.sim_failure import is_control_message
+
+
+class Simulator:
+    """
+    An event queue ordered by virtual time.  Events scheduled for the same
+    time run in the order they were scheduled.
+    """
+
+    def __init__(self, seed=None):
+        self.now = 0.0
+        self.events = []
+        self.counter = itertools.count()
+        self.random = random.Random(seed)
+
+    def clock(self):
+        return self.now
+
+    def schedule(self, delay, func, *args):
+        heapq.heappush(self.events, (self.now + delay, next(self.counter),
+                                     func, args))
+
+    def step(self):
+        """
+        Run the next event.  Return False if there are no events left.
+        """
+        if not self.events:
+            return False
+        self.now, _, func, args = heapq.heappop(self.events)
+        func(*args)
+        return True
+
+
+class EventMailbox:
+    """
+    A Mailbox replacement that turns sent messages into delivery events.
+    Each message is delayed by a uniformly random amount between min_delay
+    and max_delay seconds, which also reorders messages, and dropped with the
+    destination's fail rate (see ``sim_failure.FailTestSystemConfig``).
+    """
+
+    def __init__(self, config, system, min_delay=0.001, max_delay=0.01):
+        self.config = config
+        self.system = system
+        self.simulator = system.simulator
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.num_sent = 0
+        self.num_recv = 0
+        self.num_failed = 0
+        self.tracer = None
+
+    def should_deliver(self, to, msg):
+        try:
+            fail_rate = self.config.fail_rates[to]
+        except (AttributeError, IndexError):
+            fail_rate = 0
+        if is_control_message(msg) or fail_rate == 0 or \
+                fail_rate <= self.simulator.random.random():
+            return True
+        self.num_failed += 1
+        if self.tracer:
+            self.tracer.drop(msg, to)
+        return False
+
+    def post(self, to, data):
+        """
+        Schedule delivery of encoded message data to process id ``to``.
+        """
+        self.num_sent += 1
+        self.system.in_flight += 1
+        delay = self.simulator.random.uniform(self.min_delay, self.max_delay)
+        self.simulator.schedule(delay, self.system.deliver, to, data)
+
+    def send(self, to, msg):
+        if self.should_deliver(to, msg):
+            self.post(to, self.encode(msg))
+
+    def broadcast(self, msg, pids):
+        data = self.encode(msg)
+        for to in pids:
+            if self.should_deliver(to, msg):
+                self.post(to, data)
+
+    def send_batch(self, to, msgs):
+        self.send_batches({to: msgs})
+
+    def send_batches(self, batches):
+        # Frames have no benefit without a transport, so messages of a frame
+        # are delivered, delayed and dropped individually.
+        for to, msgs in batches.items():
+            for msg in msgs:
+                self.send(to, msg)
+
+    def encode(self, msg):
+        # Encoding also gives each receiver its own copy of the message, as
+        # a real transport would.
+        return pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data):
+        self.num_recv += 1
+        return pickle.loads(data)
+
+    def depth(self, pid):
+        return None
+
+    def export_metrics(self, pid, metrics):
+        self.system.metrics.latest[pid] = metrics
+
+    def shutdown(self):
+        pass
+
+    def get_counts(self):
+        return (self.num_sent, self.num_recv, self.num_failed,
+                self.num_sent + self.num_failed)
+
+
+class EventLogger(ResultLogger):
+    """
+    A ResultLogger that records results directly instead of through a queue
+    read by a logger thread.  Results are recorded by the simulation thread,
+    which can't wait for a stream's consumer, so full streams grow instead.
+    """
+
+    block_streams = False
+
+    def log_result(self, source, instance, value):
+        self.record(source, instance, value)
+
+    def log_acceptor_state(self, source, instance, promised, accepted):
+        self.checker.check_acceptor(source, instance,
+                                    AcceptorState(promised, accepted))
+
+
+class DiscreteEventSystem(BaseSystem):
+    """
+    Simulates a network of paxos agents on a virtual clock.
+
+    Agent timeouts stop firing once no messages are in flight and none have
+    been delivered for three message timeouts, which is when a
+    ``sim.Mailbox`` would go inactive, so that the run comes to an end.
+    """
+
+    def __init__(self, config, seed=None, min_delay=0.001, max_delay=0.01):
+        self.config = config
+        self.simulator = Simulator(seed)
+        self.mailbox = EventMailbox(config, self, min_delay, max_delay)
+        self.logger = EventLogger(config)
+        self.metrics = MetricsCollector()
+        self.router = GroupRouter(config.num_groups)
+        self.value_store = None
+        if config.value_threshold is not None:
+            self.value_store = ValueStore(config.value_threshold,
+                                          config.value_dir)
+        if config.trace_dir:
+            # Traces use virtual time.
+            self.mailbox.tracer = TraceRecorder.for_process(
+                config.trace_dir, "mailbox",
+                lambda: int(self.simulator.now * 1e9))
+        self.idle_interval = 3 * config.message_timeout
+        self.last_delivery = 0.0
+        # Messages posted by the mailbox and not yet delivered.
+        self.in_flight = 0
+        # Timer generation of each agent, see schedule_timeout.
+        self.timers = defaultdict(int)
+        self.agents = {}
+        for pid, agent_class in config.process_list():
+            agent = agent_class(pid, self.mailbox, self.logger)
+            agent.clock = self.simulator.clock
+            self.agents[pid] = agent
+
+    def start(self):
+        """
+        Hand the configuration to every agent.  This happens instantly, so
+        that no agent sees a message before its configuration.  Each agent
+        gets its own copy, as agent processes do, so that an agent changing
+        its configuration (e.g. its weights) doesn't change the others'.
+        """
+        for agent in self.agents.values():
+            agent.process_message(copy.deepcopy(self.config))
+            self.schedule_timeout(agent)
+
+    def submit(self, value, to=None, delay=0, key=None):
+        """
+        Schedule a client request for value to proposer ``to``, delay
+        seconds from now.  Requests are routed to groups, tracked, large
+        values stored, and payloads split, as in System.submit.  Return the
+        value or handle that learners learn.
+        """
+        group = self.router.group_for(value if key is None else key)
+        if to is None:
+            to = self.config.group_leader(group)
+        if self.value_store:
+            value = self.value_store.wrap(value)
+        self.logger.expect(value, group)
+        proposed = value
+        if self.config.payload_split:
+            proposed = PayloadRef.for_value(value)
+            self.simulator.schedule(delay, self.mailbox.broadcast,
+                                    PayloadMsg(None, proposed, value),
+                                    self.config.learner_ids)
+        self.simulator.schedule(delay, self.mailbox.send, to,
+                                ClientRequestMsg(None, proposed, group))
+        return value
+
+    def deliver(self, to, data):
+        self.in_flight -= 1
+        self.last_delivery = self.simulator.now
+        agent = self.agents[to]
+        if not agent.active:
+            return
+        agent.process_message(self.mailbox.decode(data))
+        self.schedule_timeout(agent)
+
+    def schedule_timeout(self, agent):
+        """
+        Emulate the timeout of an agent's blocking receive: the timer fires
+        unless another message is delivered to the agent first.
+        """
+        self.timers[agent.pid] += 1
+        if agent.timeout:
+            self.simulator.schedule(agent.timeout, self.fire_timeout, agent,
+                                    self.timers[agent.pid])
+
+    def fire_timeout(self, agent, generation):
+        if generation != self.timers[agent.pid] or not agent.active:
+            return
+        if self.is_idle():
+            return
+        agent.process_timeout()
+        self.schedule_timeout(agent)
+
+    def is_idle(self):
+        return (self.in_flight == 0 and
+                self.simulator.now - self.last_delivery > self.idle_interval)
+
+    def run(self, until=None):
+        """
+        Run events until the system is idle, or until the virtual time
+        ``until`` if given.
+        """
+        while self.simulator.events:
+            if until is not None and self.simulator.events[0][0] > until:
+                break
+            self.simulator.step()
+
+    def shutdown_agents(self):
+        """
+        Run until the system is idle and stop the agents, which closes their
+        traces, and close the mailbox's trace, so that the run's trace can
+        be read.
+        """
+        self.run()
+        for agent in self.agents.values():
+            if agent.active:
+                agent.process_message(QuitMsg(None))
+        if self.mailbox.tracer:
+            self.mailbox.tracer.close()
+
+    def quit(self):
+        self.logger.close_streams()
+
+    def print_summary(self):
+        self.logger.print_summary()
+        sent, recv, failed, total = self.mailbox.get_counts()
+        print("Messages: {} sent, {} failed, {} total, {} received".format(
+              sent, failed, total, recv))
+        print("Virtual time: {:.3f}s".format(self.simulator.now))
+
+
+def run_test(config, seed=0, quiet=True):
+    """
+    Run config.num_test_requests client requests through a simulated
+    system, sent to proposer 0.  Return the system.  With quiet, agents'
+    output is discarded.
+    """
+    with contextlib.ExitStack() as stack:
+        if quiet:
+            devnull = stack.enter_context(open(os.devnull, 'w'))
+            stack.enter_context(contextlib.redirect_stdout(devnull))
+        system = DiscreteEventSystem(config, seed=seed)
+        system.start()
+        for x in range(config.num_test_requests):
+            system.submit(x + 1)
+        system.shutdown_agents()
+        system.quit()
+    return system
+
+
+if __name__ == "__main__":
+    from paxos.sim_failure import FailTestSystemConfig
+    for fail_rate in [0.0, 0.1, 0.2, 0.3, 0.4, 0.5]:
+        config = FailTestSystemConfig(3, 3, 3, num_test_requests=1000,
+                                      fail_rate=fail_rate)
+        system = run_test(config)
+        print("Fail rate {}:".format(fail_rate))
+        system.print_summary()
@@ -1,5 +1,6 @@
 import time
 
+from paxos.analyzer import LatencyAnalyzer
 from paxos.sim_failure import *
 from paxos.test import DebugSystem
 
@@ -10,7 +11,7 @@ def run_test(config, delay=0):
 
     for x in range(config.num_test_requests):
         to = 0
-        system.mailbox.send(to, ClientRequestMsg(None, x+1))
+        system.submit(x+1, to)
         time.sleep(delay)
 
     system.shutdown_agents()
@@ -27,4 +28,6 @@ if __name__ == '__main__':
                                   num_test_requests=100, \
                                   fail_rates=f_rates, \
                                   dynamic_weights=True)
+                                  # Weight by latency instead of reliability:
+                                  #analyzer_class=LatencyAnalyzer)
     run_test(config, 1)
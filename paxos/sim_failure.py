@@ -7,18 +7,28 @@ from collections import namedtuple
 import random
 
 from paxos import SystemConfig
-from paxos.messages import ClientRequestMsg, AdjustWeightsMsg
+from paxos.messages import ClientRequestMsg, AdjustWeightsMsg, QuitMsg, \
+        CatchupRequestMsg, CatchupResponseMsg, PayloadMsg
 from paxos.sim import Mailbox
 from paxos.test import DebugMailbox
 
 
+def is_control_message(msg):
+    """
+    Return True for messages that failure simulations always deliver.
+    """
+    return isinstance(msg, (QuitMsg, SystemConfig, ClientRequestMsg,
+                            PayloadMsg, AdjustWeightsMsg, CatchupRequestMsg,
+                            CatchupResponseMsg))
+
+
 class FailTestMailbox(Mailbox):
     """
     A Mailbox class that drops messages destined to each process with a
     probability specified  in the system config.
     """
 
-    def send(self, to, msg):
+    def should_deliver(self, to, msg):
         """
         Test a random number between [0,1) against the fail rate to determine
         whether or not to deliver/drop the message.
@@ -27,12 +37,32 @@ class FailTestMailbox(Mailbox):
             fail_rate = self.config.fail_rates[to]
         except (AttributeError, IndexError):
             fail_rate = 0
-        if msg == "quit" or isinstance(msg, SystemConfig) or isinstance(msg, ClientRequestMsg) or \
-                isinstance(msg, AdjustWeightsMsg) or fail_rate == 0 or fail_rate <= random.random():
+        if is_control_message(msg) or fail_rate == 0 or \
+                fail_rate <= random.random():
+            return True
+        self.message_failed()
+        if self.tracer:
+            self.tracer.drop(msg, to)
+        #print("****** Message to {} failed: {} ******".format(to, msg))
+        return False
+
+    def send(self, to, msg):
+        if self.should_deliver(to, msg):
             super(FailTestMailbox, self).send(to, msg)
-        else:
-            self.message_failed()
-            #print("****** Message to {} failed: {} ******".format(to, msg))
+
+    def broadcast(self, msg, pids):
+        pids = [to for to in pids if self.should_deliver(to, msg)]
+        if pids:
+            super(FailTestMailbox, self).broadcast(msg, pids)
+
+    def send_batches(self, batches):
+        """
+        Drop each message of a frame independently, as if they had been sent
+        one at a time.
+        """
+        batches = dict((to, [msg for msg in msgs if self.should_deliver(to, msg)])
+                       for to, msgs in batches.items())
+        super(FailTestMailbox, self).send_batches(batches)
 
     def message_failed(self):
         """Hook for accounting of failed messages."""
@@ -85,7 +115,7 @@ def run_test(config):
         # the leader.
         to = 0
         #system.mailbox.send(to, ClientRequestMsg(None, "Query {}".format(x+1)))
-        system.mailbox.send(to, ClientRequestMsg(None, x+1))
+        system.submit(x+1, to)
         #time.sleep(random.random()/10)
 
     system.shutdown_agents()
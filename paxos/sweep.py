@@ -0,0 +1,126 @@
+"""
+Run failure experiments over a grid of parameters on a process pool.
+
+Each run is simulated with ``sim_discrete``, writes the agents' output to
+its own log file, and is summarized as one row of a CSV file.  Rows are
+written as runs finish, so an interrupted sweep can be resumed: runs that
+already have a row are skipped.
+
+Usage::
+
+    python -m paxos.sweep [results.csv]
+"""
+
+import contextlib
+import csv
+import multiprocessing
+import os
+import sys
+
+from paxos.sim import ResultSummary
+from paxos.sim_discrete import run_test
+from paxos.sim_failure import FailTestSystemConfig
+
+
+MESSAGE_HEADINGS = ["messages sent", "received messages", "failed messages",
+                    "total messages"]
+
+
+class Run:
+    """
+    Parameters of a single experiment run.
+    """
+
+    def __init__(self, num_agents, fail_rate, num_requests=1000, seed=0):
+        self.num_agents = num_agents
+        self.fail_rate = fail_rate
+        self.num_requests = num_requests
+        self.seed = seed
+
+    @property
+    def run_id(self):
+        return "{}-{}-{}-{}".format(self.num_agents, self.fail_rate,
+                                    self.num_requests, self.seed)
+
+    def get_config(self):
+        return FailTestSystemConfig(self.num_agents, self.num_agents,
+                                    self.num_agents,
+                                    num_test_requests=self.num_requests,
+                                    fail_rate=self.fail_rate)
+
+
+def get_headings():
+    return (["run", "agents", "fail rate", "requests", "seed"] +
+            ResultSummary.get_summary_headings() + MESSAGE_HEADINGS)
+
+
+def execute(run, output_dir):
+    """
+    Simulate a run, writing agent output to a log file named after the run
+    in output_dir.  Return the run's CSV row.
+    """
+    config = run.get_config()
+    path = os.path.join(output_dir, "{}.log".format(run.run_id))
+    with open(path, 'w') as f, contextlib.redirect_stdout(f):
+        system = run_test(config, seed=run.seed, quiet=False)
+    summary = system.logger.get_summary_data()
+    return ([run.run_id, run.num_agents, run.fail_rate, run.num_requests,
+             run.seed] + summary.get_summary_data() +
+            list(system.mailbox.get_counts()))
+
+
+def _execute(args):
+    return execute(*args)
+
+
+def completed_runs(filename):
+    """
+    Return the set of run ids that have a row in the given CSV file.
+    """
+    if not os.path.exists(filename):
+        return set()
+    with open(filename, newline='') as f:
+        return set(row["run"] for row in csv.DictReader(f))
+
+
+def run_sweep(runs, filename="sweep.csv", output_dir="sweep_output",
+              processes=None):
+    """
+    Execute the given runs on a pool of ``processes`` worker processes
+    (default: one per CPU), appending a row per run to filename as runs
+    finish.  Runs already in filename are skipped.
+    """
+    done = completed_runs(filename)
+    todo = [run for run in runs if run.run_id not in done]
+    print("{} runs, {} already done".format(len(runs), len(runs) - len(todo)))
+    if not todo:
+        return
+    os.makedirs(output_dir, exist_ok=True)
+    write_headings = not os.path.exists(filename)
+    with open(filename, 'a', newline='') as f, \
+            multiprocessing.Pool(processes) as pool:
+        writer = csv.writer(f)
+        if write_headings:
+            writer.writerow(get_headings())
+        args = [(run, output_dir) for run in todo]
+        for count, row in enumerate(pool.imap_unordered(_execute, args), 1):
+            writer.writerow(row)
+            # Flush every row so that an interrupted sweep keeps them.
+            f.flush()
+            print("[{}/{}] {}".format(count, len(todo), row[0]))
+
+
+def failrate_runs(num_requests=1000, seeds=(0,)):
+    """
+    The runs of ``sim_failure.run_failrate_tests``.
+    """
+    return [Run(num_agents, fail_rate, num_requests, seed)
+            for num_agents in (3, 5, 7, 9, 11)
+            for fail_rate in [0.0, 0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.35,
+                              0.4, 0.45, 0.5]
+            for seed in seeds]
+
+
+if __name__ == "__main__":
+    filename = sys.argv[1] if len(sys.argv) > 1 else "sweep.csv"
+    run_sweep(failrate_runs(), filename)
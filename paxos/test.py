@@ -1,11 +1,10 @@
 from collections import namedtuple
-from multiprocessing import Queue
 import random
 import time
 
 from paxos import SystemConfig
 from paxos.messages import *
-from paxos.sim import System, Mailbox
+from paxos.sim import System, Mailbox, get_context
 
 
 class DebugMailbox(Mailbox):
@@ -21,7 +20,7 @@ class DebugMailbox(Mailbox):
         if self.config.debug_messages:
             self.messages_sent = []
             self.messages_recv = []
-        self.debug_queue = Queue()
+        self.debug_queue = get_context(self.config).Queue()
 
     def is_protocol_message(self, msg):
         return isinstance(msg, (PrepareMsg, PrepareResponseMsg, AcceptMsg,
@@ -34,8 +33,25 @@ class DebugMailbox(Mailbox):
             source = getattr(msg, 'source', None)
             self.messages_sent.append((source, to))
 
-    def recv(self, from_):
-        msg = super(DebugMailbox, self).recv(from_)
+    def broadcast(self, msg, pids):
+        super(DebugMailbox, self).broadcast(msg, pids)
+        self.num_sent += len(pids)
+        if self.config.debug_messages:
+            source = getattr(msg, 'source', None)
+            for to in pids:
+                self.messages_sent.append((source, to))
+
+    def send_batches(self, batches):
+        super(DebugMailbox, self).send_batches(batches)
+        for to, msgs in batches.items():
+            self.num_sent += len(msgs)
+            if self.config.debug_messages:
+                for msg in msgs:
+                    source = getattr(msg, 'source', None)
+                    self.messages_sent.append((source, to))
+
+    def recv(self, from_, timeout=None):
+        msg = super(DebugMailbox, self).recv(from_, timeout)
         source = getattr(msg, 'source', None)
         if source is not None:
             self.num_recv += 1
@@ -168,7 +184,7 @@ def test_multi_paxos():
         # Always send to the same proposer, effectively using that proposer as
         # the leader.
         to = 0
-        system.mailbox.send(to, ClientRequestMsg(None, "Query {}".format(x)))
+        system.submit("Query {}".format(x), to)
         time.sleep(random.random()/10)
 
     system.shutdown_agents()
@@ -0,0 +1,344 @@
+"""
+Binary traces of the messages and decisions of a run, and their analysis.
+
+With ``SystemConfig(trace_dir=...)``, every agent writes each message it
+sends, receives or drops and each decision it makes to its own file in that
+directory, ``trace-<pid>.bin``.  The mailbox thread writes the messages it
+drops to ``trace-mailbox.bin``.  A file is a short header followed by fixed
+size records:
+
+    time (int64, ns) | event (uint8) | message type (uint8) | pid (int16) |
+    peer (int16) | instance (int64) | proposal number (int64)
+
+Times come from the monotonic clock, which all processes of a host share (or
+from the virtual clock of ``sim_discrete``), so files of one run can be
+merged.  Fields that don't apply are -1.
+
+Merge and analyze the files of a run with::
+
+    python -m paxos.trace <trace_dir>
+
+which prints the latency of each phase of the instances, and which acceptors
+were on their critical paths.
+"""
+
+from collections import defaultdict, deque, namedtuple, Counter
+import glob
+import os
+import struct
+import sys
+import time
+
+from paxos.messages import *
+
+
+MAGIC = b"PXTR"
+VERSION = 1
+HEADER = struct.Struct("<4sH")
+RECORD = struct.Struct("<qBBhhqq")
+
+# Events.
+SEND = 0
+RECV = 1
+DROP = 2
+DECIDE = 3
+EVENT_NAMES = ["send", "recv", "drop", "decide"]
+
+# Message types are stored as their index in this list.
+MESSAGE_TYPES = [
+    ClientRequestMsg, PrepareMsg, PrepareResponseMsg, AcceptMsg,
+    AcceptResponseMsg, RetryMsg, AdjustWeightsMsg, CatchupRequestMsg,
+    CatchupResponseMsg, BackpressureMsg, QuitMsg, PayloadMsg,
+]
+TYPE_CODES = dict((msg_type, code) for code, msg_type in enumerate(MESSAGE_TYPES))
+UNKNOWN_TYPE = 255
+NO_TYPE = 254
+
+TraceRecord = namedtuple("TraceRecord", ["time", "event", "type", "pid",
+                                         "peer", "instance", "number"])
+
+
+class TraceRecorder:
+    """
+    Writes trace records to a file.  ``clock`` returns the current time in
+    nanoseconds.
+    """
+
+    def __init__(self, path, clock=time.monotonic_ns):
+        self.path = path
+        self.clock = clock
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION))
+
+    @classmethod
+    def for_process(cls, trace_dir, name, clock=time.monotonic_ns):
+        os.makedirs(trace_dir, exist_ok=True)
+        path = os.path.join(trace_dir, "trace-{}.bin".format(name))
+        return cls(path, clock)
+
+    def record(self, event, msg, pid, peer=-1):
+        """
+        Record an event concerning msg.  For sent and dropped messages pid is
+        the sender and peer the destination, for received ones it's the
+        other way round.
+        """
+        proposal = getattr(msg, 'proposal', None)
+        if proposal is not None:
+            instance, number = proposal.instance, proposal.number
+        else:
+            instance, number = getattr(msg, 'instance', -1), -1
+        if pid is None:
+            pid = -1
+        if peer is None:
+            peer = -1
+        self.file.write(RECORD.pack(
+            self.clock(), event, TYPE_CODES.get(type(msg), UNKNOWN_TYPE),
+            pid, peer, instance, number))
+
+    def send(self, msg, pid, to):
+        self.record(SEND, msg, pid, to)
+
+    def recv(self, msg, pid):
+        self.record(RECV, msg, pid, getattr(msg, 'source', None))
+
+    def drop(self, msg, to):
+        self.record(DROP, msg, getattr(msg, 'source', None), to)
+
+    def decide(self, pid, instance, number=-1):
+        self.file.write(RECORD.pack(self.clock(), DECIDE, NO_TYPE, pid, -1,
+                                    instance, number))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read_trace(path):
+    """
+    Return the list of TraceRecords in a trace file.  The file of a process
+    that died may be missing records, or even its header.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return []
+        magic, version = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a version {} trace file"
+                             .format(path, VERSION))
+        data = f.read()
+    # Ignore a partial record at the end.
+    end = len(data) - len(data) % RECORD.size
+    return [TraceRecord(*fields)
+            for fields in RECORD.iter_unpack(data[:end])]
+
+
+def merge_traces(trace_dir):
+    """
+    Return the records of all trace files in trace_dir, ordered by time.
+    """
+    records = []
+    for path in glob.glob(os.path.join(trace_dir, "trace-*.bin")):
+        records.extend(read_trace(path))
+    records.sort(key=lambda record: record.time)
+    return records
+
+
+def type_name(code):
+    if code < len(MESSAGE_TYPES):
+        return MESSAGE_TYPES[code].__name__
+    return "-"
+
+
+def format_record(record):
+    return "{:>16} {:<6} {:<20} {:>3} -> {:>3}  I-{} N-{}".format(
+        record.time, EVENT_NAMES[record.event], type_name(record.type),
+        record.pid, record.peer, record.instance, record.number)
+
+
+class InstanceTimeline:
+    """
+    The times of the milestones of one instance, and the acceptors whose
+    responses completed its quorums.  Times are in nanoseconds.
+    """
+
+    def __init__(self, instance):
+        self.instance = instance
+        self.prepare_sent = None
+        self.accept_sent = None
+        self.chosen = None
+        self.learned = {}
+        # Acceptors whose response completed the prepare quorum at the
+        # proposer and the accept quorum at the first learner, with the
+        # (send, receive) times of those responses.
+        self.prepare_critical = None
+        self.accept_critical = None
+
+    @property
+    def first_learned(self):
+        return min(self.learned.values()) if self.learned else None
+
+    def phases(self):
+        """
+        Return a dict of phase name to latency in nanoseconds, for the
+        phases that completed.
+        """
+        phases = {}
+        if self.prepare_sent is not None and self.accept_sent is not None:
+            phases["prepare"] = self.accept_sent - self.prepare_sent
+        if self.accept_sent is not None and self.chosen is not None:
+            phases["accept"] = self.chosen - self.accept_sent
+        first = self.first_learned
+        if self.accept_sent is not None and first is not None:
+            phases["learn"] = first - self.accept_sent
+        if self.prepare_sent is not None and first is not None:
+            phases["total"] = first - self.prepare_sent
+        if len(self.learned) > 1:
+            phases["learner spread"] = max(self.learned.values()) - first
+        return phases
+
+
+def analyze(records, proposer_ids=None):
+    """
+    Build an InstanceTimeline for each instance from merged, time ordered
+    records.  Decisions by processes in proposer_ids (by default, processes
+    that sent prepare messages) are counted as the proposer's, all others as
+    learners'.
+    """
+    if proposer_ids is None:
+        prepare = TYPE_CODES[PrepareMsg]
+        proposer_ids = set(r.pid for r in records
+                           if r.event == SEND and r.type == prepare)
+    timelines = {}
+    # Sent, not yet received messages, keyed by the fields shared by the send
+    # and receive records, mapped to their send times.
+    in_flight = defaultdict(deque)
+    # The latest received response of each instance, per receiver and type.
+    last_response = {}
+
+    def timeline(instance):
+        if instance not in timelines:
+            timelines[instance] = InstanceTimeline(instance)
+        return timelines[instance]
+
+    prepare, accept = TYPE_CODES[PrepareMsg], TYPE_CODES[AcceptMsg]
+    responses = (TYPE_CODES[PrepareResponseMsg], TYPE_CODES[AcceptResponseMsg])
+    for r in records:
+        if r.event == SEND:
+            in_flight[(r.type, r.pid, r.peer, r.instance, r.number)].append(r.time)
+            if r.type == prepare and timeline(r.instance).prepare_sent is None:
+                timeline(r.instance).prepare_sent = r.time
+            elif r.type == accept:
+                t = timeline(r.instance)
+                if t.accept_sent is None:
+                    t.accept_sent = r.time
+                    t.prepare_critical = last_response.get(
+                        (r.pid, responses[0], r.instance))
+        elif r.event == RECV:
+            sends = in_flight.get((r.type, r.peer, r.pid, r.instance, r.number))
+            sent = sends.popleft() if sends else None
+            if r.type in responses:
+                last_response[(r.pid, r.type, r.instance)] = \
+                        (r.peer, sent, r.time)
+        elif r.event == DECIDE:
+            t = timeline(r.instance)
+            if r.pid in proposer_ids:
+                if t.chosen is None:
+                    t.chosen = r.time
+            elif r.pid not in t.learned:
+                if not t.learned:
+                    t.accept_critical = last_response.get(
+                        (r.pid, responses[1], r.instance))
+                t.learned[r.pid] = r.time
+    return timelines
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def print_report(timelines):
+    """
+    Print latency statistics of each phase over all instances, and how often
+    each acceptor completed a quorum.
+    """
+    phases = defaultdict(list)
+    for t in timelines.values():
+        for name, latency in t.phases().items():
+            phases[name].append(latency / 1e6)
+    print("Instances: {}, learned: {}".format(
+          len(timelines), sum(1 for t in timelines.values() if t.learned)))
+    print("{:<16} {:>8} {:>10} {:>10} {:>10} {:>10}".format(
+          "phase (ms)", "count", "mean", "p50", "p99", "max"))
+    for name in ("prepare", "accept", "learn", "total", "learner spread"):
+        values = sorted(phases[name])
+        if not values:
+            continue
+        print("{:<16} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+              name, len(values), sum(values) / len(values),
+              percentile(values, 50), percentile(values, 99), values[-1]))
+
+    for label, attr in (("prepare", "prepare_critical"),
+                        ("accept", "accept_critical")):
+        counts = Counter()
+        delays = defaultdict(list)
+        for t in timelines.values():
+            critical = getattr(t, attr)
+            if critical:
+                pid, sent, received = critical
+                counts[pid] += 1
+                if sent is not None:
+                    delays[pid].append((received - sent) / 1e6)
+        if not counts:
+            continue
+        print("Acceptors completing the {} quorum:".format(label))
+        for pid, count in counts.most_common():
+            mean = sum(delays[pid]) / len(delays[pid]) if delays[pid] else 0
+            print("    {:>3}: {:>6} instances, mean response delivery "
+                  "{:.3f} ms".format(pid, count, mean))
+
+
+def print_critical_path(timeline):
+    """
+    Print the milestones of one instance in time order.
+    """
+    t = timeline
+    print("Instance {}:".format(t.instance))
+    start = t.prepare_sent
+    if start is None:
+        return
+    def at(when):
+        if when is None:
+            return "-"
+        return "{:10.3f} ms".format((when - start) / 1e6)
+    # (time, label, send time of a response) of each milestone, in causal
+    # order, which the sort keeps for milestones at the same time.
+    milestones = [(t.prepare_sent, "prepare sent", None)]
+    if t.prepare_critical:
+        pid, sent, received = t.prepare_critical
+        milestones.append((received, "promise from {:>3}".format(pid), sent))
+    milestones.append((t.accept_sent, "accept sent", None))
+    if t.accept_critical:
+        pid, sent, received = t.accept_critical
+        milestones.append((received, "accepted by {:>3}".format(pid), sent))
+    milestones.append((t.chosen, "chosen", None))
+    for pid, when in t.learned.items():
+        milestones.append((when, "learned by {:>3}".format(pid), None))
+    # Milestones that weren't reached go last.
+    milestones.sort(key=lambda m: (m[0] is None, m[0] or 0))
+    for when, label, sent in milestones:
+        line = "  {:<19} {}".format(label, at(when))
+        if sent is not None:
+            line += " (sent {})".format(at(sent))
+        print(line)
+
+
+if __name__ == "__main__":
+    trace_dir = sys.argv[1]
+    records = merge_traces(trace_dir)
+    timelines = analyze(records)
+    print_report(timelines)
+    if len(sys.argv) > 2:
+        print_critical_path(timelines[int(sys.argv[2])])
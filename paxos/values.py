@@ -0,0 +1,183 @@
+"""
+A content-addressed store for large values.
+
+Proposal values are pickled into every message that carries them, so a large
+value is copied from the client to the proposer, to every acceptor and on to
+every learner.  With ``SystemConfig(value_threshold=...)``, ``System.submit``
+writes values of at least that many bytes once to a ``ValueStore``, a
+directory of files named by the SHA-256 of their contents (in ``/dev/shm``
+where it exists, so they stay in memory), and proposes a small
+``ValueHandle`` instead.  Handles compare equal when their contents do, so
+the protocol agrees on handles just as on the values themselves.  Whoever
+needs the value resolves the handle, which memory-maps the file.
+
+With ``SystemConfig(payload_split=True)``, which doesn't need the processes
+to share a file system, ``submit`` instead sends the value to the learners
+directly and has Paxos order a ``PayloadRef`` to it.  Learners hold back a
+decided reference until its payload has arrived.
+"""
+
+import hashlib
+import mmap
+import os
+import pickle
+import shutil
+import tempfile
+import weakref
+
+
+class ValueHandle:
+    """
+    Refers to a value in a ValueStore by the digest of its contents.  The
+    value is read from the store the first time it's resolved, and kept.
+    """
+
+    def __init__(self, digest, size, path, raw=False):
+        self.digest = digest
+        self.size = size
+        # Path of the file holding the value.
+        self.path = path
+        # True if the value is bytes stored as is, rather than pickled.
+        self.raw = raw
+        self.value = None
+        self.resolved = False
+
+    def __getstate__(self):
+        # Only the reference is sent, never a resolved value.
+        state = self.__dict__.copy()
+        state["value"] = None
+        state["resolved"] = False
+        return state
+
+    def __eq__(self, other):
+        return isinstance(other, ValueHandle) and self.digest == other.digest
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __str__(self):
+        return "<value {}, {} bytes>".format(self.digest[:12], self.size)
+
+    __repr__ = __str__
+
+    def view(self):
+        """
+        Return a read-only memoryview of the stored bytes, mapped from the
+        file without copying.
+        """
+        with open(self.path, 'rb') as f:
+            if not self.size:
+                return memoryview(b"")
+            return memoryview(mmap.mmap(f.fileno(), 0,
+                                        access=mmap.ACCESS_READ))
+
+    def resolve(self):
+        """
+        Return the value.
+        """
+        if not self.resolved:
+            data = self.view()
+            self.value = bytes(data) if self.raw else pickle.loads(data)
+            self.resolved = True
+        return self.value
+
+
+class PayloadRef:
+    """
+    Stands for a value whose payload is sent to the learners separately, in
+    a PayloadMsg, so that only this small reference is ordered by Paxos.
+    """
+
+    def __init__(self, digest, size):
+        self.digest = digest
+        self.size = size
+
+    @classmethod
+    def for_value(cls, value):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        return cls(hashlib.sha256(data).hexdigest(), len(data))
+
+    def __eq__(self, other):
+        return isinstance(other, PayloadRef) and self.digest == other.digest
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __str__(self):
+        return "<payload {}, {} bytes>".format(self.digest[:12], self.size)
+
+    __repr__ = __str__
+
+
+def resolve(value):
+    """
+    Return value, resolved if it's a ValueHandle.
+    """
+    if isinstance(value, ValueHandle):
+        return value.resolve()
+    return value
+
+
+class ValueStore:
+    """
+    Stores values of at least ``threshold`` bytes, pickled, or as is if they
+    are bytes, in files of ``directory``.  If no directory is given, a
+    temporary one is created and removed when the store is garbage collected
+    or the program exits.  Agent processes only need the handles, which carry
+    their file's path, so the store itself stays in the system process.
+    """
+
+    def __init__(self, threshold, directory=None):
+        self.threshold = threshold
+        if directory is None:
+            parent = "/dev/shm" if os.path.isdir("/dev/shm") else None
+            directory = tempfile.mkdtemp(prefix="paxos-values-", dir=parent)
+            self.cleanup = weakref.finalize(self, shutil.rmtree, directory,
+                                            ignore_errors=True)
+        else:
+            os.makedirs(directory, exist_ok=True)
+            self.cleanup = None
+        self.directory = directory
+
+    def wrap(self, value):
+        """
+        Return a ValueHandle for value if it's large enough to store, else
+        value itself.
+        """
+        if isinstance(value, ValueHandle):
+            return value
+        raw = isinstance(value, (bytes, bytearray, memoryview))
+        if raw:
+            if len(value) < self.threshold:
+                return value
+            data = value
+        else:
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            if len(data) < self.threshold:
+                return value
+        return self.put(data, raw)
+
+    def put(self, data, raw=False):
+        """
+        Store data, unless it's already stored, and return its handle.
+        """
+        # Raw and pickled values with the same bytes are different values.
+        hasher = hashlib.sha256(b"r" if raw else b"p")
+        hasher.update(data)
+        digest = hasher.hexdigest()
+        path = os.path.join(self.directory, digest)
+        if not os.path.exists(path):
+            # Write to a temporary name first, so that no reader sees a
+            # partial file.
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return ValueHandle(digest, len(data), path, raw)
+
+    def close(self):
+        """
+        Remove the store's directory, if it created it.
+        """
+        if self.cleanup:
+            self.cleanup()
@@ -0,0 +1,38 @@
+"""
+Stand-ins for the mailbox and logger of agents driven in-process by tests.
+"""
+
+from paxos.sim import Mailbox
+
+
+class RecordingMailbox(Mailbox):
+    """
+    A Mailbox that keeps sent messages as (destination, message) pairs.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.sent = []
+
+    def send_batches(self, batches):
+        for pid, msgs in sorted(batches.items()):
+            self.sent.extend((pid, msg) for msg in msgs)
+
+    def broadcast(self, msg, pids):
+        self.sent.extend((pid, msg) for pid in pids)
+
+    def take(self):
+        """
+        Return the messages sent so far and forget them.
+        """
+        sent, self.sent = self.sent, []
+        return sent
+
+
+class RecordingLogger:
+
+    def __init__(self):
+        self.results = []
+
+    def log_result(self, source, instance, value):
+        self.results.append((instance, value))
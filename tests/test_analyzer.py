@@ -0,0 +1,106 @@
+"""
+Tests of the reliability and latency estimates of Analyzer, and of the
+weights LatencyAnalyzer derives from them.
+"""
+
+from itertools import combinations
+
+import pytest
+
+from paxos.analyzer import Analyzer, LatencyAnalyzer
+
+
+class Clock:
+    now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_analyzer(**kwargs):
+    clock = Clock()
+    return Analyzer([0, 1, 2], clock=clock, **kwargs), clock
+
+
+def test_reliability_moves_towards_answered_fraction():
+    analyzer, clock = make_analyzer(alpha=0.5)
+    analyzer.add_send(0, "a")
+    analyzer.add_send(0, "b")
+    analyzer.add_recvd(0, "a")
+    assert analyzer.reliability[0] == 1.0
+    clock.now = 2.0
+    analyzer.expire()
+    assert analyzer.reliability[0] == 0.5
+    analyzer.add_send(0, "c")
+    analyzer.add_recvd(0, "c")
+    assert analyzer.reliability[0] == 0.75
+    # A response after the message was counted as lost is ignored.
+    analyzer.add_recvd(0, "b")
+    assert analyzer.reliability[0] == 0.75
+
+
+def test_latency_is_a_moving_average_of_round_trips():
+    analyzer, clock = make_analyzer(alpha=0.5)
+    for n, rtt in enumerate([0.2, 0.1, 0.1]):
+        analyzer.add_send(1, n)
+        clock.now += rtt
+        analyzer.add_recvd(1, n)
+    assert analyzer.latency[1] == pytest.approx(0.125)
+    assert analyzer.latency[0] is None
+
+
+def test_expire_only_counts_messages_past_the_timeout():
+    analyzer, clock = make_analyzer(alpha=0.5, loss_timeout=1.0)
+    analyzer.add_send(0, "old")
+    clock.now = 0.5
+    analyzer.add_send(1, "new")
+    # Sending again restarts the message's wait.
+    analyzer.add_send(0, "old")
+    clock.now = 1.2
+    analyzer.expire()
+    assert analyzer.reliability == {0: 1.0, 1: 1.0, 2: 1.0}
+    clock.now = 1.6
+    analyzer.expire()
+    assert analyzer.reliability == {0: 0.5, 1: 0.5, 2: 1.0}
+    assert not analyzer.outstanding
+
+
+def test_zero_latency_counts_as_the_fastest():
+    analyzer, _ = make_analyzer()
+    analyzer.latency = {0: 0.0, 1: 0.1, 2: None}
+    scores = analyzer.scores()
+    assert scores[0] == 1.0
+    assert scores[1] == 0.5
+    assert scores[2] == 1.0
+
+
+def quorums(weights):
+    """
+    Return the sets of acceptors that hold a majority of the weight.
+    """
+    pids = sorted(weights)
+    sets = (frozenset(pid for i, pid in enumerate(pids) if mask >> i & 1)
+            for mask in range(1, 1 << len(pids)))
+    return [s for s in sets if sum(weights[pid] for pid in s) > 0.5]
+
+
+@pytest.mark.parametrize("n", [4, 5, 6, 7])
+def test_fast_quorum_is_smaller_than_a_majority(n):
+    acceptor_ids = list(range(n))
+    analyzer = LatencyAnalyzer(acceptor_ids, clock=Clock())
+    for pid in acceptor_ids:
+        analyzer.samples[pid].extend([0.01 * (pid + 1)] * 10)
+    weights = analyzer.compute_weights()
+    fast_quorum = set(analyzer.fast_quorum)
+    assert fast_quorum == set(range(len(fast_quorum)))
+    assert len(fast_quorum) < n // 2 + 1
+    weighted = quorums(weights)
+    assert fast_quorum in weighted
+    assert min(len(s) for s in weighted) == len(fast_quorum)
+    # The acceptors left after any fault_tolerance of them fail still form
+    # a quorum.
+    assert analyzer.fault_tolerance >= 1
+    for failed in combinations(acceptor_ids, analyzer.fault_tolerance):
+        assert frozenset(acceptor_ids) - frozenset(failed) in weighted
+    # Quorums still intersect.
+    assert all(a & b for a in weighted for b in weighted)
@@ -0,0 +1,110 @@
+"""
+Tests of AcceptorTable, and of CompactAcceptor against Acceptor.
+"""
+
+import random
+
+from paxos.compact import AcceptorTable, NO_PROPOSAL
+from paxos.messages import (Proposal, PrepareMsg, PrepareResponseMsg,
+                            AcceptMsg)
+from paxos.microbench import (StubAcceptor, StubCompactAcceptor,
+                              get_config)
+
+
+class RecordingAcceptor(StubAcceptor):
+
+    def __init__(self, config):
+        super(RecordingAcceptor, self).__init__(config, pid=1)
+        self.sent = []
+
+    def send_message(self, msg, pids, immediate=False):
+        self.sent.append(describe(msg, pids))
+
+
+class RecordingCompactAcceptor(StubCompactAcceptor):
+
+    def __init__(self, config):
+        super(RecordingCompactAcceptor, self).__init__(config, pid=1)
+        self.sent = []
+        # Exercise the sparse dict as well as the arrays.
+        self.table = AcceptorTable(max_gap=64)
+
+    def send_message(self, msg, pids, immediate=False):
+        self.sent.append(describe(msg, pids))
+
+
+def describe(msg, pids):
+    """
+    Return what a sent message says, as a tuple.  The instance of a prepare
+    response's highest accepted proposal, when there is none, isn't
+    compared: Acceptor leaves it None.
+    """
+    fields = (type(msg).__name__, msg.source, tuple(pids),
+              msg.proposal.number, msg.proposal.instance, msg.proposal.value)
+    if isinstance(msg, PrepareResponseMsg):
+        fields += (msg.highest_proposal.number, msg.highest_proposal.value)
+    return fields
+
+
+def test_compact_acceptor_sends_the_same_messages_as_acceptor():
+    config = get_config(3)
+    acceptors = [RecordingAcceptor(config), RecordingCompactAcceptor(config)]
+    rand = random.Random(0)
+    instances = list(range(1, 200)) + [1000, 5000, 100000]
+    for _ in range(20000):
+        instance = rand.choice(instances)
+        proposal = Proposal(rand.randrange(20), instance, 0,
+                            rand.choice("abc"))
+        if rand.random() < 0.5:
+            msg = PrepareMsg(0, proposal)
+            for acceptor in acceptors:
+                acceptor.handle_prepare(msg)
+        else:
+            learner_ids = rand.choice([None, [4]])
+            msg = AcceptMsg(0, proposal, learner_ids)
+            for acceptor in acceptors:
+                acceptor.handle_accept(msg)
+        assert acceptors[0].sent == acceptors[1].sent
+    assert len(acceptors[0].sent) > 1000
+
+
+def test_table_grows_past_its_gap():
+    table = AcceptorTable(max_gap=100)
+    for instance in range(1, 1001):
+        table.set_promised(instance, instance)
+    assert not table.sparse
+    assert table.get(1000) == (1000, NO_PROPOSAL, None)
+    assert table.get(1001) == (NO_PROPOSAL, NO_PROPOSAL, None)
+
+
+def test_table_takes_in_far_instances_once_reached():
+    table = AcceptorTable(max_gap=100)
+    table.set_accepted(500, 3, "far")
+    assert 500 in table.sparse
+    for instance in range(1, 450):
+        table.set_promised(instance, 1)
+    assert not table.sparse
+    assert table.get(500) == (NO_PROPOSAL, 3, "far")
+
+
+def test_table_scans_in_instance_order():
+    table = AcceptorTable(base=10, max_gap=100)
+    table.set_promised(5, 1)
+    table.set_promised(12, 2)
+    table.set_accepted(11, 3, "x")
+    table.set_promised(1000, 4)
+    assert [entry[0] for entry in table.scan()] == [5, 11, 12, 1000]
+    assert [entry[0] for entry in table.scan(12)] == [12, 1000]
+
+
+def test_table_discards_instances_below():
+    table = AcceptorTable(max_gap=100)
+    for instance in range(1, 51):
+        table.set_accepted(instance, 1, instance)
+    table.set_promised(1000, 2)
+    table.discard_below(40)
+    assert table.base == 40
+    assert table.get(39) == (NO_PROPOSAL, NO_PROPOSAL, None)
+    assert table.get(45) == (NO_PROPOSAL, 1, 45)
+    assert [entry[0] for entry in table.scan()] == \
+        list(range(40, 51)) + [1000]
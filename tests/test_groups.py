@@ -0,0 +1,35 @@
+"""
+Tests of GroupRouter and of the log positions of consensus groups.
+"""
+
+from paxos import SystemConfig
+from paxos.groups import GroupRouter
+
+
+def test_single_group_routes_everything_to_group_0():
+    router = GroupRouter(1)
+    assert {router.group_for(key) for key in ["a", b"b", 3, (4, 5)]} == {0}
+
+
+def test_same_key_same_group():
+    router = GroupRouter(4)
+    for key in ["a", b"a", 7, ("x", 1)]:
+        assert router.group_for(key) == router.group_for(key)
+    # A str key is routed as its UTF-8 bytes.
+    assert router.group_for("key") == router.group_for(b"key")
+
+
+def test_keys_spread_over_groups():
+    router = GroupRouter(4)
+    groups = [router.group_for("key-{}".format(n)) for n in range(1000)]
+    for group in range(4):
+        assert 150 < groups.count(group) < 350
+
+
+def test_log_positions_interleave_groups():
+    config = SystemConfig(3, 3, 1, num_groups=3)
+    positions = [config.log_position(group, number)
+                 for number in (1, 2) for group in range(3)]
+    assert positions == [1, 2, 3, 4, 5, 6]
+    assert [config.group_of(i) for i in positions] == [0, 1, 2, 0, 1, 2]
+    assert [config.group_leader(g) for g in range(3)] == [0, 1, 2]
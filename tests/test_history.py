@@ -0,0 +1,64 @@
+"""
+Tests of DecidedLog.
+"""
+
+import os
+
+from paxos.history import DecidedLog
+
+
+def test_values_are_read_back(tmp_path):
+    log = DecidedLog(str(tmp_path))
+    log[2] = "two"
+    log[1] = {"one": 1}
+    log[2] = "two again"
+    assert log[1] == {"one": 1}
+    assert log[2] == "two again"
+    assert 3 not in log
+    assert log.get(3) is None
+    assert len(log) == 2
+    assert list(log.scan()) == [(1, {"one": 1}), (2, "two again")]
+    assert list(log.scan(2)) == [(2, "two again")]
+    log.close()
+
+
+def test_segments_roll_and_are_recovered(tmp_path):
+    log = DecidedLog(str(tmp_path), segment_size=256)
+    for instance in range(1, 101):
+        log[instance] = "value {}".format(instance)
+    assert len(log.segments) > 1
+    log.close()
+    log = DecidedLog(str(tmp_path), segment_size=256)
+    assert len(log) == 100
+    assert log[57] == "value 57"
+    assert [i for i, _ in log.scan(95)] == [95, 96, 97, 98, 99, 100]
+    log.close()
+
+
+def test_value_larger_than_a_segment(tmp_path):
+    log = DecidedLog(str(tmp_path), segment_size=64)
+    log[1] = b"x" * 1000
+    log[2] = "small"
+    assert log[1] == b"x" * 1000
+    assert log[2] == "small"
+    log.close()
+
+
+def test_discard_below_deletes_old_segments(tmp_path):
+    log = DecidedLog(str(tmp_path), segment_size=256)
+    for instance in range(1, 101):
+        log[instance] = "value {}".format(instance)
+    num_segments = len(os.listdir(str(tmp_path)))
+    log.discard_below(90)
+    assert 89 not in log
+    assert log[90] == "value 90"
+    assert len(log) == 11
+    # The discarded instances aren't logged again.
+    log[10] = "late"
+    assert 10 not in log
+    assert len(os.listdir(str(tmp_path))) < num_segments
+    log.close()
+    log = DecidedLog(str(tmp_path), segment_size=256)
+    assert log.base == 90
+    assert [i for i, _ in log.scan()] == list(range(90, 101))
+    log.close()
@@ -0,0 +1,107 @@
+"""
+Tests of how a Learner resolves the payloads of split values and serves
+catch-up, driven in-process with a mailbox that records sent messages.
+"""
+
+import os
+
+from paxos import Learner, SystemConfig
+from paxos.messages import (Proposal, AcceptResponseMsg, PayloadMsg,
+                            CatchupRequestMsg, CatchupResponseMsg)
+from paxos.values import PayloadRef
+
+from recording import RecordingMailbox, RecordingLogger
+
+
+def make_learner(**kwargs):
+    kwargs.setdefault("payload_split", True)
+    config = SystemConfig(1, 3, 2, message_timeout=1, **kwargs)
+    learner = Learner(config.learner_ids[0], RecordingMailbox(config),
+                      RecordingLogger())
+    now = [0.0]
+    learner.clock = lambda: now[0]
+    learner.set_config(config)
+    return learner, now
+
+
+def decide(learner, instance, value):
+    learner.log_result(AcceptResponseMsg(1, Proposal(0, instance,
+                                                     value=value)))
+
+
+def test_payload_is_forgotten_once_decided():
+    learner, _ = make_learner()
+    ref = PayloadRef.for_value("v")
+    # Submitted twice.
+    learner.process_message(PayloadMsg(None, ref, "v"))
+    learner.process_message(PayloadMsg(None, ref, "v"))
+    decide(learner, 1, ref)
+    assert ref in learner.payloads
+    decide(learner, 2, ref)
+    assert not learner.payloads
+    assert not learner.payload_counts
+    assert learner.logger.results == [(1, "v"), (2, "v")]
+
+
+def test_missing_payload_is_fetched_from_other_learners():
+    learner, now = make_learner()
+    ref = PayloadRef.for_value("v")
+    decide(learner, 3, ref)
+    learner.process_timeout()
+    assert not learner.mailbox.sent
+    now[0] = 2.0
+    learner.process_timeout()
+    [(pid, request)] = learner.mailbox.sent
+    assert pid == 5
+    assert isinstance(request, CatchupRequestMsg)
+    assert request.instance == 3
+    learner.process_message(CatchupResponseMsg(5, {3: "v"}))
+    assert learner.logger.results == [(3, "v")]
+    assert not learner.awaiting_payload
+    # The payload arriving late isn't kept.
+    learner.process_message(PayloadMsg(None, ref, "v"))
+    assert not learner.payloads
+    assert not learner.payload_counts
+    assert learner.logger.results == [(3, "v")]
+
+
+def test_catchup_is_sent_in_chunks(tmp_path):
+    learner, _ = make_learner(decided_log_dir=str(tmp_path))
+    learner.catchup_chunk_size = 4
+    for instance in range(1, 11):
+        decide(learner, instance, instance)
+    learner.process_message(CatchupRequestMsg(5, 2))
+    responses = [msg.results for _, msg in learner.mailbox.sent]
+    assert [sorted(results) for results in responses] == \
+        [[2, 3, 4, 5], [6, 7, 8, 9], [10]]
+    learner.handle_quit()
+
+
+def test_decided_log_is_truncated(tmp_path):
+    learner, _ = make_learner(decided_log_dir=str(tmp_path),
+                              retain_instances=10)
+    learner.decided_log.segment_size = 256
+    for instance in range(1, 101):
+        decide(learner, instance, "value {}".format(instance))
+    log = learner.decided_log
+    # Discarded in steps of retain_instances.
+    assert 80 <= log.base <= 91
+    assert 79 not in log
+    assert log[100] == "value 100"
+    assert min(log.segments) > 0
+    learner.handle_quit()
+
+
+def test_each_run_has_its_own_decided_logs(tmp_path):
+    learner, _ = make_learner(decided_log_dir=str(tmp_path))
+    decide(learner, 1, "old")
+    learner.handle_quit()
+    run_id = learner.config.run_id
+    learner, _ = make_learner(decided_log_dir=str(tmp_path))
+    assert 1 not in learner.results
+    learner.handle_quit()
+    assert len(os.listdir(str(tmp_path))) == 2
+    # Naming the earlier run recovers its log.
+    learner, _ = make_learner(decided_log_dir=str(tmp_path), run_id=run_id)
+    assert learner.results[1] == "old"
+    learner.handle_quit()
@@ -0,0 +1,134 @@
+"""
+Tests of the bounded inboxes of sim.Mailbox, driven without the mailbox
+thread or agent processes.
+"""
+
+import copy
+import time
+from threading import Thread
+
+from paxos import SystemConfig
+from paxos.messages import Proposal, PrepareMsg, QuitMsg, RetryMsg
+from paxos.parallel import ParallelAcceptor
+from paxos.sim import Mailbox
+
+
+def make_mailbox(policy, size, **kwargs):
+    return Mailbox(SystemConfig(1, 1, 1, inbox_size=size,
+                                overflow_policy=policy, **kwargs))
+
+
+def test_drop_oldest_keeps_control_messages_in_order():
+    mailbox = make_mailbox("drop_oldest", 4)
+    mailbox.deliver(1, QuitMsg(None), None)
+    for n in range(10):
+        mailbox.deliver(1, mailbox.encode(RetryMsg(0, n)), 0)
+    received = []
+    for _ in range(4):
+        received.append(mailbox.recv(1, timeout=1))
+        mailbox.feed(1)
+    assert isinstance(received[0], QuitMsg)
+    # The inbox queue took the first two messages, and the oldest of the
+    # backlog were dropped to make room for the later ones.
+    assert [msg.instance for msg in received[1:]] == [0, 8, 9]
+    assert mailbox.num_dropped == 7
+
+
+def test_block_bounds_unreceived_frames():
+    mailbox = make_mailbox("block", 2, message_timeout=0.05)
+    for n in range(3):
+        mailbox.send(1, RetryMsg(0, n))
+    # The third message waited for a message timeout and was dropped.
+    assert mailbox.unreceived[1] == 2
+    assert mailbox.num_dropped == 1
+    assert mailbox.funnel.get(timeout=1)[1].instance == 0
+    mailbox.deliver(1, RetryMsg(0, 0), 0)
+    assert mailbox.recv(1, timeout=1).instance == 0
+    assert mailbox.unreceived[1] == 1
+
+
+def test_blocked_sender_wakes_up_when_a_frame_is_received():
+    mailbox = make_mailbox("block", 1, message_timeout=30)
+    mailbox.send(1, RetryMsg(0, 0))
+    mailbox.deliver(1, mailbox.funnel.get(timeout=1)[1], 0)
+    sender = Thread(target=mailbox.send, args=(1, RetryMsg(0, 1)))
+    sender.start()
+    sender.join(0.2)
+    assert sender.is_alive()
+    started = time.monotonic()
+    assert mailbox.recv(1, timeout=1).instance == 0
+    sender.join(5)
+    assert not sender.is_alive()
+    assert time.monotonic() - started < 5
+    assert mailbox.funnel.get(timeout=1)[1].instance == 1
+    assert mailbox.num_dropped == 0
+
+
+def test_agents_do_not_wait_for_proposers():
+    mailbox = make_mailbox("block", 1, message_timeout=30)
+    for n in range(3):
+        mailbox.send(0, RetryMsg(1, n))
+    assert mailbox.unreceived[0] == 3
+    assert mailbox.num_dropped == 0
+
+
+def test_depth_is_the_inbox_queue_only():
+    mailbox = make_mailbox("signal", 4)
+    mailbox.deliver(1, mailbox.encode(RetryMsg(0, 1)), 0)
+    mailbox.deliver(1, [mailbox.encode(RetryMsg(0, 2)),
+                        mailbox.encode(RetryMsg(0, 3))], 0)
+    assert mailbox.recv(1, timeout=1).instance == 1
+    assert mailbox.recv(1, timeout=1).instance == 2
+    # The rest of the frame is pending in this process, not in the inbox.
+    assert mailbox.depth(1) == 0
+    assert mailbox.recv(1).instance == 3
+
+
+def test_mailbox_becomes_active_again_when_messages_arrive():
+    mailbox = make_mailbox("signal", 4, message_timeout=0.2)
+    thread = Thread(target=mailbox.run)
+    thread.start()
+    assert mailbox.idle.wait(5)
+    assert not mailbox.active
+    mailbox.funnel.put((1, RetryMsg(0, 1), 0))
+    assert mailbox.recv(1, timeout=5).instance == 1
+    assert mailbox.active
+    assert not mailbox.idle.is_set()
+    # And it goes idle again.
+    assert mailbox.idle.wait(5)
+    mailbox.funnel.put(None)
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+def test_prepare_and_accept_go_to_partition_inboxes():
+    mailbox = Mailbox(SystemConfig(1, 1, 1, acceptor_class=ParallelAcceptor,
+                                   acceptor_workers=3))
+    inboxes = mailbox.partitions[1]
+    assert len(inboxes) == 3
+    prepares = [PrepareMsg(0, Proposal(0, instance)) for instance in range(6)]
+    mailbox.send_batches({1: prepares})
+    mailbox.send(1, QuitMsg(None))
+    routed = {}
+    for _ in range(4):
+        to, frame, _ = mailbox.funnel.get(timeout=1)
+        routed[to] = frame
+    # Quit goes to the acceptor's own inbox, and each partition gets a frame
+    # of its instances.
+    assert isinstance(routed.pop(1), QuitMsg)
+    assert sorted(routed) == inboxes
+    for index, inbox in enumerate(inboxes):
+        instances = [mailbox.decode(data).proposal.instance
+                     for data in routed[inbox]]
+        assert instances == [index, index + 3]
+    assert mailbox.get_depths().keys() >= {"1.0", "1.1", "1.2"}
+
+
+def test_worker_mailbox_only_has_its_inbox_and_copies_again():
+    mailbox = Mailbox(SystemConfig(1, 1, 1, acceptor_class=ParallelAcceptor))
+    inbox = mailbox.partitions[1][1]
+    # Copying goes through __getstate__, like pickling for a new process,
+    # which a copy without an idle event must support too.
+    worker_mailbox = copy.copy(mailbox.for_inbox(inbox))
+    assert [i for i, queue in enumerate(worker_mailbox.inbox)
+            if queue is not None] == [inbox]
@@ -0,0 +1,77 @@
+"""
+Tests of acceptors and learners joining and leaving a running system,
+driven in-process with mailboxes that record sent messages.
+"""
+
+from paxos import Learner, Proposer, SystemConfig
+from paxos.messages import (Proposal, AcceptResponseMsg, ClientRequestMsg,
+                            PrepareMsg)
+from paxos.reconfig import MembershipChange
+
+from recording import RecordingMailbox, RecordingLogger
+
+
+def make_config():
+    return SystemConfig(1, 3, 2, num_spare=1, reconfiguration_window=2,
+                        message_timeout=1)
+
+
+def make_agent(agent_class, pid, config):
+    agent = agent_class(pid, RecordingMailbox(config), RecordingLogger())
+    agent.set_config(config)
+    return agent
+
+
+def accept(learner, source, instance, value):
+    learner.process_message(AcceptResponseMsg(
+        source, Proposal(0, instance, value=value)))
+
+
+def test_added_learner_catches_up():
+    config = make_config()
+    learner = make_agent(Learner, 4, config)
+    change = MembershipChange(add_learners=[6])
+    values = [change, "a", "b"]
+    for instance, value in enumerate(values, 1):
+        for source in config.acceptor_ids[:2]:
+            accept(learner, source, instance, value)
+    assert learner.logger.results == list(enumerate(values, 1))
+    # Spare pid 6 joins and asks the other learners for the values.
+    added = make_agent(Learner, 6, config)
+    requests = added.mailbox.take()
+    assert sorted(pid for pid, _ in requests) == [4, 5]
+    learner.process_message(dict(requests)[4])
+    for pid, response in learner.mailbox.take():
+        assert pid == 6
+        added.process_message(response)
+    assert added.logger.results == list(enumerate(values, 1))
+    assert added.schedule.members_for(3) == ([1, 2, 3], [4, 5, 6])
+
+
+def test_retired_acceptor_leaves_quorums_from_the_effective_instance():
+    config = make_config()
+    change = MembershipChange(remove_acceptors=[1])
+    proposer = make_agent(Proposer, 0, config)
+    proposer.process_message(ClientRequestMsg(None, change))
+    proposer.record_decision(1, change)
+    proposer.mailbox.take()
+    proposer.process_message(ClientRequestMsg(None, "a"))
+    proposer.process_message(ClientRequestMsg(None, "b"))
+    prepared = {}
+    for pid, msg in proposer.mailbox.take():
+        if isinstance(msg, PrepareMsg):
+            prepared.setdefault(msg.proposal.instance, []).append(pid)
+    # The change was chosen in instance 1 and takes effect in instance 3.
+    assert prepared == {2: [1, 2, 3], 3: [2, 3]}
+
+    learner = make_agent(Learner, 4, config)
+    for source in [1, 2]:
+        accept(learner, source, 1, change)
+    for instance in [2, 3]:
+        for source in [1, 2]:
+            accept(learner, source, instance, instance)
+    # Acceptors 1 and 2 are a quorum of instance 2, but only acceptor 2
+    # counts in instance 3, where acceptors 2 and 3 are needed.
+    assert learner.logger.results == [(1, change), (2, 2)]
+    accept(learner, 3, 3, 3)
+    assert learner.logger.results == [(1, change), (2, 2), (3, 3)]
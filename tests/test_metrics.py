@@ -0,0 +1,86 @@
+"""
+Tests of Histogram, MetricsRegistry and MetricsCollector.
+"""
+
+import random
+
+from paxos.metrics import Histogram, MetricsRegistry
+from paxos.sim import MetricsCollector
+
+
+def test_percentiles_are_within_the_relative_error():
+    histogram = Histogram()
+    values = [random.Random(0).uniform(1e-6, 10) for _ in range(10000)]
+    for value in values:
+        histogram.record(value)
+    values.sort()
+    error = 2 ** -(histogram.precision - 1)
+    for p in (1, 50, 90, 99, 99.9):
+        exact = values[int(p * len(values) / 100) - 1]
+        assert abs(histogram.percentile(p) - exact) <= error * exact + 1e-6
+
+
+def test_small_values_are_exact():
+    histogram = Histogram(unit=1)
+    for value in range(1, 101):
+        histogram.record(value)
+    assert histogram.percentile(50) == 50
+    assert histogram.percentile(100) == 100
+    assert histogram.mean() == 50.5
+
+
+def test_merge_adds_the_other_histogram():
+    first, second = Histogram(unit=1), Histogram(unit=1)
+    first.record(10, count=3)
+    second.record(1000)
+    first.merge(second)
+    assert first.count == 4
+    assert first.min == 10
+    assert first.max == 1000
+    assert first.percentile(75) == 10
+    assert first.percentile(100) == 1000
+
+
+def test_empty_histogram():
+    histogram = Histogram()
+    assert histogram.percentile(50) is None
+    assert histogram.mean() is None
+    assert histogram.summary() == {"count": 0}
+
+
+def test_registry_records_by_name():
+    metrics = MetricsRegistry()
+    metrics.count("sent")
+    metrics.count("sent", 2)
+    metrics.gauge("depth", 5)
+    metrics.observe("handler", 0.5)
+    assert metrics.counters == {"sent": 3}
+    assert metrics.gauges == {"depth": 5}
+    assert metrics.histograms["handler"].count == 1
+
+
+def test_merged_gauges_keep_the_highest_value():
+    first, second = MetricsRegistry(), MetricsRegistry()
+    first.count("sent", 2)
+    first.gauge("inbox_depth", 7)
+    second.count("sent", 3)
+    second.gauge("inbox_depth", 2)
+    second.gauge("congested_processes", 1)
+    merged = MetricsRegistry()
+    merged.merge(first)
+    merged.merge(second)
+    assert merged.counters == {"sent": 5}
+    assert merged.gauges == {"inbox_depth": 7, "congested_processes": 1}
+
+
+def test_collector_reports_each_processes_gauge():
+    collector = MetricsCollector()
+    for pid, depth in [(1, 4), (2, 9), (3, 0)]:
+        metrics = MetricsRegistry()
+        metrics.gauge("inbox_depth", depth)
+        collector.latest[pid] = metrics
+    assert collector.get_metrics().gauges == {"inbox_depth": 9}
+    assert collector.get_metrics([1, 3]).gauges == {"inbox_depth": 4}
+    assert collector.get_gauge("inbox_depth") == {1: 4, 2: 9, 3: 0}
+    assert collector.get_gauge("inbox_depth", [2]) == {2: 9}
+    assert collector.get_gauge("missing") == {}
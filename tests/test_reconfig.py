@@ -0,0 +1,101 @@
+"""
+Tests of weight changes ordered through consensus: the schedule of the
+configurations in effect, and how the reconfiguration window holds back the
+instances a proposer starts.
+"""
+
+from paxos import Proposer, SystemConfig
+from paxos.messages import ClientRequestMsg, PrepareMsg
+from paxos.reconfig import ConfigSchedule, Reconfiguration, MembershipChange
+
+from recording import RecordingMailbox
+
+WEIGHTS = {1: 1, 2: 1, 3: 1}
+
+
+def make_schedule(window):
+    return ConfigSchedule(WEIGHTS, 3, [4, 5], window)
+
+
+def test_change_takes_effect_alpha_instances_after_its_instance():
+    schedule = make_schedule(4)
+    new_weights = {1: 2, 2: 1, 3: 1}
+    schedule.record(3, Reconfiguration(new_weights))
+    assert schedule.weights_for(6) == (WEIGHTS, 3)
+    assert schedule.weights_for(7) == (new_weights, 4)
+    assert schedule.weights_for(100) == (new_weights, 4)
+
+
+def test_membership_change_takes_effect_alpha_instances_later():
+    schedule = make_schedule(2)
+    schedule.record(1, MembershipChange(add_acceptors=[6],
+                                        remove_acceptors=[1],
+                                        add_learners=[7]))
+    assert schedule.members_for(2) == ([1, 2, 3], [4, 5])
+    assert schedule.members_for(3) == ([2, 3, 6], [4, 5, 7])
+    # The new acceptor gets the mean weight of the current ones.
+    assert schedule.weights_for(3) == ({2: 1, 3: 1, 6: 1}, 3)
+
+
+def test_configuration_is_known_within_alpha_of_the_first_undecided():
+    schedule = make_schedule(2)
+    schedule.record(3, "c")
+    assert schedule.known(2)
+    assert not schedule.known(3)
+    schedule.record(1, "a")
+    schedule.record(2, "b")
+    assert schedule.first_undecided == 4
+    assert schedule.known(5)
+    assert not schedule.known(6)
+
+
+def make_proposer(window):
+    config = SystemConfig(1, 3, 2, reconfiguration_window=window,
+                          message_timeout=1)
+    proposer = Proposer(0, RecordingMailbox(config), None)
+    now = [0.0]
+    proposer.clock = lambda: now[0]
+    proposer.set_config(config)
+    return proposer, now
+
+
+def prepared_instances(proposer):
+    instances = sorted(set(msg.proposal.instance
+                           for _, msg in proposer.mailbox.sent
+                           if isinstance(msg, PrepareMsg)))
+    proposer.mailbox.sent = []
+    return instances
+
+
+def test_window_holds_back_instances_until_it_opens():
+    proposer, _ = make_proposer(2)
+    for value in "abc":
+        proposer.process_message(ClientRequestMsg(None, value))
+    assert prepared_instances(proposer) == [1, 2]
+    assert len(proposer.pending_requests) == 1
+    # Deciding instance 1 lets instance 3 start.
+    proposer.record_decision(1, "a")
+    assert prepared_instances(proposer) == [3]
+    assert not proposer.pending_requests
+
+
+def test_proposer_counts_quorums_with_the_new_weights_alpha_later():
+    proposer, _ = make_proposer(2)
+    weights = {1: 3, 2: 1, 3: 1}
+    proposer.record_decision(1, Reconfiguration(weights))
+    assert proposer.get_weights(2) == (proposer.config.weights, 3)
+    assert proposer.get_weights(3) == (weights, 5)
+
+
+def test_stalled_instance_is_retried_while_the_window_is_closed():
+    proposer, now = make_proposer(1)
+    proposer.process_message(ClientRequestMsg(None, "a"))
+    proposer.process_message(ClientRequestMsg(None, "b"))
+    assert prepared_instances(proposer) == [1]
+    # Not retried before two message timeouts.
+    proposer.process_timeout()
+    assert prepared_instances(proposer) == []
+    now[0] = 2.5
+    proposer.process_timeout()
+    assert prepared_instances(proposer) == [1]
+    assert len(proposer.pending_requests) == 1
@@ -0,0 +1,173 @@
+"""
+Tests of DecisionStream, ResultTable and SafetyChecker, and of feeding
+streams from the result loggers.
+"""
+
+from threading import Thread
+
+from paxos import SystemConfig
+from paxos.results import DecisionStream, ResultTable, SafetyChecker
+from paxos.sim import ResultLogger
+from paxos.sim_discrete import DiscreteEventSystem
+
+
+def test_stream_orders_decisions():
+    stream = DecisionStream(3)
+    for instance in [2, 1, 4, 3]:
+        stream.put(instance, instance * 10)
+    stream.close()
+    assert list(stream) == [(1, 10), (2, 20), (3, 30), (4, 40)]
+
+
+def test_stream_holds_back_results_after_a_gap():
+    stream = DecisionStream(3)
+    stream.put(2, "b")
+    stream.close()
+    assert list(stream) == []
+
+
+def test_stream_orders_each_group_by_its_own_sequence():
+    stream = DecisionStream(3, num_groups=2)
+    # Group 1 (instances 2, 4, ...) got no requests.
+    for instance in [3, 1, 5]:
+        stream.put(instance, instance)
+    stream.put(4, 4)
+    stream.put(2, 2)
+    stream.close()
+    assert list(stream) == [(1, 1), (3, 3), (5, 5), (2, 2), (4, 4)]
+
+
+def test_table_counts_the_instances_of_each_groups_requests():
+    table = ResultTable([4, 5], 3, num_groups=2)
+    table.record(4, 1, "a")
+    table.count_request(0)
+    table.count_request(0)
+    table.count_request(0)
+    # Requests beyond the third aren't counted.
+    table.count_request(1)
+    for pid in [4, 5]:
+        table.record(pid, 3, "b")
+        table.record(pid, 5, "c")
+    table.record(4, 2, "d")
+    assert list(table.counted_instances()) == [1, 3, 5]
+    counts = table.counts()
+    assert counts["learned"] == 5
+    assert counts["complete"] == 2
+    assert counts["incomplete"] == 1
+    assert counts["empty"] == 0
+
+
+def test_requests_of_one_group_are_all_counted():
+    config = SystemConfig(2, 3, 2, num_groups=2, num_test_requests=10)
+    system = DiscreteEventSystem(config)
+    stream = system.logger.subscribe(config.learner_ids[0])
+    system.start()
+    for x in range(10):
+        system.submit(x, key="same")
+    system.shutdown_agents()
+    system.quit()
+    counts = system.logger.table.counts()
+    assert counts["complete"] == 10
+    assert counts["missing"] == 0
+    assert len(list(stream)) == 10
+
+
+def test_unread_stream_does_not_block_the_simulation():
+    config = SystemConfig(1, 3, 2)
+    system = DiscreteEventSystem(config)
+    stream = system.logger.subscribe(config.learner_ids[0], maxsize=5)
+    system.start()
+    for x in range(20):
+        system.submit(x + 1)
+    system.shutdown_agents()
+    system.quit()
+    assert not system.logger.outstanding
+    decisions = list(stream)
+    assert [instance for instance, _ in decisions] == list(range(1, 21))
+    assert sorted(value for _, value in decisions) == list(range(1, 21))
+
+
+def test_quit_releases_a_logger_waiting_for_an_unread_stream():
+    logger = ResultLogger(SystemConfig(1, 3, 2))
+    thread = Thread(target=logger.run)
+    thread.start()
+    stream = logger.subscribe(4, maxsize=2)
+    for instance in range(1, 11):
+        logger.log_result(4, instance, instance)
+    # The logger thread waits for the stream, but subscribing, which takes
+    # the lock, doesn't.
+    logger.subscribe(5)
+    # As in System.quit.
+    logger.close_streams()
+    logger.log_result("quit", None, None)
+    thread.join(5)
+    assert not thread.is_alive()
+    assert len(list(stream)) == 10
+
+
+def test_duplicate_submissions_are_each_tracked():
+    logger = ResultLogger(SystemConfig(1, 3, 2))
+    logger.expect("x")
+    logger.expect("x")
+    assert logger.num_outstanding == 2
+    # Learning one instance of the value completes one of the submissions.
+    logger.record(4, 1, "x")
+    logger.record(5, 1, "x")
+    assert logger.num_outstanding == 1
+    # A learner logging an instance again doesn't count.
+    logger.record(4, 1, "x")
+    assert logger.num_outstanding == 1
+    logger.record(4, 2, "x")
+    logger.record(5, 2, "x")
+    assert not logger.outstanding
+    assert logger.wait_done(0)
+
+
+def test_retired_learner_is_no_longer_waited_for():
+    logger = ResultLogger(SystemConfig(1, 3, 2))
+    logger.expect("x")
+    logger.record(4, 1, "x")
+    assert not logger.wait_done(0)
+    logger.remove_learner(5)
+    assert logger.wait_done(0)
+    # Nor for the values submitted after it left.
+    logger.expect("y")
+    logger.record(4, 2, "y")
+    assert logger.wait_done(0)
+
+
+def test_added_learner_is_waited_for():
+    logger = ResultLogger(SystemConfig(1, 3, 2, num_spare=1))
+    logger.add_learner(6)
+    logger.expect("x")
+    logger.record(4, 1, "x")
+    logger.record(5, 1, "x")
+    assert not logger.wait_done(0)
+    logger.record(6, 1, "x")
+    assert logger.wait_done(0)
+
+
+def test_checker_forgets_instances_out_of_the_window():
+    checker = SafetyChecker([4, 5], window=2)
+    for instance in range(1, 6):
+        checker.check_decision(4, instance, instance)
+        checker.check_decision(5, instance, instance)
+    assert checker.pruned_below == [4]
+    assert sorted(checker.chosen) == [4, 5]
+    # A late decision in a forgotten instance is only counted.
+    assert checker.check_decision(4, 1, "other")
+    assert checker.unchecked == 1
+    assert not checker.check_decision(4, 5, "other")
+    assert not checker.consistent
+
+
+def test_checker_forgets_each_groups_instances_along_its_sequence():
+    checker = SafetyChecker([4, 5], window=2, num_groups=2)
+    # Group 1 gets a single request, group 0 gets ten.
+    instances = [1, 2] + [number * 2 + 1 for number in range(1, 10)]
+    for instance in instances:
+        checker.check_decision(4, instance, instance)
+        checker.check_decision(5, instance, instance)
+    assert checker.complete_below == [21, 4]
+    assert checker.pruned_below == [17, 2]
+    assert sorted(checker.chosen) == [2, 17, 19]
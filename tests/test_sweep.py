@@ -0,0 +1,37 @@
+"""
+Tests of the resumable sweep runner.
+"""
+
+import csv
+import os
+
+from paxos.sweep import Run, run_sweep
+
+
+def read_rows(filename):
+    with open(filename, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def test_sweep_resumes_without_rerunning_finished_runs(tmp_path, capsys):
+    filename = str(tmp_path / "sweep.csv")
+    output_dir = str(tmp_path / "output")
+    runs = [Run(3, 0.0, num_requests=5), Run(3, 0.2, num_requests=5)]
+    run_sweep(runs[:1], filename, output_dir, processes=1)
+    [row] = read_rows(filename)
+    assert row["run"] == runs[0].run_id
+    log = os.path.join(output_dir, runs[0].run_id + ".log")
+    finished_at = os.stat(log).st_mtime_ns
+
+    run_sweep(runs, filename, output_dir, processes=2)
+    assert "2 runs, 1 already done" in capsys.readouterr().out
+    rows = read_rows(filename)
+    assert [row["run"] for row in rows] == [run.run_id for run in runs]
+    assert os.stat(log).st_mtime_ns == finished_at
+    assert sorted(os.listdir(output_dir)) == \
+        sorted(run.run_id + ".log" for run in runs)
+
+    # Nothing is left to run.
+    run_sweep(runs, filename, output_dir)
+    assert "2 runs, 2 already done" in capsys.readouterr().out
+    assert len(read_rows(filename)) == 2
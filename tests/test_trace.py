@@ -0,0 +1,53 @@
+"""
+Tests of recording, merging and analyzing protocol traces.
+"""
+
+import os
+
+from paxos.sim_discrete import run_test
+from paxos.sim_failure import FailTestSystemConfig
+from paxos.trace import (InstanceTimeline, HEADER, read_trace, merge_traces,
+                         analyze, print_critical_path)
+
+
+def test_simulated_run_is_recorded_merged_and_analyzed(tmp_path):
+    trace_dir = str(tmp_path)
+    config = FailTestSystemConfig(1, 3, 2, num_test_requests=20,
+                                  trace_dir=trace_dir)
+    run_test(config)
+    names = sorted(os.listdir(trace_dir))
+    assert "trace-mailbox.bin" in names
+    assert len(names) == 1 + config.num_processes
+    records = merge_traces(trace_dir)
+    assert [r.time for r in records] == sorted(r.time for r in records)
+    timelines = analyze(records)
+    assert sorted(timelines) == list(range(1, 21))
+    for t in timelines.values():
+        assert sorted(t.learned) == config.learner_ids
+        phases = t.phases()
+        assert phases["total"] >= phases["learn"] > 0
+
+
+def test_file_without_a_header_has_no_records(tmp_path):
+    path = str(tmp_path / "trace-1.bin")
+    for size in (0, HEADER.size - 1):
+        with open(path, 'wb') as f:
+            f.write(b"P" * size)
+        assert read_trace(path) == []
+
+
+def test_critical_path_is_printed_in_time_order(capsys):
+    t = InstanceTimeline(1)
+    t.prepare_sent = 0
+    t.prepare_critical = (2, 1000000, 2000000)
+    t.accept_sent = 3000000
+    # The first learner received the deciding accept response before the
+    # proposer chose the value.
+    t.accept_critical = (3, 4000000, 5000000)
+    t.chosen = 6000000
+    t.learned = {5: 7000000, 4: 5000000}
+    print_critical_path(t)
+    lines = capsys.readouterr().out.splitlines()
+    assert [line[2:21].rstrip() for line in lines[1:]] == [
+        "prepare sent", "promise from   2", "accept sent",
+        "accepted by   3", "learned by   4", "chosen", "learned by   5"]
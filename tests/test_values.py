@@ -0,0 +1,65 @@
+"""
+Tests of ValueStore and ValueHandle.
+"""
+
+import os
+import pickle
+
+from paxos.values import ValueHandle, ValueStore, resolve
+
+
+def test_large_value_is_stored_once_and_resolved(tmp_path):
+    store = ValueStore(64, str(tmp_path))
+    value = {"key": "x" * 100}
+    handle = store.wrap(value)
+    assert isinstance(handle, ValueHandle)
+    assert store.wrap(dict(value)) == handle
+    assert os.listdir(str(tmp_path)) == [handle.digest]
+    assert handle.resolve() == value
+    assert resolve(handle) == value
+
+
+def test_resolved_value_is_not_sent(tmp_path):
+    store = ValueStore(64, str(tmp_path))
+    handle = store.wrap("x" * 100)
+    handle.resolve()
+    sent = pickle.loads(pickle.dumps(handle))
+    assert sent.value is None and not sent.resolved
+    assert sent.resolve() == "x" * 100
+
+
+def test_bytes_are_stored_as_is(tmp_path):
+    store = ValueStore(64, str(tmp_path))
+    data = bytes(range(100))
+    handle = store.wrap(data)
+    assert handle.raw and handle.size == len(data)
+    assert handle.view() == data
+    assert handle.resolve() == data
+    # The same bytes pickled are a different value.
+    assert store.put(data) != handle
+
+
+def test_handles_compare_and_hash_by_digest(tmp_path):
+    store = ValueStore(64, str(tmp_path))
+    handle = store.wrap("x" * 100)
+    other = ValueHandle(handle.digest, 0, "elsewhere")
+    assert other == handle
+    assert len({handle, other}) == 1
+    assert store.wrap("y" * 100) != handle
+    assert handle != handle.digest
+
+
+def test_small_values_pass_through(tmp_path):
+    store = ValueStore(64, str(tmp_path))
+    assert store.wrap("small") == "small"
+    assert store.wrap(b"small") == b"small"
+    assert resolve("small") == "small"
+    assert not os.listdir(str(tmp_path))
+
+
+def test_temporary_store_is_removed_on_close():
+    store = ValueStore(1)
+    handle = store.wrap("value")
+    assert os.path.exists(handle.path)
+    store.close()
+    assert not os.path.exists(store.directory)